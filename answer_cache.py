@@ -0,0 +1,102 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+class SemanticAnswerCache:
+    """Reuses answers for questions that are worded differently but mean the same.
+
+    An entry is keyed on the question embedding and scoped by the ids of the
+    chunks retrieved for it, so a hit requires both a cosine similarity of at
+    least ``threshold`` and the same retrieved context (in any order). When the knowledge
+    base changes the retrieval changes, and old entries simply stop matching.
+    """
+
+    def __init__(self, threshold=None, ttl=None, max_entries=None):
+        self.threshold = float(threshold or os.getenv('ANSWER_CACHE_THRESHOLD', 0.95))
+        self.ttl = float(ttl or os.getenv('ANSWER_CACHE_TTL', 24 * 3600))
+        self.max_entries = int(max_entries or os.getenv('ANSWER_CACHE_MAX_ENTRIES', 2048))
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # entry id -> (scope, unit vector, answer, latency, created)
+        self._by_scope = {}  # scope -> set of entry ids
+        self._next_id = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def lookup(self, embedding, scope):
+        """Return the cached answer for a similar question with the same scope, or None."""
+        vector = self._normalize(embedding)
+        scope = self._scope_key(scope)
+        now = time.time()
+        with self._lock:
+            best_id, best_score = None, self.threshold
+            for entry_id in list(self._by_scope.get(scope, ())):
+                _, cached_vector, _, _, created = self._entries[entry_id]
+                if now - created > self.ttl:
+                    self._remove(entry_id)
+                    continue
+                score = float(np.dot(vector, cached_vector))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            _, _, answer, latency, _ = self._entries[best_id]
+            self.hits += 1
+            self.saved_seconds += latency
+            return answer
+
+    def store(self, embedding, scope, answer, latency):
+        """Cache an answer; latency is what a future hit will save."""
+        vector = self._normalize(embedding)
+        scope = self._scope_key(scope)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (scope, vector, answer, latency, time.time())
+            self._by_scope.setdefault(scope, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'saved_seconds': self.saved_seconds,
+                'threshold': self.threshold,
+            }
+
+    def _remove(self, entry_id):
+        scope = self._entries.pop(entry_id)[0]
+        ids = self._by_scope.get(scope)
+        if ids is not None:
+            ids.discard(entry_id)
+            if not ids:
+                del self._by_scope[scope]
+
+    @staticmethod
+    def _scope_key(scope):
+        # The same chunks retrieved in a different order are the same context
+        return tuple(sorted(scope))
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
@@ -0,0 +1,87 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Per-route defaults: (concurrent requests, threads for blocking SDK calls).
+# Uploads get their own small pool so bulk ingestion cannot starve chat.
+ROUTE_DEFAULTS = {
+    'chat': (32, 16),
+    'upload': (2, 2),
+}
+
+_executors = {}
+_executors_lock = threading.Lock()
+_sessions = {}
+_in_flight = defaultdict(int)
+
+
+def concurrency_limit(route):
+    """Number of concurrent requests Gradio should run for a route (env: CHAT_CONCURRENCY, ...)."""
+    return int(os.getenv(f'{route.upper()}_CONCURRENCY', ROUTE_DEFAULTS[route][0]))
+
+
+def get_executor(route):
+    """Bounded thread pool for the blocking SDK calls of a route (env: CHAT_THREADS, ...)."""
+    with _executors_lock:
+        executor = _executors.get(route)
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv(f'{route.upper()}_THREADS', ROUTE_DEFAULTS[route][1])),
+                thread_name_prefix=f'{route}-blocking')
+            _executors[route] = executor
+        return executor
+
+
+async def run_blocking(route, fn, *args, **kwargs):
+    """Run a blocking call on the route's thread pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    # Run in a copy of the caller's context so tracing spans nest across threads
+    context = contextvars.copy_context()
+    with _executors_lock:
+        _in_flight[route] += 1
+    try:
+        return await loop.run_in_executor(get_executor(route), functools.partial(context.run, fn, *args, **kwargs))
+    finally:
+        with _executors_lock:
+            _in_flight[route] -= 1
+
+
+def in_flight(route):
+    """Blocking calls of a route that are queued or running, e.g. to let background work yield to chat."""
+    return _in_flight[route]
+
+
+async def iterate_blocking(route, iterable):
+    """Consume a blocking iterator (e.g. a streaming SDK response) from async code."""
+    iterator = iter(iterable)
+    sentinel = object()
+    while True:
+        item = await run_blocking(route, next, iterator, sentinel)
+        if item is sentinel:
+            return
+        yield item
+
+
+def get_session():
+    """Shared aiohttp session (and connection pool) for the running event loop."""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        timeout = float(os.getenv('HTTP_POOL_TIMEOUT', 30))
+        # No total timeout: it would cut long SSE answers off mid-stream. A stalled
+        # connection is caught by the time allowed between reads instead.
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=int(os.getenv('HTTP_POOL_SIZE_ASYNC', 100))),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout * 2))
+        _sessions[loop] = session
+    return session
@@ -1,8 +1,13 @@
 import os
+import subprocess
+import wave
 from pydub import AudioSegment
 from datetime import datetime
 import io
 
+# 1 second of 16 kHz mono s16le audio
+DEFAULT_CHUNK_SIZE = 32000
+
 def convert_audio_to_wav(input_file_path, save_to_file=False, sample_rate=16000):
     """Convert audio file to PCM WAV format. Save or return the audio data."""
     
@@ -25,15 +30,86 @@ def convert_audio_to_wav(input_file_path, save_to_file=False, sample_rate=16000)
         # Create audio directory if it doesn't exist
         os.makedirs('audio', exist_ok=True)
 
-        # Export as WAV file, ensuring PCM 16-bit mono
+        # Export as WAV file once, ensuring PCM 16-bit mono, and read it back
         audio.export(output_file_path, format='wav', codec='pcm_s16le')
         print(f"Converted audio saved as: {output_file_path}")
+        with open(output_file_path, 'rb') as f:
+            return f.read()
 
-    # Save to memory and return as byte stream
+    # Save to memory and return the buffer without an extra copy
     byte_io = io.BytesIO()
     audio.export(byte_io, format='wav', codec='pcm_s16le')
-    byte_io.seek(0)  # Rewind the byte stream
-    return byte_io.read()  # Return the byte content
+    return byte_io.getbuffer().tobytes()
+
+
+def is_target_pcm_wav(input_file_path, sample_rate=16000):
+    """Return True if the file is already a 16-bit mono PCM WAV at sample_rate."""
+    try:
+        with wave.open(input_file_path, 'rb') as wav:
+            return (wav.getcomptype() == 'NONE' and wav.getnchannels() == 1
+                    and wav.getsampwidth() == 2 and wav.getframerate() == sample_rate)
+    except (wave.Error, EOFError):
+        return False
+
+
+def audio_duration(input_file_path):
+    """Duration in seconds from the WAV header, or from ffprobe for other formats; None if unknown."""
+    try:
+        with wave.open(input_file_path, 'rb') as wav:
+            return wav.getnframes() / wav.getframerate()
+    except (wave.Error, EOFError):
+        pass
+    from pydub.utils import mediainfo
+    try:
+        return float(mediainfo(input_file_path)['duration'])
+    except (KeyError, ValueError, OSError):
+        return None
+
+
+def stream_audio_to_pcm(input_file_path, sample_rate=16000, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield raw mono s16le PCM at sample_rate in chunks of chunk_size bytes.
+
+    WAV files already in the target format are read frame by frame without
+    decoding or resampling. Anything else is decoded by ffmpeg into a pipe, so
+    memory use stays flat regardless of the recording length.
+    """
+    if not os.path.isfile(input_file_path):
+        raise FileNotFoundError(f"The file '{input_file_path}' does not exist.")
+
+    if is_target_pcm_wav(input_file_path, sample_rate):
+        with wave.open(input_file_path, 'rb') as wav:
+            frames_per_chunk = max(chunk_size // 2, 1)
+            while True:
+                chunk = wav.readframes(frames_per_chunk)
+                if not chunk:
+                    break
+                yield chunk
+        return
+
+    # Use the same ffmpeg binary pydub is configured with
+    command = [
+        AudioSegment.converter, '-nostdin', '-loglevel', 'error',
+        '-i', input_file_path,
+        '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(sample_rate),
+        'pipe:1',
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        while True:
+            chunk = process.stdout.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        stderr = process.stderr.read()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to decode '{input_file_path}': "
+                               f"{stderr.decode(errors='replace').strip()}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
 
 if __name__ == "__main__":
     # Example usage: Change these variables as needed
@@ -0,0 +1,138 @@
+import numpy as np
+
+
+def _frame_rms(samples, frame_len):
+    n_frames = -(-len(samples) // frame_len)
+    frames = np.zeros(n_frames * frame_len, dtype=np.float32)
+    frames[:len(samples)] = samples
+    return np.sqrt(np.mean(frames.reshape(n_frames, frame_len) ** 2, axis=1))
+
+
+def estimate_noise_floor(rms):
+    return float(np.percentile(rms, 10)) if len(rms) else 0.0
+
+
+def detect_speech_segments(pcm, sample_rate=16000, frame_ms=30,
+                           threshold_ratio=3.0, min_energy=300.0,
+                           min_silence_ms=400, min_speech_ms=200,
+                           max_segment_seconds=50, padding_ms=150, noise_floor=None):
+    """Split raw mono s16le PCM on silence using frame energy.
+
+    A frame counts as speech when its RMS is ``threshold_ratio`` times above
+    the estimated noise floor (and above ``min_energy``). Speech runs separated
+    by at least ``min_silence_ms`` of silence become separate segments, and a
+    segment longer than ``max_segment_seconds`` is cut at its quietest frame.
+    The noise floor is estimated from ``pcm`` unless given.
+    Returns a list of (start_sample, end_sample) tuples in order.
+    """
+    samples = np.frombuffer(pcm, dtype='<i2')
+    frame_len = max(sample_rate * frame_ms // 1000, 1)
+    rms = _frame_rms(samples, frame_len)
+    n_frames = len(rms)
+    if n_frames == 0:
+        return []
+
+    if noise_floor is None:
+        noise_floor = estimate_noise_floor(rms)
+    threshold = max(noise_floor * threshold_ratio, min_energy)
+    is_speech = rms > threshold
+
+    padding = padding_ms // frame_ms
+    min_silence = max(min_silence_ms // frame_ms, 1)
+    min_speech = max(min_speech_ms // frame_ms, 1)
+    # Leave room for padding on both sides within the length cap
+    max_frames = max(int(max_segment_seconds * 1000 // frame_ms) - 2 * padding, min_speech)
+
+    spans = []
+    start = None
+    silence = 0
+    for i in range(n_frames):
+        if is_speech[i]:
+            if start is None:
+                start = i
+            silence = 0
+        elif start is not None:
+            silence += 1
+            if silence >= min_silence:
+                spans.append((start, i - silence + 1))
+                start = None
+                silence = 0
+
+        if start is not None and i + 1 - start >= max_frames:
+            # Cut at the quietest frame in the last third of the window
+            window_start = start + 2 * max_frames // 3
+            cut = window_start + int(np.argmin(rms[window_start:i + 1])) + 1
+            spans.append((start, cut))
+            start = cut if cut <= i else None
+            silence = 0
+
+    if start is not None:
+        spans.append((start, n_frames - silence))
+
+    segments = []
+    previous_end = 0
+    for span_start, span_end in spans:
+        if span_end - span_start < min_speech:
+            continue
+        seg_start = max((span_start - padding) * frame_len, previous_end)
+        seg_end = min((span_end + padding) * frame_len, len(samples))
+        if seg_end > seg_start:
+            segments.append((seg_start, seg_end))
+            previous_end = seg_end
+    return segments
+
+
+def stream_speech_segments(chunks, sample_rate=16000, max_segment_seconds=50, guard_seconds=1.0, **vad_options):
+    """Yield (start_sample, pcm bytes) speech segments from an iterator of PCM chunks.
+
+    The audio is scanned in windows of about twice ``max_segment_seconds``.
+    Segments that end before the last ``guard_seconds`` of a window are
+    complete and yielded; the rest of the window is carried into the next
+    one, so at most about one window of audio is held in memory. The noise
+    floor is the lowest seen in any window so far, so a window of continuous
+    speech is not mistaken for background noise.
+    """
+    if max_segment_seconds <= 0:
+        raise ValueError(f"max_segment_seconds must be positive, got {max_segment_seconds}")
+    frame_len = max(sample_rate * vad_options.get('frame_ms', 30) // 1000, 1)
+    noise_floor = None
+    max_segment_samples = max(int(max_segment_seconds * sample_rate), 1)
+    window_bytes = 2 * max_segment_samples * 2
+    # A guard as long as a segment would carry every segment over forever
+    guard = min(int(guard_seconds * sample_rate), max_segment_samples // 2)
+    chunks = iter(chunks)
+    buffer = bytearray()
+    offset = 0  # sample index of buffer[0]
+    ended = False
+    while not ended or buffer:
+        while not ended and len(buffer) < window_bytes:
+            chunk = next(chunks, None)
+            if chunk is None:
+                ended = True
+            else:
+                buffer += chunk
+        usable = len(buffer) // 2
+        if usable == 0:
+            break
+        window = bytes(buffer[:usable * 2])
+        estimate = estimate_noise_floor(_frame_rms(np.frombuffer(window, dtype='<i2'), frame_len))
+        noise_floor = estimate if noise_floor is None else min(noise_floor, estimate)
+        spans = detect_speech_segments(window, sample_rate=sample_rate, max_segment_seconds=max_segment_seconds,
+                                       noise_floor=noise_floor, **vad_options)
+        carry_from = usable if ended else max(usable - guard, 0)
+        for start, end in spans:
+            if not ended and end > usable - guard:
+                if start == 0 and len(buffer) >= window_bytes:
+                    # Nothing would be dropped and nothing more fits: cut it here
+                    # rather than scan the same window again
+                    yield offset, bytes(buffer[:end * 2])
+                    carry_from = end
+                    break
+                # May continue past the window; look at it again with more audio
+                carry_from = start
+                break
+            yield offset + start, bytes(buffer[start * 2:end * 2])
+        if ended:
+            break
+        del buffer[:carry_from * 2]
+        offset += carry_from
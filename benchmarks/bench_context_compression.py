@@ -0,0 +1,91 @@
+"""Prompt tokens and content_query latency with and without context compression.
+
+Starts a fake DashScope server whose time to first token grows with the
+prompt length (--prefill-per-1k-tokens), ingests a generated knowledge base
+of short sentences into the local vector store and asks the same questions
+with context compression off, with the lexical scorer and with the
+embedding scorer. Reports the prompt context tokens per query, the
+compression time and the content_query latency, and the latency saved
+against no compression.
+
+    python benchmarks/bench_context_compression.py --requests 50 --budget 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_e2e import WORDS, configure_environment, question  # noqa: E402
+from fake_servers import FakeASRHandler, FakeDashScopeHandler, FakeOSSHandler, FakeServer  # noqa: E402
+
+
+def write_corpus(path, files, paragraphs, rng):
+    """Paragraphs of short sentences, so a chunk mixes relevant and unrelated ones."""
+    os.makedirs(path)
+    for i in range(files):
+        text = "\n\n".join(
+            ' '.join(' '.join(rng.choice(WORDS, rng.integers(8, 16))).capitalize() + f" doc{i}p{j}s{k}."
+                     for k in range(6))
+            for j in range(paragraphs))
+        with open(os.path.join(path, f"doc{i}.txt"), 'w') as f:
+            f.write(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--files', type=int, default=10, help='documents in the knowledge base')
+    parser.add_argument('--paragraphs', type=int, default=20, help='paragraphs per document')
+    parser.add_argument('--dimension', type=int, default=256)
+    parser.add_argument('--budget', type=int, default=200, help='CONTEXT_TOKEN_BUDGET')
+    parser.add_argument('--chat-ttft', type=float, default=0.2)
+    parser.add_argument('--prefill-per-1k-tokens', type=float, default=0.3,
+                        help='s of time to first token per 1000 prompt tokens')
+    parser.add_argument('--answer-tokens', type=int, default=20)
+    parser.add_argument('--token-interval', type=float, default=0.01)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    dashscope_server = FakeServer(FakeDashScopeHandler, chat_ttft=args.chat_ttft,
+                                  prefill_per_1k_tokens=args.prefill_per_1k_tokens,
+                                  token_interval=args.token_interval, answer_tokens=args.answer_tokens,
+                                  embed_latency=0.01, dimension=args.dimension)
+    with tempfile.TemporaryDirectory() as work_dir, dashscope_server, \
+            FakeServer(FakeASRHandler) as asr_server, FakeServer(FakeOSSHandler) as oss_server:
+        configure_environment(work_dir, dashscope_server, asr_server, oss_server, args)
+        os.environ['CONTEXT_TOKEN_BUDGET'] = str(args.budget)
+        from context_compression import ContextCompressor
+        from services import get_solver
+
+        solver = get_solver()
+        write_corpus(os.path.join(work_dir, 'docs'), args.files, args.paragraphs, rng)
+        solver.upload_directory(os.path.join(work_dir, 'docs'))
+        questions = [question(rng) for _ in range(args.requests)]
+
+        print(f"\n{'mode':<12} {'ctx tokens':>10} {'compress ms':>12} {'p50 ms':>8} {'mean ms':>8} {'saved ms':>9}")
+        baseline = None
+        for mode, enabled, scorer in (('off', False, 'lexical'), ('lexical', True, 'lexical'),
+                                      ('embedding', True, 'embedding')):
+            solver.context_compressor = ContextCompressor(solver.vector_db.embeddings, scorer=scorer,
+                                                          enabled=enabled)
+            latencies = []
+            for text in questions:
+                start = time.perf_counter()
+                solver.content_query(text, [])
+                latencies.append(time.perf_counter() - start)
+            latencies = np.asarray(latencies) * 1000
+            baseline = latencies.mean() if baseline is None else baseline
+            stats = solver.context_compressor.stats()
+            print(f"{mode:<12} {stats['tokens_after'] / stats['queries']:>10.0f} "
+                  f"{stats['compress_seconds_mean'] * 1000:>12.2f} {np.percentile(latencies, 50):>8.1f} "
+                  f"{latencies.mean():>8.1f} {baseline - latencies.mean():>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""Offline end-to-end latency of the chat pipeline against local fake services.
+
+Starts fake DashScope (chat, embeddings, Qwen-VL), NLS and OSS servers with
+configurable latency and payload sizes, points the app at them through its
+environment variables and uses the local memory-mapped vector store in a
+temporary directory instead of AnalyticDB. It then drives the real code
+paths at each concurrency level:
+
+- content_query (with its retrieve and llm stages)
+- audio_transcription
+- upload_image_to_oss
+- process_input with text, an image, an audio file, several images and an
+  image plus a spoken question (time to first response and total)
+
+and reports p50/p95/p99 latency per stage.
+
+    python benchmarks/bench_e2e.py --requests 40 --concurrency 1 8 32
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import wave
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_servers import FakeASRHandler, FakeDashScopeHandler, FakeOSSHandler, FakeServer  # noqa: E402
+
+WORDS = ("cloud compute storage network database model training inference cluster "
+         "region bucket instance gpu latency throughput billing security backup").split()
+
+
+class LatencyRecorder:
+    """Thread-safe latency samples and error counts per stage."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def error(self, stage):
+        with self._lock:
+            self.errors[stage] += 1
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.error(stage)
+            raise
+        self.record(stage, time.perf_counter() - start)
+
+    def report(self, title):
+        print(f"\n{title}")
+        print(f"{'stage':<28} {'n':>5} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'mean ms':>9}")
+        for stage in sorted(set(self.samples) | set(self.errors)):
+            samples = np.asarray(self.samples.get(stage, [0.0])) * 1000
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            print(f"{stage:<28} {len(self.samples.get(stage, [])):>5} {self.errors[stage]:>4} "
+                  f"{p50:>9.1f} {p95:>9.1f} {p99:>9.1f} {samples.mean():>9.1f}")
+
+
+class TimedLLM:
+    """Proxy for the chat model that records the latency of invoke()."""
+
+    def __init__(self, llm, recorder):
+        self._llm = llm
+        self._recorder = recorder
+
+    def invoke(self, *args, **kwargs):
+        with self._recorder.time('  llm'):
+            return self._llm.invoke(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._llm, name)
+
+
+def instrument(obj, name, recorder, stage):
+    method = getattr(obj, name)
+
+    def timed(*args, **kwargs):
+        with recorder.time(stage):
+            return method(*args, **kwargs)
+    setattr(obj, name, timed)
+
+
+def configure_environment(work_dir, dashscope, asr, oss, args):
+    """Point every backend at the fake servers and keep all state in work_dir."""
+    token_cache = os.path.join(work_dir, 'nls_token.json')
+    with open(token_cache, 'w') as f:
+        json.dump({'token': 'fake-token', 'expire_time': int(time.time()) + 86400}, f)
+    os.environ.update({
+        'DASHSCOPE_API_KEY': 'fake',
+        'DASHSCOPE_HTTP_BASE_URL': f"http://{dashscope.host}/api/v1",
+        'EMBEDDING_MODEL': 'text-embedding-v2',
+        'EMBEDDING_DIMENSION': str(args.dimension),
+        'VECTOR_STORE': 'local',
+        'LOCAL_VECTOR_STORE_PATH': os.path.join(work_dir, 'vector_store'),
+        'EMBEDDING_CACHE_PATH': os.path.join(work_dir, 'embeddings.sqlite'),
+        'INGEST_MANIFEST': os.path.join(work_dir, 'manifest.sqlite'),
+        'LEXICAL_INDEX_PATH': os.path.join(work_dir, 'bm25.json.gz'),
+        'DEDUP_INDEX': os.path.join(work_dir, 'dedup.sqlite'),
+        # Every question is new; keep the semantic answer cache out of the numbers
+        'ANSWER_CACHE_THRESHOLD': '2',
+        # The same audio file (and question) is sent every time, so the ASR and
+        # Qwen-VL result caches would only measure cache hits
+        'ASR_CACHE_ENABLED': 'false',
+        'VL_CACHE_ENABLED': 'false',
+        'ALIBABA_NLS_GATEWAY': asr.host,
+        'ALIBABA_NLS_APP_KEY': 'fake',
+        'NLS_TOKEN_CACHE_PATH': token_cache,
+        'ALIBABA_ACCESS_KEY_ID': 'fake',
+        'ALIBABA_ACCESS_KEY_SECRET': 'fake',
+        'OSS_ENDPOINT': oss.host,
+        'OSS_BUCKET_NAME': 'bench',
+        'OSS_UPLOAD_INDEX': os.path.join(work_dir, 'uploaded_keys.txt'),
+        'WARM_UP': 'false',
+    })
+    # The UI stages uploads and images under the working directory
+    os.chdir(work_dir)
+
+
+def write_corpus(path, files, paragraphs, rng):
+    os.makedirs(path)
+    for i in range(files):
+        text = "\n\n".join(' '.join(rng.choice(WORDS, 60)) + f" doc{i}p{j}." for j in range(paragraphs))
+        with open(os.path.join(path, f"doc{i}.txt"), 'w') as f:
+            f.write(text)
+
+
+def write_audio(path, seconds, sample_rate=16000):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    samples = (8000 * np.sin(2 * np.pi * 220 * t)).astype('<i2')
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(samples.tobytes())
+
+
+def write_image(path, size, rng):
+    from PIL import Image
+    # Noise makes every image unique, so none is skipped as already uploaded
+    Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8)).save(path, quality=90)
+
+
+def question(rng):
+    return "What about " + ' '.join(rng.choice(WORDS, 6)) + "?"
+
+
+def report_errors(fn):
+    """Keep going when a request fails (the recorder counts it); print the first failure."""
+    reported = []
+
+    def wrapper(item):
+        try:
+            return fn(item)
+        except Exception as e:
+            if not reported:
+                reported.append(e)
+                print(f"{fn.__name__} failed: {e!r}")
+    return wrapper
+
+
+def run_sync(fn, items, concurrency):
+    fn = report_errors(fn)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(fn, items))
+
+
+def run_async(fn, items, concurrency):
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+        reported = []
+
+        async def bounded(item):
+            async with semaphore:
+                try:
+                    await fn(item)
+                except Exception as e:
+                    if not reported:
+                        reported.append(e)
+                        print(f"{fn.__name__} failed: {e!r}")
+        await asyncio.gather(*(bounded(item) for item in items))
+    asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=40, help='requests per stage and concurrency level')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--files', type=int, default=20, help='documents in the knowledge base')
+    parser.add_argument('--paragraphs', type=int, default=20, help='paragraphs per document')
+    parser.add_argument('--dimension', type=int, default=1536)
+    parser.add_argument('--chat-ttft', type=float, default=0.3)
+    parser.add_argument('--vl-ttft', type=float, default=0.8)
+    parser.add_argument('--token-interval', type=float, default=0.02)
+    parser.add_argument('--answer-tokens', type=int, default=100)
+    parser.add_argument('--embed-latency', type=float, default=0.05)
+    parser.add_argument('--asr-latency', type=float, default=0.3)
+    parser.add_argument('--asr-realtime-factor', type=float, default=0.1)
+    parser.add_argument('--audio-seconds', type=float, default=5)
+    parser.add_argument('--oss-latency', type=float, default=0.03)
+    parser.add_argument('--oss-bandwidth', type=float, default=50e6, help='bytes/s, 0 for unlimited')
+    parser.add_argument('--image-size', type=int, default=1024, help='pixels per side')
+    parser.add_argument('--images-per-message', type=int, default=3,
+                        help='images in the multi-image process_input messages')
+    parser.add_argument('--stages', nargs='+',
+                        default=['content_query', 'audio', 'oss', 'process_input'],
+                        choices=['content_query', 'audio', 'oss', 'process_input'])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    dashscope_server = FakeServer(FakeDashScopeHandler, chat_ttft=args.chat_ttft, vl_ttft=args.vl_ttft,
+                                  token_interval=args.token_interval, answer_tokens=args.answer_tokens,
+                                  embed_latency=args.embed_latency, dimension=args.dimension)
+    asr_server = FakeServer(FakeASRHandler, base_latency=args.asr_latency,
+                            realtime_factor=args.asr_realtime_factor)
+    oss_server = FakeServer(FakeOSSHandler, latency=args.oss_latency, bandwidth=args.oss_bandwidth)
+
+    with tempfile.TemporaryDirectory() as work_dir, dashscope_server, asr_server, oss_server:
+        configure_environment(work_dir, dashscope_server, asr_server, oss_server, args)
+        import llm_interface
+        from oss_url import upload_image_to_oss
+        from services import get_nls_client, get_solver
+
+        setup = LatencyRecorder()
+        with setup.time('service init'):
+            solver = get_solver()
+            nls_client = get_nls_client()
+        write_corpus(os.path.join(work_dir, 'docs'), args.files, args.paragraphs, rng)
+        with setup.time('upload_directory'):
+            solver.upload_directory(os.path.join(work_dir, 'docs'))
+        setup.report('setup (one run)')
+
+        audio_file = os.path.join(work_dir, 'question.wav')
+        write_audio(audio_file, args.audio_seconds)
+
+        for concurrency in args.concurrency:
+            recorder = LatencyRecorder()
+            solver.llm = TimedLLM(solver.llm if not isinstance(solver.llm, TimedLLM) else solver.llm._llm, recorder)
+            solver.__dict__.pop('retrieve', None)
+            instrument(solver, 'retrieve', recorder, '  retrieve')
+            requests = range(args.requests)
+
+            if 'content_query' in args.stages:
+                def content_query(_):
+                    with recorder.time('content_query'):
+                        solver.content_query(question(rng), [])
+                run_sync(content_query, requests, concurrency)
+
+            if 'audio' in args.stages:
+                def transcribe(_):
+                    with recorder.time('audio_transcription'):
+                        nls_client.audio_transcription(audio_file)
+                run_sync(transcribe, requests, concurrency)
+
+            # oss uses one image per request; process_input one each for the
+            # image and image+audio messages plus the multi-image messages
+            images_per_request = ('oss' in args.stages) + \
+                ('process_input' in args.stages) * (2 + args.images_per_message)
+            images = []
+            for i in range(args.requests * images_per_request):
+                images.append(os.path.join(work_dir, f"image_{concurrency}_{i}.jpg"))
+                write_image(images[-1], args.image_size, rng)
+            image_iter = iter(images)
+
+            if 'oss' in args.stages:
+                def upload(_):
+                    path = next(image_iter)
+                    with recorder.time('upload_image_to_oss'):
+                        upload_image_to_oss(path)
+                run_sync(upload, requests, concurrency)
+
+            if 'process_input' in args.stages:
+                def make_input(kind):
+                    async def send(_):
+                        if kind == 'text':
+                            message = {'text': question(rng), 'files': []}
+                        elif kind == 'image':
+                            message = {'text': 'What is in this image?', 'files': [{'path': next(image_iter)}]}
+                        elif kind == 'images':
+                            message = {'text': 'Compare these images.',
+                                       'files': [{'path': next(image_iter)} for _ in range(args.images_per_message)]}
+                        elif kind == 'image+audio':
+                            message = {'text': '', 'files': [{'path': next(image_iter)}, {'path': audio_file}]}
+                        else:
+                            message = {'text': '', 'files': [{'path': audio_file}]}
+                        stage = f"process_input {kind}"
+                        start = time.perf_counter()
+                        first, last = None, None
+                        try:
+                            async for response in llm_interface.process_input(message, []):
+                                first = first or time.perf_counter()
+                                last = response
+                        except Exception:
+                            recorder.error(stage)
+                            raise
+                        if last is None or str(last).startswith(("An error occurred", "Error")):
+                            recorder.error(stage)
+                            return
+                        recorder.record(stage + ' ttfr', first - start)
+                        recorder.record(stage, time.perf_counter() - start)
+                    return send
+                for kind in ('text', 'image', 'audio', 'images', 'image+audio'):
+                    run_async(make_input(kind), requests, concurrency)
+
+            recorder.report(f"concurrency {concurrency} ({args.requests} requests per stage)")
+
+
+if __name__ == '__main__':
+    main()
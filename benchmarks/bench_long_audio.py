@@ -0,0 +1,74 @@
+"""Wall-clock speedup of VAD segmentation + parallel fan-out for long audio.
+
+Generates synthetic speech-like audio (tone bursts separated by silence),
+serves a fake ASR endpoint locally and compares one sequential pass over the
+segments with concurrent fan-out at several worker counts.
+
+    python benchmarks/bench_long_audio.py --minutes 5 --workers 1 2 4 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_servers import FakeASRHandler, FakeServer, StaticTokenManager  # noqa: E402
+from intelligent_speech import IntelligentSpeech  # noqa: E402
+
+
+def synthesize_audio(path, minutes, sample_rate=16000, seed=0):
+    """Write a WAV of 2-12 s tone bursts separated by 0.5-1.5 s of low noise."""
+    rng = np.random.default_rng(seed)
+    total = int(minutes * 60 * sample_rate)
+    parts = []
+    length = 0
+    while length < total:
+        speech = rng.uniform(2, 12)
+        t = np.arange(int(speech * sample_rate)) / sample_rate
+        tone = 8000 * np.sin(2 * np.pi * rng.uniform(150, 400) * t) * (0.6 + 0.4 * np.sin(2 * np.pi * 3 * t))
+        silence = rng.normal(0, 50, int(rng.uniform(0.5, 1.5) * sample_rate))
+        parts.extend([tone, silence])
+        length += len(tone) + len(silence)
+    samples = np.clip(np.concatenate(parts)[:total], -32768, 32767).astype('<i2')
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(samples.tobytes())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--minutes', type=float, default=5)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--max-segment-seconds', type=float, default=50)
+    parser.add_argument('--base-latency', type=float, default=0.3)
+    parser.add_argument('--realtime-factor', type=float, default=0.1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        audio_file = os.path.join(tmp_dir, 'long.wav')
+        synthesize_audio(audio_file, args.minutes)
+
+        with FakeServer(FakeASRHandler, base_latency=args.base_latency,
+                        realtime_factor=args.realtime_factor) as server:
+            client = IntelligentSpeech(token_manager=StaticTokenManager(), host=server.host)
+
+            baseline = None
+            print(f"{'workers':>8} {'segments':>9} {'wall s':>8} {'mean seg s':>11} {'speedup':>8}")
+            for workers in args.workers:
+                result = client.transcribe_long_audio(audio_file, max_workers=workers,
+                                                      max_segment_seconds=args.max_segment_seconds)
+                if baseline is None:
+                    baseline = result.wall_time
+                mean_latency = sum(s.latency for s in result.segments) / max(len(result.segments), 1)
+                print(f"{workers:>8} {len(result.segments):>9} {result.wall_time:>8.2f} "
+                      f"{mean_latency:>11.3f} {baseline / result.wall_time:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Tail latency of a heavy-tailed backend with and without hedged requests.
+
+Each call sleeps for a base latency, and a fraction of calls are slow. The
+same call sequence runs through a resilience.Backend with hedging off and on,
+from several client threads. The script reports p50/p95/p99, the number of
+hedges and how often the hedge won.
+
+    python benchmarks/bench_resilience.py --calls 2000 --slow-fraction 0.03
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from resilience import Backend  # noqa: E402
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run(backend, calls, threads, base, slow, slow_fraction, seed):
+    rng = random.Random(seed)
+    # Decide up front which calls are slow, so both modes see the same sequence
+    delays = [slow if rng.random() < slow_fraction else base * rng.uniform(0.8, 1.2) for _ in range(calls * 2)]
+    delay_iter = iter(delays)
+
+    def backend_call():
+        time.sleep(next(delay_iter))
+
+    def client(_):
+        start = time.perf_counter()
+        backend.call(backend_call)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(client, range(calls)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--base', type=float, default=0.02, help='typical latency, seconds')
+    parser.add_argument('--slow', type=float, default=0.5, help='latency of a slow call, seconds')
+    parser.add_argument('--slow-fraction', type=float, default=0.03)
+    parser.add_argument('--retry-ratio', type=float, default=0.2, help='retry budget (hedges spend it too)')
+    args = parser.parse_args()
+
+    print(f"{'mode':<10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'hedges':>7} {'win rate':>9} {'delay ms':>9}")
+    for hedge in (False, True):
+        backend = Backend(f"bench_{'hedged' if hedge else 'plain'}", hedge=hedge, retry_ratio=args.retry_ratio)
+        latencies = run(backend, args.calls, args.threads, args.base, args.slow, args.slow_fraction, seed=0)
+        # Leave out the warm-up calls made before the hedge delay is known
+        latencies = latencies[backend.hedge_min_samples:]
+        stats = backend.stats()
+        print(f"{'hedged' if hedge else 'plain':<10} {percentile(latencies, 0.5) * 1000:>8.1f} "
+              f"{percentile(latencies, 0.95) * 1000:>8.1f} {percentile(latencies, 0.99) * 1000:>8.1f} "
+              f"{stats['hedges']:>7} {stats['hedge_win_rate']:>9.2f} {stats['hedge_delay_seconds'] * 1000:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
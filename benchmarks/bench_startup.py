@@ -0,0 +1,126 @@
+"""Startup time of the chat UI, split into import time and service init time.
+
+Each measurement runs in a fresh interpreter:
+
+- import: ``python -X importtime -c "import llm_interface"`` (builds the UI
+  without launching it), with its slowest direct imports listed
+- init: creating LLMService and IntelligentSpeech and warming them up (needs
+  the backends configured in .env; skip with --skip-init)
+- serve (--serve): launches llm_interface.py and polls /ready, reporting when
+  the server first answers and when it reports ready
+
+    python benchmarks/bench_startup.py --top 15 --serve
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+INIT_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import services
+imported = time.perf_counter()
+timings = {'import services': imported - start}
+for service in services.SERVICES:
+    begin = time.perf_counter()
+    service.get()
+    created = time.perf_counter()
+    service.warm_up()
+    timings[service.name + ' init'] = created - begin
+    timings[service.name + ' warm-up'] = time.perf_counter() - created
+print(json.dumps(timings))
+"""
+
+
+def measure_imports(module, top):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        sys.exit(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    # Lines look like "import time: <self us> | <cumulative us> | <indent><package>",
+    # with two spaces of indent per nesting level; a package is listed after
+    # everything it imports, so direct imports of the module precede its own line
+    total_us, direct = 0, []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        if level == 0 and name.strip() == module:
+            total_us = int(cumulative_us)
+        elif level == 1:
+            direct.append((int(cumulative_us), name.strip()))
+    direct.sort(reverse=True)
+    return wall, total_us / 1e6, direct[:top]
+
+
+def measure_init():
+    result = subprocess.run([sys.executable, '-c', INIT_SCRIPT], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(f"service init failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure_serve(port, timeout):
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'llm_interface.py'], cwd=ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    first_response = ready = None
+    try:
+        while time.perf_counter() - start < timeout and ready is None:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/ready', timeout=1):
+                    ready = time.perf_counter() - start
+            except urllib.error.HTTPError:  # 503 while warming up
+                pass
+            except OSError:  # not listening yet
+                time.sleep(0.1)
+                continue
+            if first_response is None:
+                first_response = time.perf_counter() - start
+            time.sleep(0.1)
+    finally:
+        process.terminate()
+        process.wait()
+    return first_response, ready
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default='llm_interface')
+    parser.add_argument('--top', type=int, default=10, help='slowest direct imports to list')
+    parser.add_argument('--skip-init', action='store_true')
+    parser.add_argument('--serve', action='store_true')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--timeout', type=float, default=120)
+    args = parser.parse_args()
+
+    wall, import_seconds, slowest = measure_imports(args.module, args.top)
+    print(f"import {args.module}: {import_seconds:.2f} s ({wall:.2f} s wall, interpreter included); "
+          f"slowest direct imports:")
+    for cumulative_us, name in slowest:
+        print(f"  {cumulative_us / 1e6:8.3f} s  {name}")
+
+    if not args.skip_init:
+        print("service init (fresh process):")
+        for stage, seconds in measure_init().items():
+            print(f"  {seconds:8.3f} s  {stage}")
+
+    if args.serve:
+        first_response, ready = measure_serve(args.port, args.timeout)
+        print(f"serve: first response after {first_response or float('nan'):.2f} s, "
+              f"ready after {ready or float('nan'):.2f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Per-call overhead of tracing spans, enabled and disabled.
+
+Each mode runs in a fresh interpreter because TRACING and TRACE_LOG are read
+at import time.
+
+    python benchmarks/bench_tracing.py --calls 200000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = """
+import time
+from tracing import span, traced
+
+@traced('leaf')
+def leaf():
+    return 1
+
+def plain():
+    return 1
+
+calls = {calls}
+for fn in (plain, leaf):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    print(fn.__name__, (time.perf_counter() - start) / calls * 1e9)
+
+start = time.perf_counter()
+for _ in range(calls // 10):
+    with span('root'):
+        for _ in range(9):
+            leaf()
+print('request', (time.perf_counter() - start) / calls * 1e9)
+"""
+
+
+def run(calls, env):
+    result = subprocess.run([sys.executable, '-c', SCRIPT.format(calls=calls)], cwd=ROOT,
+                            env=dict(os.environ, **env), capture_output=True, text=True, check=True)
+    return {name: float(ns) for name, ns in (line.split() for line in result.stdout.splitlines())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        modes = {
+            'disabled': {'TRACING': 'false', 'TRACE_LOG': ''},
+            'metrics only': {'TRACING': 'true', 'TRACE_LOG': ''},
+            'metrics + trace log': {'TRACING': 'true', 'TRACE_LOG': os.path.join(tmp_dir, 'trace.jsonl')},
+        }
+        print(f"{'mode':<22} {'plain ns':>9} {'span ns':>9} {'overhead ns':>12} {'10-span request ns':>19}")
+        for mode, env in modes.items():
+            timings = run(args.calls, env)
+            print(f"{mode:<22} {timings['plain']:>9.0f} {timings['leaf']:>9.0f} "
+                  f"{timings['leaf'] - timings['plain']:>12.0f} {timings['request']:>19.0f}")
+
+
+if __name__ == '__main__':
+    main()
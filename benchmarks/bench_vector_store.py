@@ -0,0 +1,77 @@
+"""Query latency of the local memory-mapped vector store against corpus size.
+
+Fills a temporary store with clustered random vectors and measures top-k
+latency for the flat scan and the IVF index, plus IVF recall against flat.
+
+    python benchmarks/bench_vector_store.py --sizes 10000 100000 --dimension 1536
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from local_vector_store import MmapVectorStore  # noqa: E402
+
+
+def clustered_vectors(rng, count, dimension, clusters=256):
+    centers = rng.normal(size=(clusters, dimension)).astype(np.float32)
+    labels = rng.integers(0, clusters, count)
+    return centers[labels] + 0.5 * rng.normal(size=(count, dimension)).astype(np.float32)
+
+
+def percentile_ms(samples, q):
+    return 1000 * float(np.percentile(samples, q))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000, 200000])
+    parser.add_argument('--dimension', type=int, default=1536)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--ivf-lists', type=int, default=256)
+    parser.add_argument('--nprobe', type=int, default=8)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'rows':>9} {'open ms':>8} {'flat p50':>9} {'flat p95':>9} {'ivf p50':>8} {'ivf p95':>8} {'recall':>7}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as path:
+            store = MmapVectorStore(None, path=path, dimension=args.dimension, ivf_lists=0)
+            for offset in range(0, size, 50000):
+                count = min(50000, size - offset)
+                store.add_embeddings([''] * count, clustered_vectors(rng, count, args.dimension))
+
+            start = time.perf_counter()
+            store = MmapVectorStore(None, path=path, dimension=args.dimension, ivf_lists=0)
+            open_ms = 1000 * (time.perf_counter() - start)
+
+            queries = clustered_vectors(rng, args.queries, args.dimension)
+            flat_times, flat_results = [], []
+            for query in queries:
+                start = time.perf_counter()
+                rows, _ = store.search(query, args.k)
+                flat_times.append(time.perf_counter() - start)
+                flat_results.append(set(rows.tolist()))
+
+            store.ivf_lists, store.nprobe = args.ivf_lists, args.nprobe
+            store.build_index()
+            ivf_times, hits = [], 0
+            for query, expected in zip(queries, flat_results):
+                start = time.perf_counter()
+                rows, _ = store.search(query, args.k)
+                ivf_times.append(time.perf_counter() - start)
+                hits += len(expected & set(rows.tolist()))
+
+            print(f"{size:>9} {open_ms:>8.2f} {percentile_ms(flat_times, 50):>9.2f} "
+                  f"{percentile_ms(flat_times, 95):>9.2f} {percentile_ms(ivf_times, 50):>8.2f} "
+                  f"{percentile_ms(ivf_times, 95):>8.2f} {hits / (args.k * args.queries):>7.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""Local stand-ins for the cloud endpoints, used by the benchmarks.
+
+Each server runs a ThreadingHTTPServer on 127.0.0.1 in a daemon thread and
+simulates service latency with ``time.sleep``.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeServer:
+    """Run a request handler class on a random local port."""
+
+    def __init__(self, handler_class, **settings):
+        handler = type(handler_class.__name__, (handler_class,), {'settings': settings})
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def host(self):
+        return f"127.0.0.1:{self.httpd.server_port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    settings = {}
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b''.join(chunks)
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def send_json(self, payload, status=200):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_sse(self, events):
+        """Stream (delay, payload) events as DashScope server-sent events."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream;charset=UTF-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i, (delay, payload) in enumerate(events):
+            time.sleep(delay)
+            event = (f"id:{i + 1}\nevent:result\n:HTTP_STATUS/200\n"
+                     f"data:{json.dumps(payload)}\n\n").encode('utf-8')
+            self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeASRHandler(FakeHandler):
+    """NLS one-sentence recognizer: latency grows with the audio duration.
+
+    Settings: ``base_latency`` (s), ``realtime_factor`` (s of latency per s of
+    audio) and ``sample_rate``.
+    """
+
+    def do_POST(self):
+        pcm = self.read_body()
+        sample_rate = self.settings.get('sample_rate', 16000)
+        duration = len(pcm) / 2 / sample_rate
+        time.sleep(self.settings.get('base_latency', 0.3)
+                   + self.settings.get('realtime_factor', 0.1) * duration)
+        self.send_json({
+            'task_id': 'fake',
+            'status': 20000000,
+            'message': 'SUCCESS',
+            'result': f"[{duration:.2f}s of speech]",
+        })
+
+
+class FakeDashScopeHandler(FakeHandler):
+    """DashScope REST API: text generation, text embedding and multimodal generation.
+
+    Settings: ``chat_ttft`` and ``vl_ttft`` (s before the first token),
+    ``prefill_per_1k_tokens`` (s added to the chat time to first token per
+    1000 prompt tokens, estimated at 4 characters each),
+    ``token_interval`` (s per further token), ``answer_tokens``,
+    ``embed_latency`` (s per request) and ``dimension``. Streaming is used
+    when the client asks for server-sent events, with incremental or
+    cumulative output as requested. Embeddings are hashed bags of words, so
+    chunks sharing words with a question are retrieved for it.
+    """
+
+    def do_POST(self):
+        request = json.loads(self.read_body() or b'{}')
+        if self.path.endswith('/services/embeddings/text-embedding/text-embedding'):
+            self.embed(request)
+        elif self.path.endswith('/services/aigc/text-generation/generation'):
+            prompt_tokens = len(json.dumps(request.get('input', {}), ensure_ascii=False)) / 4
+            ttft = self.settings.get('chat_ttft', 0.3) + \
+                self.settings.get('prefill_per_1k_tokens', 0.0) * prompt_tokens / 1000
+            self.generate(request, ttft, multimodal=False)
+        elif self.path.endswith('/services/aigc/multimodal-generation/generation'):
+            self.generate(request, self.settings.get('vl_ttft', 0.8), multimodal=True)
+        else:
+            self.send_json({'code': 'NotFound', 'message': self.path}, status=404)
+
+    def embed(self, request):
+        texts = request.get('input', {}).get('texts', [])
+        if isinstance(texts, str):
+            texts = [texts]
+        dimension = self.settings.get('dimension', 1536)
+        time.sleep(self.settings.get('embed_latency', 0.05))
+        embeddings = []
+        for i, text in enumerate(texts):
+            vector = [0.0] * dimension
+            vector[0] = 1e-3
+            for word in re.findall(r'\w+', text.lower()):
+                vector[zlib.crc32(word.encode('utf-8')) % dimension] += 1.0
+            embeddings.append({'text_index': i, 'embedding': vector})
+        self.send_json({
+            'output': {'embeddings': embeddings},
+            'usage': {'total_tokens': sum(len(text) for text in texts) // 4},
+            'request_id': 'fake',
+        })
+
+    def generate(self, request, ttft, multimodal):
+        count = self.settings.get('answer_tokens', 100)
+        interval = self.settings.get('token_interval', 0.02)
+        seed = hashlib.sha256(json.dumps(request.get('input', {})).encode('utf-8')).hexdigest()[:8]
+        tokens = [f"{seed}-{i} " for i in range(count)]
+
+        def payload(text, finished):
+            content = [{'text': text}] if multimodal else text
+            return {
+                'output': {'choices': [{'finish_reason': 'stop' if finished else 'null',
+                                        'message': {'role': 'assistant', 'content': content}}]},
+                'usage': {'input_tokens': 0, 'output_tokens': count, 'total_tokens': count},
+                'request_id': 'fake',
+            }
+
+        streaming = (self.headers.get('X-DashScope-SSE', '').lower() == 'enable'
+                     or 'text/event-stream' in self.headers.get('Accept', ''))
+        if not streaming:
+            time.sleep(ttft + interval * max(count - 1, 0))
+            self.send_json(payload(''.join(tokens), True))
+            return
+
+        incremental = request.get('parameters', {}).get('incremental_output', False)
+        events = []
+        for i, token in enumerate(tokens):
+            text = token if incremental else ''.join(tokens[:i + 1])
+            events.append((ttft if i == 0 else interval, payload(text, i == count - 1)))
+        self.send_sse(events)
+
+
+class FakeOSSHandler(FakeHandler):
+    """OSS object API with path-style URLs (what oss2 uses for IP endpoints).
+
+    Supports HEAD (object_exists) and PUT (put_object); objects are kept in
+    memory. Resumable multipart uploads are not supported. Settings:
+    ``latency`` (s per request) and ``bandwidth`` (uploaded bytes/s, 0 for
+    unlimited).
+    """
+
+    def do_HEAD(self):
+        time.sleep(self.settings.get('latency', 0.03))
+        data = self.objects().get(self.path.split('?')[0])
+        self.send_response(200 if data is not None else 404)
+        self.send_header('x-oss-request-id', 'fake')
+        if data is not None:
+            self.send_header('ETag', f'"{hashlib.md5(data).hexdigest().upper()}"')
+        self.send_header('Content-Length', str(len(data) if data is not None else 0))
+        self.end_headers()
+
+    def do_PUT(self):
+        data = self.read_body()
+        bandwidth = self.settings.get('bandwidth', 0)
+        time.sleep(self.settings.get('latency', 0.03) + (len(data) / bandwidth if bandwidth else 0))
+        self.objects()[self.path.split('?')[0]] = data
+        self.send_response(200)
+        self.send_header('x-oss-request-id', 'fake')
+        self.send_header('ETag', f'"{hashlib.md5(data).hexdigest().upper()}"')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def objects(self):
+        return self.settings.setdefault('objects', {})
+
+
+class StaticTokenManager:
+    """Token manager stand-in that never calls CreateToken."""
+
+    def get_token(self):
+        return 'fake-token'
+
+    def invalidate(self, token):
+        pass
@@ -0,0 +1,207 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import zlib
+
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_SPACE = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    return _SPACE.sub(' ', text).strip().lower()
+
+
+def shingles(text, size=5):
+    """Character shingles of normalized text."""
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def lsh_params(threshold, num_perm):
+    """Return (bands, rows) for LSH over num_perm MinHash values.
+
+    The S-curve midpoint (1/bands)^(1/rows) is placed a little below the
+    threshold so pairs just above it are still likely to become candidates;
+    candidates are then checked against the threshold itself.
+    """
+    target = 0.85 * threshold
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - target)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class ChunkDeduplicator:
+    """Drops exact and near-duplicate chunks before they are embedded.
+
+    Exact duplicates are found by the SHA-256 of the whitespace- and
+    case-normalized text. Near duplicates are found with MinHash signatures
+    over character shingles and LSH banding; a candidate counts as a
+    duplicate when the estimated Jaccard similarity reaches ``threshold``.
+
+    The index lives in SQLite next to the ingest manifest and only holds
+    chunks that were kept, so it carries over between ingestion runs.
+    Chunks deleted from the vector store must be passed to remove().
+    """
+
+    def __init__(self, path=None, threshold=None, num_perm=None, shingle_size=5, seed=1):
+        self.path = path or os.getenv('DEDUP_INDEX', os.path.join('.ingest', 'dedup.sqlite'))
+        self.threshold = float(threshold or os.getenv('DEDUP_THRESHOLD', 0.9))
+        self.num_perm = int(num_perm or os.getenv('DEDUP_NUM_PERM', 128))
+        self.shingle_size = shingle_size
+        self.seed = seed
+        self.bands, self.rows = lsh_params(self.threshold, self.num_perm)
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 1 << 32, self.num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, self.num_perm, dtype=np.uint64)
+
+        self.checked = 0
+        self.exact_dropped = 0
+        self.near_dropped = 0
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS params (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS exact (
+                hash TEXT PRIMARY KEY,
+                chunk_id TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS exact_chunk_id ON exact (chunk_id);
+            CREATE TABLE IF NOT EXISTS signatures (
+                chunk_id TEXT PRIMARY KEY,
+                signature BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS bands (
+                band INTEGER NOT NULL,
+                bucket BLOB NOT NULL,
+                chunk_id TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS bands_bucket ON bands (band, bucket);
+            CREATE INDEX IF NOT EXISTS bands_chunk_id ON bands (chunk_id);
+        """)
+        self._check_params()
+
+    def signature(self, text):
+        """MinHash signature (uint32[num_perm]) of already normalized text."""
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles(text, self.shingle_size)),
+                             dtype=np.uint64)
+        values = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME
+        return (values.min(axis=0) & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+    def deduplicate(self, docs, exclude=()):
+        """Drop duplicates from docs (which carry metadata['chunk_id']).
+
+        Returns (kept_docs, chunk_ids, dropped): chunk_ids has one id per input
+        doc, the id of the chunk it duplicates for dropped ones, so the file
+        still references the chunk that stands in for its text. Chunks in
+        ``exclude`` (those the file is about to stop referencing) are not used
+        as originals.
+        """
+        kept, chunk_ids, dropped = [], [], 0
+        for doc in docs:
+            chunk_id = doc.metadata['chunk_id']
+            text = normalize_text(doc.page_content)
+            exact_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+            with self._lock:
+                self.checked += 1
+                row = self._conn.execute('SELECT chunk_id FROM exact WHERE hash = ?', (exact_hash,)).fetchone()
+                if row and row[0] == chunk_id:
+                    kept.append(doc)
+                    chunk_ids.append(chunk_id)
+                    continue
+                if row and row[0] not in exclude:
+                    self.exact_dropped += 1
+                    dropped += 1
+                    chunk_ids.append(row[0])
+                    continue
+
+                signature = self.signature(text)
+                original = self._near_match(signature, chunk_id, exclude)
+                if original is not None:
+                    self.near_dropped += 1
+                    dropped += 1
+                    chunk_ids.append(original)
+                    continue
+                self._add(chunk_id, exact_hash, signature)
+            kept.append(doc)
+            chunk_ids.append(chunk_id)
+        return kept, chunk_ids, dropped
+
+    def remove(self, chunk_ids):
+        """Forget chunks that are no longer in the vector store."""
+        rows = [(chunk_id,) for chunk_id in chunk_ids]
+        with self._lock, self._conn:
+            self._conn.executemany('DELETE FROM exact WHERE chunk_id = ?', rows)
+            self._conn.executemany('DELETE FROM signatures WHERE chunk_id = ?', rows)
+            self._conn.executemany('DELETE FROM bands WHERE chunk_id = ?', rows)
+
+    def stats(self):
+        with self._lock:
+            indexed = self._conn.execute('SELECT COUNT(*) FROM signatures').fetchone()[0]
+            return {
+                'checked': self.checked,
+                'exact_dropped': self.exact_dropped,
+                'near_dropped': self.near_dropped,
+                'dropped_ratio': (self.exact_dropped + self.near_dropped) / self.checked if self.checked else 0.0,
+                'indexed': indexed,
+                'bands': self.bands,
+                'rows': self.rows,
+            }
+
+    def _near_match(self, signature, chunk_id, exclude):
+        candidates = set()
+        for band in range(self.bands):
+            bucket = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            candidates.update(row[0] for row in self._conn.execute(
+                'SELECT chunk_id FROM bands WHERE band = ? AND bucket = ?', (band, bucket)))
+        candidates.discard(chunk_id)
+        best, best_score = None, self.threshold
+        for candidate in candidates - set(exclude):
+            row = self._conn.execute('SELECT signature FROM signatures WHERE chunk_id = ?', (candidate,)).fetchone()
+            if row is None:
+                continue
+            score = float(np.mean(np.frombuffer(row[0], dtype=np.uint32) == signature))
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    def _add(self, chunk_id, exact_hash, signature):
+        with self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO exact (hash, chunk_id) VALUES (?, ?)', (exact_hash, chunk_id))
+            self._conn.execute('INSERT OR REPLACE INTO signatures (chunk_id, signature) VALUES (?, ?)',
+                               (chunk_id, signature.tobytes()))
+            self._conn.execute('DELETE FROM bands WHERE chunk_id = ?', (chunk_id,))
+            self._conn.executemany('INSERT INTO bands (band, bucket, chunk_id) VALUES (?, ?, ?)',
+                                   [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes(), chunk_id)
+                                    for band in range(self.bands)])
+
+    def _check_params(self):
+        # Signatures from other settings are not comparable: start over
+        params = {'num_perm': str(self.num_perm), 'shingle_size': str(self.shingle_size),
+                  'bands': str(self.bands), 'rows': str(self.rows), 'seed': str(self.seed)}
+        with self._lock, self._conn:
+            stored = dict(self._conn.execute('SELECT name, value FROM params'))
+            if stored and stored != params:
+                print(f"Dedup index settings changed ({stored} -> {params}); starting a new index")
+                self._conn.execute('DELETE FROM exact')
+                self._conn.execute('DELETE FROM signatures')
+                self._conn.execute('DELETE FROM bands')
+            self._conn.execute('DELETE FROM params')
+            self._conn.executemany('INSERT INTO params (name, value) VALUES (?, ?)', params.items())
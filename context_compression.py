@@ -0,0 +1,142 @@
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import List
+
+from dotenv import load_dotenv
+
+from history_manager import count_tokens
+from lexical_index import tokenize
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Sentence ends: ., ! or ? before whitespace, CJK full stops, and line breaks
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+|(?<=[。！？；])|\n+')
+
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in _SENTENCE_END.split(text or '') if sentence and sentence.strip()]
+
+
+@dataclass
+class CompressedContext:
+    texts: List[str]  # one per retrieved chunk that kept any sentence, in retrieval order
+    tokens_before: int
+    tokens_after: int
+    seconds: float
+
+    def report(self):
+        saved = 1 - self.tokens_after / self.tokens_before if self.tokens_before else 0.0
+        return (f"Context tokens: {self.tokens_before} -> {self.tokens_after} ({saved:.0%} fewer), "
+                f"compressed in {self.seconds * 1000:.1f} ms")
+
+
+class ContextCompressor:
+    """Keeps only the sentences of the retrieved chunks that matter for the question.
+
+    Chunks are split into sentences and each sentence is scored against the
+    question, either by IDF-weighted term overlap ("lexical", the default)
+    or by cosine similarity of embeddings ("embedding", through the cached
+    embeddings). The best sentences are kept, up to ``budget_tokens``, in
+    their original order. Context that already fits the budget is left as
+    it is.
+    """
+
+    def __init__(self, embeddings=None, budget_tokens=None, scorer=None, enabled=None):
+        self.embeddings = embeddings
+        self.budget_tokens = int(budget_tokens or os.getenv('CONTEXT_TOKEN_BUDGET', 400))
+        self.scorer = (scorer or os.getenv('CONTEXT_SCORER', 'lexical')).lower()
+        if self.scorer not in ('lexical', 'embedding'):
+            raise ValueError(f"Unknown context scorer: {self.scorer}")
+        self.enabled = (enabled if enabled is not None
+                        else os.getenv('CONTEXT_COMPRESSION', 'true').lower() == 'true')
+
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.compressed = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.seconds = 0.0
+
+    def compress(self, question, texts, question_embedding=None):
+        """Return a CompressedContext for the chunk texts, best-ranked chunk first."""
+        start_time = time.perf_counter()
+        sentences = []  # (chunk index, position, text, tokens)
+        for chunk_index, text in enumerate(texts):
+            for position, sentence in enumerate(split_sentences(text)):
+                sentences.append((chunk_index, position, sentence, count_tokens(sentence)))
+        tokens_before = sum(count_tokens(text) for text in texts)
+
+        if not self.enabled or tokens_before <= self.budget_tokens or not sentences:
+            kept_texts = list(texts)
+        else:
+            scores = self._score(question, [sentence[2] for sentence in sentences], question_embedding)
+            # Best score first; ties go to the better-ranked chunk and the earlier sentence
+            order = sorted(range(len(sentences)), key=lambda i: (-scores[i], sentences[i][0], sentences[i][1]))
+            relevant = any(score > 0 for score in scores)
+            kept, used = set(), 0
+            for i in order:
+                if relevant and scores[i] <= 0:
+                    break
+                if used + sentences[i][3] > self.budget_tokens:
+                    # Always keep the best sentence, even if it alone is over the budget
+                    if kept:
+                        continue
+                kept.add(i)
+                used += sentences[i][3]
+            kept_texts = []
+            for chunk_index in range(len(texts)):
+                chunk_sentences = [sentences[i][2] for i in sorted(kept) if sentences[i][0] == chunk_index]
+                if chunk_sentences:
+                    kept_texts.append(' '.join(chunk_sentences))
+
+        result = CompressedContext(kept_texts, tokens_before, sum(count_tokens(text) for text in kept_texts),
+                                   time.perf_counter() - start_time)
+        with self._lock:
+            self.queries += 1
+            self.compressed += int(result.tokens_after < result.tokens_before)
+            self.tokens_before += result.tokens_before
+            self.tokens_after += result.tokens_after
+            self.seconds += result.seconds
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queries': self.queries,
+                'compressed': self.compressed,
+                'tokens_before': self.tokens_before,
+                'tokens_after': self.tokens_after,
+                'token_reduction': 1 - self.tokens_after / self.tokens_before if self.tokens_before else 0.0,
+                'tokens_saved_per_query': (self.tokens_before - self.tokens_after) / self.queries if self.queries else 0.0,
+                'compress_seconds_mean': self.seconds / self.queries if self.queries else 0.0,
+            }
+
+    def _score(self, question, sentences, question_embedding):
+        if self.scorer == 'embedding' and self.embeddings is not None:
+            if question_embedding is None:
+                question_embedding = self.embeddings.embed_query(question)
+            return [_cosine(question_embedding, vector) for vector in self.embeddings.embed_documents(sentences)]
+
+        # Term weights come from how rare a term is among the retrieved sentences
+        sentence_terms = [set(tokenize(sentence)) for sentence in sentences]
+        document_frequency = Counter(term for terms in sentence_terms for term in terms)
+        question_terms = set(tokenize(question))
+        scores = []
+        for terms in sentence_terms:
+            matched = question_terms & terms
+            weight = sum(math.log(1 + len(sentences) / document_frequency[term]) for term in matched)
+            # Long sentences match more terms by chance
+            scores.append(weight / math.sqrt(len(terms)) if terms else 0.0)
+        return scores
+
+
+def _cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
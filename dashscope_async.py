@@ -0,0 +1,78 @@
+import json
+import os
+
+import dashscope
+from dotenv import load_dotenv
+
+from async_pipeline import get_session
+from resilience import get_backend
+from tracing import traced
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+class DashScopeError(Exception):
+    def __init__(self, code, message, status=None):
+        super().__init__(f"Error {code}: {message}")
+        self.code = code
+        self.message = message
+        # HTTP status of the response, so throttling and 5xx errors are retried
+        self.status = status
+
+
+# Generation is not hedged by default: a duplicate request is billed twice
+vl_backend = get_backend('vl', timeout=60)
+
+
+@traced('vl_generate')
+async def stream_multimodal(model, messages):
+    """Call MultiModalConversation over aiohttp and yield text pieces as they arrive.
+
+    Uses the same REST endpoint as dashscope.MultiModalConversation with
+    server-sent events and incremental output. Retries, the timeout and the
+    circuit breaker of the ``vl`` backend apply until the first piece arrives.
+    """
+    async for text in vl_backend.astream(lambda: _stream_multimodal(model, messages)):
+        yield text
+
+
+async def _stream_multimodal(model, messages):
+    url = f"{dashscope.base_http_api_url}/services/aigc/multimodal-generation/generation"
+    headers = {
+        'Authorization': f"Bearer {dashscope.api_key or os.getenv('DASHSCOPE_API_KEY')}",
+        'Content-Type': 'application/json',
+        'Accept': 'text/event-stream',
+        'X-DashScope-SSE': 'enable',
+    }
+    payload = {
+        'model': model,
+        'input': {'messages': messages},
+        'parameters': {'incremental_output': True},
+    }
+
+    async with get_session().post(url, json=payload, headers=headers) as response:
+        if response.status != 200:
+            body = await response.text()
+            try:
+                error = json.loads(body)
+                raise DashScopeError(error.get('code', response.status), error.get('message', body),
+                                     status=response.status)
+            except ValueError:
+                raise DashScopeError(response.status, body, status=response.status)
+
+        async for line in response.content:
+            line = line.decode('utf-8').strip()
+            if not line.startswith('data:'):
+                continue
+            event = json.loads(line[len('data:'):])
+            if 'code' in event and 'output' not in event:
+                raise DashScopeError(event['code'], event.get('message'))
+            for choice in event.get('output', {}).get('choices', []):
+                content = choice.get('message', {}).get('content', [])
+                if isinstance(content, str):
+                    text = content
+                else:
+                    text = ''.join(item.get('text', '') for item in content)
+                if text:
+                    yield text
@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class DiskCache:
+    """Small SQLite key-value store with size-based LRU eviction and optional TTL.
+
+    Values are bytes. When the stored values exceed ``max_bytes`` the least
+    recently accessed entries are removed until the cache is back under 90% of
+    the limit. Entries older than ``ttl`` seconds (if set) are treated as
+    missing and removed on access.
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, ttl=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+        self._total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """Return {key: value} for the keys that are present and not expired."""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        now = time.time()
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for offset in range(0, len(keys), 500):
+                batch = keys[offset:offset + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = self._conn.execute(
+                    f'SELECT key, value, created FROM entries WHERE key IN ({placeholders})', batch)
+                for key, value, created in rows:
+                    if self.ttl is None or now - created <= self.ttl:
+                        found[key] = value
+            expired = [key for key in keys if key not in found]
+            with self._conn:
+                if found:
+                    self._conn.executemany('UPDATE entries SET accessed = ? WHERE key = ?',
+                                           [(now, key) for key in found])
+                if self.ttl is not None and expired:
+                    self._delete(expired)
+        return found
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, items):
+        now = time.time()
+        with self._lock, self._conn:
+            self._delete(list(items))
+            self._conn.executemany(
+                'INSERT INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                [(key, value, len(value), now, now) for key, value in items.items()])
+            self._total_bytes += sum(len(value) for value in items.values())
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def delete(self, key):
+        with self._lock, self._conn:
+            self._delete([key])
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def _delete(self, keys):
+        for offset in range(0, len(keys), 500):
+            batch = keys[offset:offset + 500]
+            placeholders = ','.join('?' * len(batch))
+            freed = self._conn.execute(
+                f'SELECT COALESCE(SUM(size), 0) FROM entries WHERE key IN ({placeholders})', batch).fetchone()[0]
+            self._conn.execute(f'DELETE FROM entries WHERE key IN ({placeholders})', batch)
+            self._total_bytes -= freed
+
+    def _evict(self):
+        target = int(self.max_bytes * 0.9)
+        rows = self._conn.execute('SELECT key, size FROM entries ORDER BY accessed')
+        victims = []
+        for key, size in rows:
+            if self._total_bytes <= target:
+                break
+            victims.append(key)
+            self._total_bytes -= size
+        self._conn.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key in victims])
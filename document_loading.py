@@ -0,0 +1,68 @@
+import os
+
+from ingest_manifest import chunk_id_for
+from hashing import file_sha256
+
+
+def load_documents(file, fallback=False):
+    """Load a file with the loader for its extension.
+
+    Unknown extensions raise ValueError, or go through UnstructuredFileLoader
+    when ``fallback`` is set (what DirectoryLoader used for every file).
+    Loaders are imported here so process pool workers only pay for the one
+    they use.
+    """
+    extension = os.path.splitext(file)[1].lower()
+    if extension == '.csv':
+        from langchain_community.document_loaders import CSVLoader
+        return CSVLoader(file).load()
+    elif extension == '.md':
+        from langchain_community.document_loaders import UnstructuredMarkdownLoader
+        return UnstructuredMarkdownLoader(file).load()
+    elif extension == '.txt':
+        from langchain_community.document_loaders import TextLoader
+        return TextLoader(file).load()
+    elif extension == '.pdf':
+        from langchain_community.document_loaders import PyPDFLoader
+        return PyPDFLoader(file).load()
+    elif extension == '.html':
+        from langchain_community.document_loaders import UnstructuredHTMLLoader
+        return UnstructuredHTMLLoader(file).load()
+    elif fallback:
+        from langchain_community.document_loaders import UnstructuredFileLoader
+        return UnstructuredFileLoader(file).load()
+    raise ValueError(f"Unsupported file extension: {file.lower()}")
+
+
+def split_documents(documents, chunk_size=1000, chunk_overlap=0):
+    from langchain.text_splitter import CharacterTextSplitter
+    text_splitter = CharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return text_splitter.split_documents(documents)
+
+
+def assign_chunk_ids(docs):
+    """Set metadata['chunk_id'] on each chunk and return the ids in order."""
+    chunk_ids = []
+    for doc in docs:
+        doc.metadata['chunk_id'] = chunk_id_for(doc.page_content)
+        chunk_ids.append(doc.metadata['chunk_id'])
+    return chunk_ids
+
+
+def ingest_hash(path, chunk_size, chunk_overlap):
+    # Splitter settings are part of the hash so changing them re-chunks the file
+    return f"{file_sha256(path)}:{chunk_size}:{chunk_overlap}"
+
+
+def parse_file(path, chunk_size, chunk_overlap, known_hash=None, fallback=True):
+    """Hash, load, split and id one file; runs in a process pool worker.
+
+    Returns (path, content_hash, chunks), with chunks None when the file
+    still matches ``known_hash``.
+    """
+    content_hash = ingest_hash(path, chunk_size, chunk_overlap)
+    if content_hash == known_hash:
+        return path, content_hash, None
+    docs = split_documents(load_documents(path, fallback=fallback), chunk_size, chunk_overlap)
+    assign_chunk_ids(docs)
+    return path, content_hash, docs
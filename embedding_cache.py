@@ -0,0 +1,146 @@
+import contextvars
+import hashlib
+import os
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+from dotenv import load_dotenv
+
+from disk_cache import DiskCache
+from tracing import span
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+class RateLimiter:
+    """Token bucket allowing ``rate`` acquisitions per second, shared by threads."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(rate, 1))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper with a persistent cache and batched, concurrent misses.
+
+    Vectors are stored as float32 in a DiskCache keyed by model name, text
+    type (document or query) and the SHA-256 of the text. Cache misses are
+    de-duplicated, grouped into batches of at most ``batch_size`` texts and
+    sent concurrently, limited to ``requests_per_second``.
+    """
+
+    def __init__(self, embeddings, model_name, cache_path=None, max_bytes=None,
+                 batch_size=None, max_concurrency=None, requests_per_second=None):
+        self.embeddings = embeddings
+        self.model_name = model_name or ''
+        self.cache = DiskCache(
+            cache_path or os.getenv('EMBEDDING_CACHE_PATH', os.path.join('.cache', 'embeddings.sqlite')),
+            max_bytes=int(max_bytes or os.getenv('EMBEDDING_CACHE_MAX_BYTES', 512 * 1024 * 1024)))
+        # DashScope text-embedding-v1/v2 accept up to 25 texts per request
+        self.batch_size = int(batch_size or os.getenv('EMBEDDING_BATCH_SIZE', 25))
+        self.max_concurrency = int(max_concurrency or os.getenv('EMBEDDING_MAX_CONCURRENCY', 4))
+        self.rate_limiter = RateLimiter(float(requests_per_second or os.getenv('EMBEDDING_RPS', 10)))
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.batched_texts = 0
+        self.max_batch = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, 'document', self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], 'query', lambda batch: [self.embeddings.embed_query(batch[0])])[0]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'batches': self.batches,
+                'avg_batch_size': self.batched_texts / self.batches if self.batches else 0.0,
+                'max_batch_size': self.max_batch,
+                'cache_bytes': self.cache.total_bytes,
+            }
+
+    def _key(self, text, text_type):
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return f"{self.model_name}:{text_type}:{digest}"
+
+    def _embed(self, texts, text_type, embed_batch):
+        keys = [self._key(text, text_type) for text in texts]
+        cached = self.cache.get_many(keys)
+
+        # Embed each distinct missing text once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+
+        with self._lock:
+            self.hits += len(texts) - sum(1 for key in keys if key not in cached)
+            self.misses += len(missing)
+
+        vectors = {key: self._decode(value) for key, value in cached.items()}
+        if missing:
+            items = list(missing.items())
+            batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+
+            def run(batch):
+                self.rate_limiter.acquire()
+                with span('embedding_request', texts=len(batch)):
+                    return batch, embed_batch([text for _, text in batch])
+
+            if len(batches) == 1:
+                results = [run(batches[0])]
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                    # Each batch runs in a copy of this context so its span nests here
+                    contexts = [contextvars.copy_context() for _ in batches]
+                    results = list(executor.map(lambda context, batch: context.run(run, batch), contexts, batches))
+
+            new_entries = {}
+            for batch, embedded in results:
+                for (key, _), vector in zip(batch, embedded):
+                    vectors[key] = vector
+                    new_entries[key] = array('f', vector).tobytes()
+            self.cache.set_many(new_entries)
+
+            with self._lock:
+                self.batches += len(batches)
+                self.batched_texts += len(items)
+                self.max_batch = max(self.max_batch, max(len(batch) for batch in batches))
+
+        return [vectors[key] for key in keys]
+
+    @staticmethod
+    def _decode(value):
+        vector = array('f')
+        vector.frombytes(value)
+        return vector.tolist()
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from langchain_core.messages import AIMessage, HumanMessage
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+_tokenizer = None
+_tokenizer_loaded = False
+
+_CJK = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯]')
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a user and an assistant.
+Keep names, numbers, decisions and open questions; drop small talk. Answer with the summary only.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}
+"""
+
+
+def _get_tokenizer():
+    # Loaded on first use: the tokenizer files make importing this module slow
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        try:
+            from dashscope import get_tokenizer
+            _tokenizer = get_tokenizer('qwen-turbo')
+        except Exception:  # tokenizer files unavailable; fall back to an estimate
+            _tokenizer = None
+        _tokenizer_loaded = True
+    return _tokenizer
+
+
+def count_tokens(text):
+    """Qwen token count, or an estimate (1 per CJK character, ~4 characters otherwise)."""
+    if not text:
+        return 0
+    if not isinstance(text, str):
+        text = str(text)
+    tokenizer = _get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text))
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class HistoryManager:
+    """Keeps the chat history sent to the LLM within a token budget.
+
+    The most recent turns are kept verbatim up to ``budget_tokens``. Older
+    turns are folded into a rolling summary that is cached by a hash of the
+    folded turns, so it is only reused for a history that starts with exactly
+    those turns, and extended incrementally with only the newly folded turns.
+    Folding happens in blocks, down to ``keep_ratio`` of the budget, so the
+    summary is not regenerated on every turn. Summaries are generated through
+    the chat backend and router when given, like other chat calls.
+    """
+
+    def __init__(self, llm, budget_tokens=None, keep_ratio=0.5, max_sessions=1024, backend=None, router=None):
+        self.llm = llm
+        self.backend = backend
+        self.router = router
+        self.budget_tokens = int(budget_tokens or os.getenv('HISTORY_TOKEN_BUDGET', 2000))
+        self.keep_ratio = keep_ratio
+        self.max_sessions = max_sessions
+        self._summaries = OrderedDict()  # hash of the folded turns -> (folded turn count, summary)
+        self._lock = threading.Lock()
+
+    def build(self, history):
+        """Return (summary, messages) for the given Gradio (user, assistant) history."""
+        turns = [(user, assistant) for user, assistant in history]
+        if not turns:
+            return "", []
+        turn_tokens = [count_tokens(user) + count_tokens(assistant) for user, assistant in turns]
+
+        prefix_keys = self._prefix_keys(turns)
+        folded, summary = 0, ""
+        with self._lock:
+            # The longest folded prefix this history still starts with, leaving a turn verbatim
+            for count in range(len(turns) - 1, 0, -1):
+                entry = self._summaries.get(prefix_keys[count])
+                if entry is not None:
+                    folded, summary = entry
+                    self._summaries.move_to_end(prefix_keys[count])
+                    break
+
+        if sum(turn_tokens[folded:]) > self.budget_tokens:
+            # Fold the oldest verbatim turns until the rest fits in keep_ratio of the budget
+            target = self.budget_tokens * self.keep_ratio
+            split = folded
+            remaining = sum(turn_tokens[folded:])
+            while split < len(turns) - 1 and remaining > target:
+                remaining -= turn_tokens[split]
+                split += 1
+            # The newest turn is always kept verbatim, so with nothing older left to fold
+            # an oversized last turn is passed through as it is
+            if split > folded:
+                summary = self._summarize(summary, turns[folded:split])
+                folded = split
+                with self._lock:
+                    self._summaries[prefix_keys[folded]] = (folded, summary)
+                    self._summaries.move_to_end(prefix_keys[folded])
+                    while len(self._summaries) > self.max_sessions:
+                        self._summaries.popitem(last=False)
+
+        messages = []
+        for user, assistant in turns[folded:]:
+            if user is not None:
+                messages.append(HumanMessage(content=user))
+            if assistant is not None:
+                messages.append(AIMessage(content=assistant))
+        return summary, messages
+
+    def _summarize(self, summary, turns):
+        lines = []
+        for user, assistant in turns:
+            if user is not None:
+                lines.append(f"User: {user}")
+            if assistant is not None:
+                lines.append(f"Assistant: {assistant}")
+        prompt = SUMMARY_PROMPT.format(summary=summary or "(empty)", turns="\n".join(lines))
+        messages = [HumanMessage(content=prompt)]
+
+        def generate(model=None):
+            kwargs = {'model': model} if model else {}
+            if self.backend is not None:
+                return self.backend.call(self.llm.invoke, messages, **kwargs).content
+            return self.llm.invoke(messages, **kwargs).content
+
+        if self.router is None:
+            return generate()
+        return self.router.run(self.router.route(prompt_tokens=count_tokens(prompt)), generate)
+
+    @staticmethod
+    def _prefix_keys(turns):
+        """keys[n] identifies the first n turns."""
+        digest = hashlib.sha256()
+        keys = [digest.hexdigest()]
+        for turn in turns:
+            digest.update(repr(turn).encode('utf-8'))
+            keys.append(digest.copy().hexdigest())
+        return keys
@@ -0,0 +1,170 @@
+import http.client
+import os
+import threading
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+
+from tracing import register_collector
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Errors that mean a pooled keep-alive socket was closed by the server
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    http.client.BadStatusLine,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+
+class HTTPConnectionPool:
+    """Thread-safe pool of persistent keep-alive connections to a single host.
+
+    Up to ``maxsize`` idle connections are kept for reuse; extra concurrent
+    requests open temporary connections that are closed afterwards. Idle
+    connections older than ``idle_timeout`` seconds are evicted, and a request
+    on a stale socket is retried once on a fresh connection.
+    """
+
+    def __init__(self, host, port=None, scheme='http', maxsize=4,
+                 idle_timeout=60, timeout=30):
+        self.host = host
+        self.port = port
+        self.scheme = scheme
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+
+        self._idle = deque()  # (connection, last_used)
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.evictions = 0
+        self.connect_time = 0.0
+
+    def request(self, method, url, body=None, headers=None, encode_chunked=False):
+        """Send a request and return (status, reason, body) with the body read.
+
+        ``body`` may also be a zero-argument callable returning the body, e.g. a
+        generator factory for chunked uploads, so it can be replayed on retry.
+        """
+        conn, reused = self._acquire()
+        try:
+            try:
+                response = self._send(conn, method, url, body, headers, encode_chunked)
+            except STALE_CONNECTION_ERRORS:
+                # Only a reused socket can be stale, and only a replayable body can be resent
+                conn.close()
+                if not reused or not (callable(body) or isinstance(body, (bytes, bytearray, memoryview, str, type(None)))):
+                    raise
+                with self._lock:
+                    self.reconnects += 1
+                conn = self._connect()
+                response = self._send(conn, method, url, body, headers, encode_chunked)
+            data = response.read()
+        except Exception:
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+        return response.status, response.reason, data
+
+    def stats(self):
+        with self._lock:
+            return {
+                'host': self.host,
+                'requests': self.requests,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / self.requests if self.requests else 0.0,
+                'reconnects': self.reconnects,
+                'evictions': self.evictions,
+                'idle': len(self._idle),
+                'avg_connect_ms': 1000 * self.connect_time / self.misses if self.misses else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._idle.popleft()[0].close()
+
+    def _send(self, conn, method, url, body, headers, encode_chunked):
+        if callable(body):
+            body = body()
+        conn.request(method, url, body=body, headers=headers or {},
+                     encode_chunked=encode_chunked)
+        return conn.getresponse()
+
+    def _acquire(self):
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            # Most recently used connections are the least likely to be stale
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                if now - last_used <= self.idle_timeout:
+                    self.hits += 1
+                    return conn, True
+                self.evictions += 1
+                conn.close()
+            self.misses += 1
+        return self._connect(), False
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def _connect(self):
+        if self.scheme == 'https':
+            conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        start_time = time.perf_counter()
+        conn.connect()
+        elapsed = time.perf_counter() - start_time
+        with self._lock:
+            self.connect_time += elapsed
+        return conn
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(host, port=None, scheme='http'):
+    """Return the process-wide pool for a host, creating it on first use."""
+    key = (scheme, host, port)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = HTTPConnectionPool(
+                host, port=port, scheme=scheme,
+                maxsize=int(os.getenv('HTTP_POOL_SIZE', 4)),
+                idle_timeout=float(os.getenv('HTTP_POOL_IDLE_TIMEOUT', 60)),
+                timeout=float(os.getenv('HTTP_POOL_TIMEOUT', 30)),
+            )
+            _pools[key] = pool
+        return pool
+
+
+def pool_stats():
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
+
+
+register_collector('http_pool', pool_stats)
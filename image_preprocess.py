@@ -0,0 +1,116 @@
+import base64
+import io
+import os
+import time
+from dataclasses import dataclass, field
+
+from PIL import Image, ImageOps
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+
+
+@dataclass
+class PreprocessedImage:
+    data: bytes
+    format: str
+    original_bytes: int
+    width: int
+    height: int
+    timings: dict = field(default_factory=dict)  # stage -> seconds
+    inline: bool = False
+
+    @property
+    def extension(self):
+        return FORMAT_EXTENSIONS.get(self.format, '.' + self.format.lower())
+
+    @property
+    def bytes_saved(self):
+        return self.original_bytes - len(self.data)
+
+    def data_uri(self):
+        encoded = base64.b64encode(self.data).decode('ascii')
+        return f"data:image/{self.format.lower()};base64,{encoded}"
+
+    def report(self):
+        stages = ', '.join(f"{name}={1000 * seconds:.1f}ms" for name, seconds in self.timings.items())
+        return (f"{self.original_bytes} -> {len(self.data)} bytes "
+                f"({self.bytes_saved} saved, {self.width}x{self.height}); {stages}")
+
+
+class ImagePreprocessor:
+    """Shrinks images before they are uploaded and sent to Qwen-VL.
+
+    Stages: decode, EXIF-aware orientation, downscale to ``max_side``,
+    re-encode to ``format``/``quality`` without metadata. Results of at most
+    ``inline_max_bytes`` are marked inline so the caller can send them as a
+    data URI instead of uploading to OSS (0 disables inline mode).
+    """
+
+    def __init__(self, max_side=None, quality=None, format=None,
+                 strip_metadata=True, inline_max_bytes=None):
+        self.max_side = int(max_side or os.getenv('IMAGE_MAX_SIDE', 1536))
+        self.quality = int(quality or os.getenv('IMAGE_QUALITY', 85))
+        self.format = (format or os.getenv('IMAGE_FORMAT', 'JPEG')).upper()
+        self.strip_metadata = strip_metadata
+        self.inline_max_bytes = int(inline_max_bytes if inline_max_bytes is not None
+                                    else os.getenv('IMAGE_INLINE_MAX_BYTES', 0))
+
+    def settings_key(self):
+        """The settings that change the processed image, for result cache keys."""
+        return f"{self.max_side}-{self.quality}-{self.format}-{int(self.strip_metadata)}"
+
+    def process(self, file_path):
+        timings = {}
+        original_bytes = os.path.getsize(file_path)
+
+        start = time.perf_counter()
+        # The file is closed once the pixels are loaded
+        with Image.open(file_path) as image:
+            if getattr(image, 'is_animated', False):
+                # Keep animations intact; only the first frame would survive re-encoding
+                with open(file_path, 'rb') as f:
+                    data = f.read()
+                timings['decode'] = time.perf_counter() - start
+                return self._result(data, image.format, original_bytes, image.size, timings)
+            # Let the JPEG decoder downscale by a power of two while decoding
+            image.draft('RGB', (self.max_side, self.max_side))
+            exif = image.info.get('exif')
+            image.load()
+        timings['decode'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        image = ImageOps.exif_transpose(image)
+        timings['orient'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if max(image.size) > self.max_side:
+            image.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+        timings['resize'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if self.format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = self._flatten(image)
+        buffer = io.BytesIO()
+        save_kwargs = {'quality': self.quality, 'optimize': True}
+        if not self.strip_metadata and exif:
+            save_kwargs['exif'] = exif
+        image.save(buffer, format=self.format, **save_kwargs)
+        timings['encode'] = time.perf_counter() - start
+
+        return self._result(buffer.getvalue(), self.format, original_bytes, image.size, timings)
+
+    def _result(self, data, format, original_bytes, size, timings):
+        return PreprocessedImage(data=data, format=format, original_bytes=original_bytes,
+                                 width=size[0], height=size[1], timings=timings,
+                                 inline=0 < len(data) <= self.inline_max_bytes)
+
+    @staticmethod
+    def _flatten(image):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
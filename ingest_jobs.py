@@ -0,0 +1,289 @@
+import contextvars
+import multiprocessing
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from dotenv import load_dotenv
+
+from async_pipeline import in_flight
+from document_loading import assign_chunk_ids, ingest_hash, load_documents, split_documents
+from embedding_cache import CachedEmbeddings
+from tracing import span
+
+# Load environment variables from .env file
+load_dotenv()
+
+JOB_COLUMNS = ('id', 'name', 'path', 'status', 'attempts', 'created', 'started', 'finished',
+               'pages', 'chunks_total', 'duplicates', 'chunks_embedded', 'rows_inserted',
+               'rows_deleted', 'error', 'retry_at')
+
+
+def parse_upload(path, chunk_size, chunk_overlap):
+    """Load and split one uploaded file in a worker process; returns (pages, chunks)."""
+    documents = load_documents(path, fallback=True)
+    return len(documents), split_documents(documents, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+class IngestJobQueue:
+    """Persistent queue of knowledge-upload jobs, run by background workers.
+
+    Jobs and their progress live in SQLite, so they survive restarts: jobs
+    that were running are queued again when the queue starts, and resume
+    from the chunks they had already inserted (recorded per batch). A failed
+    job is queued again with exponential backoff until it has been tried
+    ``max_attempts`` times. Parsing runs in a separate (spawned) process so it
+    does not compete with chat for the GIL,
+    and before each batch a worker waits (up to ``yield_seconds``) while chat
+    requests are in flight.
+    """
+
+    def __init__(self, get_service, path=None, workers=None, batch_size=None,
+                 max_attempts=None, yield_seconds=None, retry_seconds=None):
+        self.get_service = get_service
+        self.path = path or os.getenv('INGEST_JOBS_DB', os.path.join('.ingest', 'jobs.sqlite'))
+        self.workers = int(workers or os.getenv('INGEST_JOB_WORKERS', 1))
+        self.batch_size = int(batch_size or os.getenv('INGEST_JOB_BATCH_SIZE', 32))
+        self.max_attempts = int(max_attempts or os.getenv('INGEST_JOB_MAX_ATTEMPTS', 3))
+        self.yield_seconds = float(yield_seconds if yield_seconds is not None
+                                   else os.getenv('INGEST_JOB_YIELD_SECONDS', 1.0))
+        self.retry_seconds = float(retry_seconds if retry_seconds is not None
+                                   else os.getenv('INGEST_JOB_RETRY_SECONDS', 5.0))
+        self.chunk_size = int(os.getenv('CHUNK_SIZE', 1000))
+        self.chunk_overlap = int(os.getenv('CHUNK_OVERLAP', 0))
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL,
+                started REAL,
+                finished REAL,
+                pages INTEGER NOT NULL DEFAULT 0,
+                chunks_total INTEGER NOT NULL DEFAULT 0,
+                duplicates INTEGER NOT NULL DEFAULT 0,
+                chunks_embedded INTEGER NOT NULL DEFAULT 0,
+                rows_inserted INTEGER NOT NULL DEFAULT 0,
+                rows_deleted INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                retry_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+            CREATE TABLE IF NOT EXISTS job_chunks (
+                job_id TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                PRIMARY KEY (job_id, chunk_id)
+            );
+        """)
+        # Queues created before retries were added lack the column
+        if 'retry_at' not in {row[1] for row in self._conn.execute('PRAGMA table_info(jobs)')}:
+            with self._conn:
+                self._conn.execute('ALTER TABLE jobs ADD COLUMN retry_at REAL')
+        self._threads = []
+        self._parser = None
+        self._stopping = False
+
+    def start(self):
+        """Requeue jobs interrupted by a restart and start the workers."""
+        with self._lock:
+            if self._threads:
+                return self
+            with self._conn:
+                resumed = self._conn.execute(
+                    "UPDATE jobs SET status = 'queued' WHERE status = 'running'").rowcount
+            self._parser = self._new_parser()
+            for index in range(self.workers):
+                thread = threading.Thread(target=contextvars.copy_context().run, args=(self._worker,),
+                                          name=f'ingest-job-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        if resumed:
+            print(f"Resuming {resumed} interrupted ingestion job(s)")
+        return self
+
+    def stop(self):
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join()
+        if self._parser is not None:
+            self._parser.shutdown()
+
+    def submit(self, path, name=None):
+        """Queue a file for ingestion and return the job id."""
+        job_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            with self._conn:
+                self._conn.execute('INSERT INTO jobs (id, name, path, status, created) VALUES (?, ?, ?, ?, ?)',
+                                   (job_id, name or os.path.basename(path), os.path.abspath(path), 'queued',
+                                    time.time()))
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?",
+                                     (job_id,)).fetchone()
+        return self._describe(row) if row else None
+
+    def list_jobs(self, limit=20):
+        """Most recent jobs first, with progress and throughput."""
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs ORDER BY created DESC LIMIT ?",
+                                      (limit,)).fetchall()
+        return [self._describe(row) for row in rows]
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status'))
+        return {status: counts.get(status, 0) for status in ('queued', 'running', 'done', 'failed')}
+
+    def _describe(self, row):
+        job = dict(zip(JOB_COLUMNS, row))
+        end = job['finished'] or time.time()
+        job['elapsed'] = end - job['started'] if job['started'] else 0.0
+        job['rows_per_second'] = job['rows_inserted'] / job['elapsed'] if job['elapsed'] else 0.0
+        return job
+
+    def _update(self, job_id, **fields):
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+
+    def _claim(self):
+        """Take the oldest queued job that is due, waiting until there is one; None when stopping."""
+        with self._lock:
+            while not self._stopping:
+                now = time.time()
+                row = self._conn.execute(
+                    "SELECT id, path, attempts FROM jobs WHERE status = 'queued' "
+                    "AND (retry_at IS NULL OR retry_at <= ?) ORDER BY created LIMIT 1", (now,)).fetchone()
+                if row is not None:
+                    with self._conn:
+                        self._conn.execute(
+                            "UPDATE jobs SET status = 'running', attempts = attempts + 1, retry_at = NULL, "
+                            "started = COALESCE(started, ?), error = NULL WHERE id = ?", (now, row[0]))
+                    return row[0], row[1], row[2] + 1
+                # Wake up for new jobs, or when the next retry is due
+                next_retry = self._conn.execute(
+                    "SELECT MIN(retry_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+                self._wakeup.wait(timeout=min(5.0, max(0.05, next_retry - now)) if next_retry else 5.0)
+        return None
+
+    def _worker(self):
+        while True:
+            claimed = self._claim()
+            if claimed is None:
+                return
+            job_id, path, attempt = claimed
+            if attempt > self.max_attempts:
+                self._update(job_id, status='failed', finished=time.time(),
+                             error=f"Gave up after {self.max_attempts} attempts")
+                continue
+            try:
+                with span('ingest_job'):
+                    self._run(job_id, path)
+            except Exception as e:
+                if attempt < self.max_attempts:
+                    # Chunks already inserted are recorded, so the retry resumes after them
+                    delay = random.uniform(0.5, 1.0) * self.retry_seconds * 2 ** (attempt - 1)
+                    print(f"Ingestion job {job_id} failed (attempt {attempt}/{self.max_attempts}), "
+                          f"retrying in {delay:.0f} s: {e}")
+                    self._update(job_id, status='queued', retry_at=time.time() + delay, error=str(e))
+                else:
+                    print(f"Ingestion job {job_id} failed after {attempt} attempts: {e}")
+                    self._update(job_id, status='failed', finished=time.time(), error=str(e))
+            else:
+                with self._lock, self._conn:
+                    self._conn.execute('DELETE FROM job_chunks WHERE job_id = ?', (job_id,))
+
+    def _run(self, job_id, path):
+        service = self.get_service()
+        content_hash = ingest_hash(path, self.chunk_size, self.chunk_overlap)
+        if service.manifest.file_hash(path) == content_hash:
+            self._update(job_id, status='done', finished=time.time())
+            return
+
+        with span('ingest_parse'):
+            pages, docs = self._parse(path)
+        assign_chunk_ids(docs)
+
+        # Chunks inserted before an interruption are not sent again
+        with self._lock:
+            done_ids = {row[0] for row in self._conn.execute(
+                'SELECT chunk_id FROM job_chunks WHERE job_id = ?', (job_id,))}
+        new_docs, chunk_ids, to_delete, dropped = service._plan_file(
+            path, docs, lambda chunk_ids, to_insert, to_delete: (
+                [chunk_id for chunk_id in to_insert if chunk_id not in done_ids], to_delete))
+        self._update(job_id, pages=pages, chunks_total=len(chunk_ids), duplicates=dropped,
+                     chunks_embedded=len(done_ids), rows_inserted=len(done_ids))
+
+        service._delete_chunks(to_delete)
+        self._update(job_id, rows_deleted=len(to_delete))
+
+        # Embedding first (into the embedding cache) lets the status tell it apart from inserting
+        embeddings = service.vector_db.embeddings
+        embedded = inserted = len(done_ids)
+        for start in range(0, len(new_docs), self.batch_size):
+            batch = new_docs[start:start + self.batch_size]
+            self._yield_to_chat()
+            if isinstance(embeddings, CachedEmbeddings):
+                embeddings.embed_documents([doc.page_content for doc in batch])
+                embedded += len(batch)
+                self._update(job_id, chunks_embedded=embedded)
+            service._insert_chunks(batch)
+            # A batch is recorded as done only once the lexical index has it on disk too
+            service.lexical_index.save()
+            inserted += len(batch)
+            with self._lock, self._conn:
+                self._conn.executemany('INSERT OR IGNORE INTO job_chunks (job_id, chunk_id) VALUES (?, ?)',
+                                       [(job_id, doc.metadata['chunk_id']) for doc in batch])
+                self._conn.execute('UPDATE jobs SET chunks_embedded = ?, rows_inserted = ? WHERE id = ?',
+                                   (max(embedded, inserted), inserted, job_id))
+
+        service._commit_file(path, content_hash, chunk_ids)
+        self._update(job_id, status='done', finished=time.time())
+        print(f"Ingestion job {job_id} done: {inserted} inserted, {len(to_delete)} deleted, "
+              f"{dropped} duplicates dropped")
+
+    def _new_parser(self):
+        # Parsing gets its own processes, one per worker; they are spawned, since
+        # forking this threaded server process can deadlock the child
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def _parse(self, path):
+        """Parse a file on the process pool, replacing the pool if a worker died."""
+        for attempt in range(2):
+            parser = self._parser
+            try:
+                return parser.submit(parse_upload, path, self.chunk_size, self.chunk_overlap).result()
+            except BrokenProcessPool:
+                # A crashed worker breaks the pool for every later job; the file is
+                # tried once more on a new pool, then the job fails and is retried
+                with self._lock:
+                    if self._parser is parser and not self._stopping:
+                        print("Ingestion parse worker died; starting a new parser pool")
+                        self._parser = self._new_parser()
+                        parser.shutdown(wait=False)
+                if attempt:
+                    raise
+
+    def _yield_to_chat(self):
+        # Background ingestion gives way to interactive requests, but not forever
+        deadline = time.monotonic() + self.yield_seconds
+        while in_flight('chat') > 0 and time.monotonic() < deadline:
+            time.sleep(0.02)
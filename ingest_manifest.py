@@ -0,0 +1,92 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+def chunk_id_for(text):
+    """Stable vector-store id derived from the chunk content."""
+    return str(uuid.uuid5(uuid.NAMESPACE_OID, hashlib.sha256(text.encode('utf-8')).hexdigest()))
+
+
+class IngestManifest:
+    """SQLite record of what has been ingested into the vector store.
+
+    Stores a content hash per file and the chunk ids each file contributed.
+    Chunk ids are derived from chunk content, so identical chunks from
+    different files share one row in the vector store and are only deleted
+    once no file references them anymore.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('INGEST_MANIFEST', os.path.join('.ingest', 'manifest.sqlite'))
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS file_chunks (
+                path TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                PRIMARY KEY (path, chunk_id)
+            );
+            CREATE INDEX IF NOT EXISTS file_chunks_chunk_id ON file_chunks (chunk_id);
+        """)
+
+    def file_hash(self, path):
+        with self._lock:
+            row = self._conn.execute('SELECT content_hash FROM files WHERE path = ?', (path,)).fetchone()
+        return row[0] if row else None
+
+    def chunk_ids(self, path):
+        with self._lock:
+            rows = self._conn.execute('SELECT chunk_id FROM file_chunks WHERE path = ?', (path,)).fetchall()
+        return [row[0] for row in rows]
+
+    def files_under(self, dir_path):
+        prefix = os.path.join(dir_path, '')
+        with self._lock:
+            rows = self._conn.execute('SELECT path FROM files WHERE substr(path, 1, ?) = ?',
+                                      (len(prefix), prefix)).fetchall()
+        return [row[0] for row in rows]
+
+    def plan(self, path, chunk_ids):
+        """Return (ids_to_insert, ids_to_delete) to make path contribute chunk_ids."""
+        new_ids = set(chunk_ids)
+        with self._lock:
+            old_ids = {row[0] for row in self._conn.execute(
+                'SELECT chunk_id FROM file_chunks WHERE path = ?', (path,))}
+            to_insert = [chunk_id for chunk_id in dict.fromkeys(chunk_ids)
+                         if chunk_id not in old_ids and not self._referenced(chunk_id, path)]
+            to_delete = [chunk_id for chunk_id in old_ids - new_ids
+                         if not self._referenced(chunk_id, path)]
+        return to_insert, to_delete
+
+    def commit(self, path, content_hash, chunk_ids):
+        """Record that path (with content_hash) now contributes exactly chunk_ids."""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM file_chunks WHERE path = ?', (path,))
+            self._conn.executemany('INSERT OR IGNORE INTO file_chunks (path, chunk_id) VALUES (?, ?)',
+                                   [(path, chunk_id) for chunk_id in chunk_ids])
+            self._conn.execute('INSERT OR REPLACE INTO files (path, content_hash, updated_at) VALUES (?, ?, ?)',
+                               (path, content_hash, time.time()))
+
+    def remove(self, path):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM file_chunks WHERE path = ?', (path,))
+            self._conn.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def _referenced(self, chunk_id, excluding_path):
+        return self._conn.execute('SELECT 1 FROM file_chunks WHERE chunk_id = ? AND path != ? LIMIT 1',
+                                  (chunk_id, excluding_path)).fetchone() is not None
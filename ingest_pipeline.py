@@ -0,0 +1,250 @@
+import contextvars
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from dotenv import load_dotenv
+
+from document_loading import parse_file
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+class IngestionPipeline:
+    """Streaming bulk ingestion into an LLMService's vector store.
+
+    Files are hashed, parsed and split on a process pool; at most two files
+    per worker are in flight. New chunks go through a bounded queue of
+    batches to threads that embed and insert them, so memory stays bounded
+    whatever the corpus size: when inserts fall behind, the queue fills up
+    and parsing pauses.
+
+    A file is committed to the manifest only once all of its batches are
+    inserted, and all chunks it shares with other files of the run that were
+    queued by those files, so a file that fails is retried on the next run.
+    Parse workers are spawned rather than forked, as forking a threaded
+    server process can deadlock the child.
+    """
+
+    def __init__(self, service, parse_workers=None, insert_workers=None,
+                 batch_size=None, queue_batches=None, progress_interval=None):
+        self.service = service
+        self.parse_workers = int(parse_workers or os.getenv('INGEST_PARSE_WORKERS', os.cpu_count() or 1))
+        self.insert_workers = int(insert_workers or os.getenv('INGEST_INSERT_WORKERS', 4))
+        self.batch_size = int(batch_size or os.getenv('INGEST_BATCH_SIZE', 64))
+        self.queue_batches = int(queue_batches or os.getenv('INGEST_QUEUE_BATCHES', 8))
+        self.progress_interval = float(progress_interval or os.getenv('INGEST_PROGRESS_SECONDS', 5))
+        self._lock = threading.Lock()
+
+    def run(self, paths, chunk_size=1000, chunk_overlap=0):
+        """Ingest paths and return the final stats()."""
+        self._reset(len(paths))
+        batches = queue.Queue(maxsize=self.queue_batches)
+        # Workers run in copies of this context so their tracing spans nest here
+        workers = [threading.Thread(target=contextvars.copy_context().run, args=(self._insert_worker, batches),
+                                    daemon=True)
+                   for _ in range(self.insert_workers)]
+        for worker in workers:
+            worker.start()
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.parse_workers,
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                pending = set()
+                for path in paths:
+                    if len(pending) >= 2 * self.parse_workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self._handle_parsed(future, batches)
+                    future = executor.submit(parse_file, path, chunk_size, chunk_overlap,
+                                             self.service.manifest.file_hash(path))
+                    future.path = path
+                    pending.add(future)
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._handle_parsed(future, batches)
+        finally:
+            for _ in workers:
+                batches.put(None)
+            for worker in workers:
+                worker.join()
+            self.service.lexical_index.save()
+
+        stats = self.stats()
+        self._report(stats, final=True)
+        return stats
+
+    def stats(self):
+        with self._lock:
+            elapsed = max(time.perf_counter() - self._start, 1e-9)
+            return {
+                'files_total': self._files_total,
+                'files_parsed': self._files_parsed,
+                'files_skipped': self._files_skipped,
+                'files_failed': self._parse_failures + self._insert_failures,
+                'parse_failures': self._parse_failures,
+                'files_committed': self._files_committed,
+                'chunks': self._chunks,
+                'duplicates_dropped': self._duplicates,
+                'inserted': self._inserted,
+                'deleted': self._deleted,
+                'elapsed': elapsed,
+                'files_per_second': self._files_parsed / elapsed,
+                'chunks_per_second': self._chunks / elapsed,
+                'inserts_per_second': self._inserted / elapsed,
+                'insert_seconds': self._insert_seconds,
+            }
+
+    def _reset(self, files_total):
+        with self._lock:
+            self._start = time.perf_counter()
+            self._last_report = self._start
+            self._files_total = files_total
+            self._files_parsed = self._files_skipped = self._files_committed = 0
+            self._parse_failures = self._insert_failures = 0
+            self._chunks = self._duplicates = self._inserted = self._deleted = 0
+            self._insert_seconds = 0.0
+            self._queued_ids = set()  # chunk ids inserted or queued by this run
+            self._inserted_ids = set()  # chunk ids inserted by this run
+            self._deleted_ids = set()  # chunk ids deleted by this run
+            # path -> [batches left, content_hash, chunk_ids, ids queued by other files not inserted yet]
+            self._remaining = {}
+            self._waiters = defaultdict(set)  # chunk id -> paths waiting for another file to insert it
+            self._failed_paths = set()
+
+    def _handle_parsed(self, future, batches):
+        """Plan a parsed file against the manifest and queue its new chunks."""
+        try:
+            path, content_hash, docs = future.result()
+        except Exception as e:
+            print(f"Failed to parse {future.path}: {e}")
+            with self._lock:
+                self._parse_failures += 1
+            return
+        if docs is None:
+            with self._lock:
+                self._files_skipped += 1
+            return
+
+        chunks = len(docs)
+        waiting = set()
+
+        def adjust(chunk_ids, to_insert, to_delete):
+            with self._lock:
+                # The manifest only knows committed files: chunks queued for another
+                # file of this run must not be inserted twice or deleted, and chunks
+                # deleted earlier in this run must be inserted again if still used
+                # (and this file must wait for them to be inserted before it is committed)
+                waiting.update(chunk_id for chunk_id in to_insert
+                               if chunk_id in self._queued_ids and chunk_id not in self._inserted_ids)
+                to_insert = [chunk_id for chunk_id in to_insert if chunk_id not in self._queued_ids]
+                to_insert += [chunk_id for chunk_id in dict.fromkeys(chunk_ids)
+                              if chunk_id in self._deleted_ids and chunk_id not in to_insert]
+                for chunk_id in waiting:
+                    self._waiters[chunk_id].add(path)
+                to_delete = [chunk_id for chunk_id in to_delete if chunk_id not in self._queued_ids]
+                self._queued_ids.update(to_insert)
+                self._deleted_ids.difference_update(to_insert)
+                self._deleted_ids.update(to_delete)
+            return to_insert, to_delete
+
+        new_docs, chunk_ids, to_delete, dropped = self.service._plan_file(path, docs, adjust)
+        with self._lock:
+            self._files_parsed += 1
+            self._chunks += chunks
+            self._duplicates += dropped
+            self._deleted += len(to_delete)
+        self.service._delete_chunks(to_delete)
+
+        file_batches = [new_docs[i:i + self.batch_size] for i in range(0, len(new_docs), self.batch_size)]
+        with self._lock:
+            # Chunks this file waits for may have been inserted (or failed) meanwhile
+            waiting.intersection_update(self._queued_ids - self._inserted_ids)
+            if path in self._failed_paths:
+                return
+            ready = not file_batches and not waiting
+            if not ready:
+                self._remaining[path] = [len(file_batches), content_hash, chunk_ids, waiting]
+        if ready:
+            self._commit(path, content_hash, chunk_ids)
+            return
+        for batch in file_batches:
+            # Blocks while the queue is full, which pauses parsing
+            batches.put((path, batch))
+        self._maybe_report()
+
+    def _insert_worker(self, batches):
+        while True:
+            item = batches.get()
+            if item is None:
+                return
+            path, batch = item
+            batch_ids = [doc.metadata['chunk_id'] for doc in batch]
+            start = time.perf_counter()
+            try:
+                self.service._insert_chunks(batch)
+            except Exception as e:
+                print(f"Failed to insert {len(batch)} chunks of {path}: {e}")
+                with self._lock:
+                    # Files relying on these chunks fail too; later files queue them again
+                    self._queued_ids.difference_update(batch_ids)
+                    failed = {path}
+                    for chunk_id in batch_ids:
+                        failed.update(self._waiters.pop(chunk_id, ()))
+                    for failed_path in failed:
+                        if failed_path not in self._failed_paths:
+                            self._failed_paths.add(failed_path)
+                            self._insert_failures += 1
+                        self._remaining.pop(failed_path, None)
+                continue
+
+            ready = []
+            with self._lock:
+                self._inserted += len(batch)
+                self._insert_seconds += time.perf_counter() - start
+                self._inserted_ids.update(batch_ids)
+                entry = self._remaining.get(path)
+                if entry is not None:
+                    entry[0] -= 1
+                    if entry[0] == 0 and not entry[3]:
+                        ready.append(path)
+                for chunk_id in batch_ids:
+                    for waiter in self._waiters.pop(chunk_id, ()):
+                        entry = self._remaining.get(waiter)
+                        if entry is not None:
+                            entry[3].discard(chunk_id)
+                            if entry[0] == 0 and not entry[3]:
+                                ready.append(waiter)
+                done = [(ready_path, self._remaining.pop(ready_path)) for ready_path in dict.fromkeys(ready)]
+            for done_path, entry in done:
+                self._commit(done_path, entry[1], entry[2])
+            self._maybe_report()
+
+    def _commit(self, path, content_hash, chunk_ids):
+        self.service._commit_file(path, content_hash, chunk_ids)
+        with self._lock:
+            self._files_committed += 1
+
+    def _maybe_report(self):
+        with self._lock:
+            now = time.perf_counter()
+            if now - self._last_report < self.progress_interval:
+                return
+            self._last_report = now
+        self._report(self.stats())
+
+    @staticmethod
+    def _report(stats, final=False):
+        done = stats['files_parsed'] + stats['files_skipped'] + stats['parse_failures']
+        print(f"Ingest {'done' if final else 'progress'}: {done}/{stats['files_total']} files "
+              f"({stats['files_skipped']} unchanged, {stats['files_failed']} failed), "
+              f"{stats['chunks']} chunks ({stats['duplicates_dropped']} duplicates dropped), "
+              f"{stats['inserted']} inserted, {stats['deleted']} deleted "
+              f"in {stats['elapsed']:.1f} s | {stats['files_per_second']:.2f} files/s, "
+              f"{stats['chunks_per_second']:.1f} chunks/s, {stats['inserts_per_second']:.1f} inserts/s")
@@ -1,11 +1,21 @@
 # -*- coding: UTF-8 -*-
-import http.client
+import contextvars
 import json
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import List, Optional
+from urllib.parse import urlencode
 
-from aliyunsdkcore.client import AcsClient
-from aliyunsdkcore.request import CommonRequest
-
-from audio_convert import convert_audio_to_wav
+from async_pipeline import get_session, iterate_blocking, run_blocking
+from audio_convert import audio_duration, stream_audio_to_pcm
+from audio_vad import stream_speech_segments
+from hashing import file_sha256
+from http_pool import get_pool
+from nls_token import get_token_manager
+from resilience import HTTPStatusError, get_backend
+from result_cache import TieredCache
+from tracing import register_collector, traced
 
 from dotenv import load_dotenv
 import os
@@ -14,107 +24,320 @@ import os
 load_dotenv()
 
 
+@dataclass
+class SegmentTranscription:
+    index: int
+    start: float  # seconds
+    end: float  # seconds
+    text: Optional[str]
+    latency: float  # seconds spent in the recognizer call
+    error: Optional[str] = None
+
+
+@dataclass
+class LongTranscription:
+    text: str
+    duration: float
+    wall_time: float
+    segments: List[SegmentTranscription] = field(default_factory=list)
+
 
 class IntelligentSpeech:
-    def __init__(self):
+    def __init__(self, token_manager=None, host=None):
         self.app_key = os.getenv('ALIBABA_NLS_APP_KEY')
-        self.token = self.obtain_token()
-        self.host = 'nls-gateway-ap-southeast-1.aliyuncs.com'
-        self.url = 'http://nls-gateway-ap-southeast-1.aliyuncs.com/stream/v1/asr'
+        # The token is fetched lazily and refreshed in the background
+        self.token_manager = token_manager or get_token_manager()
+        self.host = host or os.getenv('ALIBABA_NLS_GATEWAY', 'nls-gateway-ap-southeast-1.aliyuncs.com')
+        self.path = '/stream/v1/asr'
+        self.url = 'http://' + self.host + self.path
+        self.pool = get_pool(self.host)
+        # Timeouts, retries, hedging and a circuit breaker for gateway calls;
+        # recognition is idempotent, so slow requests may be hedged
+        self.backend = get_backend('nls', timeout=30, hedge=True)
+        # Transcripts keyed by audio content and recognition parameters
+        self.result_cache = TieredCache('asr')
+        register_collector('asr_cache', self.result_cache.stats)
+        # The one-sentence recognizer takes at most 60 s of audio; longer clips are split on silence
+        self.one_shot_seconds = float(os.getenv('NLS_ONE_SHOT_SECONDS', 55))
 
-    def obtain_token(self):
-        # Create an AcsClient instance.
-        client = AcsClient(
-            os.getenv('ALIBABA_ACCESS_KEY_ID'),
-            os.getenv('ALIBABA_ACCESS_KEY_SECRET'),
-            # "cn-shanghai"
-            "ap-southeast-1"
-        )
-
-        # Create a request and configure request parameters. 
-        request = CommonRequest()
-        request.set_method('POST')
-        # request.set_domain('nls-meta.cn-shanghai.aliyuncs.com')
-        request.set_domain("nlsmeta.ap-southeast-1.aliyuncs.com")
-        request.set_version('2019-07-17')
-        request.set_action_name('CreateToken')
-
-        try : 
-            response = client.do_action_with_exception(request)
-            # print(response)
-
-            jss = json.loads(response)
-            if 'Token' in jss and 'Id' in jss['Token']:
-                token = jss['Token']['Id']
-                # expireTime = jss['Token']['ExpireTime']
-                # print("token = " + token)
-                # print("expireTime = " + str(expireTime))
-                return token
-        except Exception as e:
-            return f"An error occurred: {str(e)}"
-
-        
-    def audio_transcription(self, audio_file, format='wav', sample_rate=16000,
-                            enable_punctuation_prediction=True,
-                            enable_inverse_text_normalization=True,
-                            enable_voice_detection=False):
-        
-        # Specify the audio file.
-        format = 'pcm'
+    @property
+    def token(self):
+        return self.token_manager.get_token()
 
-        # Configure the RESTful request parameters.
-        request = self.url + '?appkey=' + self.app_key
-        request = request + '&format=' + format
-        request = request + '&sample_rate=' + str(sample_rate)
+    def obtain_token(self):
+        return self.token_manager.get_token()
 
+    def build_request(self, sample_rate=16000,
+                      enable_punctuation_prediction=True,
+                      enable_inverse_text_normalization=True,
+                      enable_voice_detection=False):
+        """Return the request path with the RESTful query parameters for raw PCM."""
+        params = {
+            'appkey': self.app_key,
+            'format': 'pcm',
+            'sample_rate': sample_rate,
+        }
         if enable_punctuation_prediction :
-            request = request + '&enable_punctuation_prediction=' + 'true'
+            params['enable_punctuation_prediction'] = 'true'
         if enable_inverse_text_normalization :
-            request = request + '&enable_inverse_text_normalization=' + 'true'
+            params['enable_inverse_text_normalization'] = 'true'
         if enable_voice_detection :
-            request = request + '&enable_voice_detection=' + 'true'
+            params['enable_voice_detection'] = 'true'
+        return self.path + '?' + urlencode(params)
+
+    def is_long_audio(self, audio_file):
+        duration = audio_duration(audio_file)
+        return duration is not None and duration > self.one_shot_seconds
 
-        print('Request: ' + request)
+    def long_transcription_text(self, audio_file, sample_rate=16000,
+                                enable_punctuation_prediction=True,
+                                enable_inverse_text_normalization=True):
+        """Text of transcribe_long_audio; raises if no segment could be recognized."""
+        result = self.transcribe_long_audio(audio_file, sample_rate=sample_rate,
+                                            enable_punctuation_prediction=enable_punctuation_prediction,
+                                            enable_inverse_text_normalization=enable_inverse_text_normalization)
+        failed = [segment for segment in result.segments if segment.error]
+        if failed and len(failed) == len(result.segments):
+            raise RuntimeError(f"Recognizer failed on all {len(failed)} segments: {failed[0].error}")
+        if failed:
+            print(f"Recognizer failed on {len(failed)} of {len(result.segments)} segments; "
+                  f"first error: {failed[0].error}")
+        return result.text, not failed
 
-        pcm_1_wav_content = convert_audio_to_wav(audio_file)
+    def transcription_key(self, audio_file, sample_rate=16000,
+                          enable_punctuation_prediction=True,
+                          enable_inverse_text_normalization=True,
+                          enable_voice_detection=False):
+        """Result cache key: a hash of the audio plus the parameters that shape the transcript."""
+        flags = ''.join('1' if flag else '0' for flag in (enable_punctuation_prediction,
+                                                         enable_inverse_text_normalization,
+                                                         enable_voice_detection))
+        return f"{file_sha256(audio_file)}:{sample_rate}:{flags}"
 
+    @traced('asr_recognize')
+    def recognize(self, request, body, encode_chunked=False):
+        """POST PCM to the gateway and return (status_code, reason, response body).
 
+        The response body is parsed JSON when possible, otherwise the raw bytes.
+        """
         # Configure the HTTP request header.
+        token = self.token
         httpHeaders = {
-            'X-NLS-Token': self.token,
+            'X-NLS-Token': token,
             'Content-type': 'application/octet-stream',
-            'Content-Length': len(pcm_1_wav_content)
             }
 
+        # Reuse a pooled keep-alive connection to the gateway.
+        def post():
+            status_code, reason, data = self.pool.request(method='POST', url=request,
+                                                          body=body,
+                                                          headers=httpHeaders,
+                                                          encode_chunked=encode_chunked)
+            if status_code == 429 or status_code >= 500:
+                raise HTTPStatusError(status_code, reason)
+            return status_code, reason, data
+
+        status_code, reason, body = self.backend.call(post)
+        try:
+            body = json.loads(body)
+        except ValueError:
+            return status_code, reason, body
+
+        if body.get('status') == 40000001:
+            # Token rejected by the gateway; refetch on the next call
+            self.token_manager.invalidate(token)
+        return status_code, reason, body
+
+    @traced('asr')
+    def audio_transcription(self, audio_file, format='wav', sample_rate=16000,
+                            enable_punctuation_prediction=True,
+                            enable_inverse_text_normalization=True,
+                            enable_voice_detection=False):
+
+        # A clip seen before is answered from the result cache; the file is only
+        # hashed when the cache is on
+        cache_key = self.transcription_key(audio_file, sample_rate,
+                                           enable_punctuation_prediction,
+                                           enable_inverse_text_normalization,
+                                           enable_voice_detection) if self.result_cache.enabled else None
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        if self.is_long_audio(audio_file):
+            result, complete = self.long_transcription_text(audio_file, sample_rate,
+                                                            enable_punctuation_prediction,
+                                                            enable_inverse_text_normalization)
+            # A transcript with missing segments is not cached
+            if complete:
+                self.result_cache.set(cache_key, result)
+            return result
+
+        # Configure the RESTful request parameters.
+        request = self.build_request(sample_rate,
+                                     enable_punctuation_prediction,
+                                     enable_inverse_text_normalization,
+                                     enable_voice_detection)
 
-        # Use the http.client module for Python 3.x.
-        conn = http.client.HTTPConnection(self.host)
+        print('Request: ' + 'http://' + self.host + request)
 
-        conn.request(method='POST', url=request, body=pcm_1_wav_content, headers=httpHeaders)
+        # Raw PCM is streamed from the decoder with chunked transfer encoding.
+        def pcm_body():
+            return stream_audio_to_pcm(audio_file, sample_rate=sample_rate)
 
-        response = conn.getresponse()
+        status_code, reason, body = self.recognize(request, pcm_body, encode_chunked=True)
         print('Response status and response reason:')
-        print(response.status ,response.reason)
+        print(status_code, reason)
+
+        if not isinstance(body, dict):
+            print('The response is not json format string')
+            raise RuntimeError(f"Recognizer returned a non-JSON response ({status_code} {reason})")
+
+        print('Recognize response is:')
+        print(body)
+        status = body.get('status')
+        if status != 20000000:
+            print('Recognizer failed!')
+            raise RuntimeError(f"Recognizer failed: {status} {body.get('message')}")
+        result = body['result']
+        print('Recognize result: ' + result)
+
+        self.result_cache.set(cache_key, result)
+        return result
+
+    @traced('asr')
+    async def audio_transcription_async(self, audio_file, sample_rate=16000,
+                                        enable_punctuation_prediction=True,
+                                        enable_inverse_text_normalization=True,
+                                        enable_voice_detection=False,
+                                        route='chat'):
+        """Async variant of audio_transcription over the shared aiohttp session.
 
-        body = response.read()
+        Decoding and the token lookup run on the route's thread pool; the PCM
+        is streamed to the gateway with chunked transfer encoding.
+        """
+        def lookup():
+            key = self.transcription_key(audio_file, sample_rate,
+                                         enable_punctuation_prediction,
+                                         enable_inverse_text_normalization,
+                                         enable_voice_detection) if self.result_cache.enabled else None
+            cached = self.result_cache.get(key)
+            return key, cached, cached is None and self.is_long_audio(audio_file)
+
+        # Hashing the file, the disk tier and probing the duration are blocking
+        cache_key, cached, long_audio = await run_blocking(route, lookup)
+        if cached is not None:
+            return cached
+
+        if long_audio:
+            result, complete = await run_blocking(route, self.long_transcription_text, audio_file, sample_rate,
+                                                  enable_punctuation_prediction,
+                                                  enable_inverse_text_normalization)
+            if complete:
+                await run_blocking(route, self.result_cache.set, cache_key, result)
+            return result
+
+        request = self.build_request(sample_rate,
+                                     enable_punctuation_prediction,
+                                     enable_inverse_text_normalization,
+                                     enable_voice_detection)
+        token = await run_blocking(route, self.token_manager.get_token)
+
+        httpHeaders = {
+            'X-NLS-Token': token,
+            'Content-type': 'application/octet-stream',
+            }
+
+        async def post():
+            # Every attempt (retry or hedge) decodes the audio again
+            async def pcm_body():
+                async for chunk in iterate_blocking(route, stream_audio_to_pcm(audio_file, sample_rate=sample_rate)):
+                    yield chunk
+
+            async with get_session().post('http://' + self.host + request, data=pcm_body(),
+                                          headers=httpHeaders) as response:
+                if response.status == 429 or response.status >= 500:
+                    raise HTTPStatusError(response.status, response.reason)
+                return response.status, await response.read()
+
+        status, body = await self.backend.acall(post)
         try:
-            print('Recognize response is:')
             body = json.loads(body)
-            print(body)
+        except ValueError:
+            raise RuntimeError(f"Recognizer returned a non-JSON response ({status})")
+        if body.get('status') == 40000001:
+            self.token_manager.invalidate(token)
+        if body.get('status') != 20000000:
+            raise RuntimeError(f"Recognizer failed: {body.get('status')} {body.get('message')}")
+        await run_blocking(route, self.result_cache.set, cache_key, body['result'])
+        return body['result']
 
-            status = body['status']
-            if status == 20000000 :
-                result = body['result']
-                print('Recognize result: ' + result)
-            else :
-                print('Recognizer failed!')
+    @traced('asr_long')
+    def transcribe_long_audio(self, audio_file, sample_rate=16000,
+                              max_segment_seconds=None, max_workers=None,
+                              enable_punctuation_prediction=True,
+                              enable_inverse_text_normalization=True):
+        """Transcribe a long recording by splitting it on silence.
 
-        except ValueError:
-            print('The response is not json format string')
+        Speech segments are found by energy-based VAD while the audio is
+        decoded, and recognized concurrently on a bounded thread pool as they
+        come; decoding pauses while enough segments are waiting, so memory
+        stays bounded by the VAD window and the segments in flight. The texts
+        are stitched back together in order.
+        """
+        max_segment_seconds = float(max_segment_seconds or os.getenv('NLS_MAX_SEGMENT_SECONDS', 50))
+        max_workers = int(max_workers or os.getenv('NLS_MAX_WORKERS', 4))
 
-        conn.close()
-        
-        return result
+        start_time = time.perf_counter()
+        request = self.build_request(sample_rate,
+                                     enable_punctuation_prediction,
+                                     enable_inverse_text_normalization)
+        samples = [0]
+
+        def counted(chunks):
+            for chunk in chunks:
+                samples[0] += len(chunk) // 2
+                yield chunk
+
+        def transcribe_segment(index, start, pcm):
+            segment_start = time.perf_counter()
+            text, error = None, None
+            try:
+                _, reason, body = self.recognize(request, pcm)
+                if isinstance(body, dict) and body.get('status') == 20000000:
+                    text = body['result']
+                elif isinstance(body, dict):
+                    error = f"{body.get('status')}: {body.get('message')}"
+                else:
+                    error = reason
+            except Exception as e:
+                error = str(e)
+            return SegmentTranscription(index=index,
+                                        start=start / sample_rate,
+                                        end=(start + len(pcm) // 2) / sample_rate,
+                                        text=text,
+                                        latency=time.perf_counter() - segment_start,
+                                        error=error)
+
+        futures, pending = [], set()
+        pcm_chunks = counted(stream_audio_to_pcm(audio_file, sample_rate=sample_rate))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for index, (start, pcm) in enumerate(stream_speech_segments(pcm_chunks, sample_rate=sample_rate,
+                                                                        max_segment_seconds=max_segment_seconds)):
+                # Back-pressure: a few segments queued per worker at most
+                while len(pending) >= 2 * max_workers:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                # Each segment runs in a copy of this context so its span nests here
+                future = executor.submit(contextvars.copy_context().run, transcribe_segment, index, start, pcm)
+                futures.append(future)
+                pending.add(future)
+            segments = [future.result() for future in futures]
+
+        text = ' '.join(segment.text for segment in segments if segment.text)
+        return LongTranscription(text=text,
+                                 duration=samples[0] / sample_rate,
+                                 wall_time=time.perf_counter() - start_time,
+                                 segments=segments)
 
 
 if __name__ == "__main__":
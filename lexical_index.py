@@ -0,0 +1,193 @@
+import gzip
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+from langchain_core.documents import Document
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Words, numbers and codes such as "ECS-2024", "0x80070005" or "v1.2.3"
+_WORD = re.compile(r'[a-z0-9]+(?:[-_./][a-z0-9]+)*')
+_CJK = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯]+')
+_PARTS = re.compile(r'[-_./]')
+
+
+def tokenize(text):
+    """Lowercased terms; codes are kept whole and also split into their parts,
+    and CJK runs are indexed as character unigrams and bigrams."""
+    text = text.lower()
+    tokens = []
+    for word in _WORD.findall(text):
+        tokens.append(word)
+        parts = _PARTS.split(word)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    for run in _CJK.findall(text):
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """Incremental in-memory BM25 index persisted as a snapshot plus a change log.
+
+    Documents are keyed by their chunk id and stored with their text and
+    metadata, so lexical hits can be returned as Documents without a
+    round trip to the vector store. ``save`` appends the changes since the
+    last save to ``<path>.log`` (JSON lines), so its cost follows the size
+    of the change, not of the index. Once the log outgrows the gzipped
+    snapshot (and ``compact_bytes``), it is folded into a new snapshot.
+    """
+
+    def __init__(self, path=None, k1=1.5, b=0.75, compact_bytes=None):
+        self.path = path or os.getenv('LEXICAL_INDEX_PATH', os.path.join('.ingest', 'bm25.json.gz'))
+        self.log_path = self.path + '.log'
+        self.compact_bytes = int(compact_bytes or os.getenv('LEXICAL_INDEX_COMPACT_BYTES', 8 * 1024 * 1024))
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._postings = defaultdict(dict)  # term -> {doc_id: term frequency}
+        self._lengths = {}  # doc_id -> number of terms
+        self._documents = {}  # doc_id -> (text, metadata)
+        self._total_length = 0
+        self._changes = []  # log records not saved yet
+        if os.path.exists(self.path):
+            self._load()
+        if os.path.exists(self.log_path):
+            self._replay()
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, doc_id, text, metadata=None):
+        counts = Counter(tokenize(text))
+        with self._lock:
+            if doc_id in self._lengths:
+                self._remove(doc_id)
+            for term, count in counts.items():
+                self._postings[term][doc_id] = count
+            length = sum(counts.values())
+            self._lengths[doc_id] = length
+            self._total_length += length
+            self._documents[doc_id] = (text, metadata or {})
+            self._changes.append({'add': doc_id, 'text': text, 'metadata': metadata or {}})
+
+    def remove(self, doc_id):
+        with self._lock:
+            if doc_id in self._lengths:
+                self._remove(doc_id)
+                self._changes.append({'remove': doc_id})
+
+    def search(self, query, k=3):
+        """Return [(Document, score)] of the top-k documents for the query."""
+        terms = set(tokenize(query))
+        with self._lock:
+            doc_count = len(self._lengths)
+            if not doc_count or not terms:
+                return []
+            avg_length = self._total_length / doc_count
+            scores = defaultdict(float)
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / avg_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+            top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            return [(Document(page_content=self._documents[doc_id][0],
+                              metadata=dict(self._documents[doc_id][1], chunk_id=doc_id)), score)
+                    for doc_id, score in top]
+
+    def save(self):
+        """Append the changes since the last save to the log, compacting it when it has grown."""
+        with self._lock:
+            if not self._changes:
+                return
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                for change in self._changes:
+                    f.write(json.dumps(change, ensure_ascii=False, separators=(',', ':')) + '\n')
+            self._changes = []
+            log_bytes = os.path.getsize(self.log_path)
+            snapshot_bytes = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            if log_bytes > max(self.compact_bytes, snapshot_bytes):
+                self.compact()
+
+    def compact(self):
+        """Write a full snapshot (replaced atomically) and empty the log."""
+        with self._lock:
+            data = {
+                'postings': self._postings,
+                'lengths': self._lengths,
+                'documents': self._documents,
+            }
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+            # Replaying a log already folded into the snapshot is harmless, so a
+            # crash between these two steps loses nothing
+            with open(self.log_path, 'w', encoding='utf-8'):
+                pass
+            self._changes = []
+
+    def _remove(self, doc_id):
+        text, _ = self._documents.pop(doc_id)
+        for term in set(tokenize(text)):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._lengths.pop(doc_id)
+
+    def _load(self):
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+        self._postings = defaultdict(dict, data['postings'])
+        self._lengths = data['lengths']
+        self._documents = {doc_id: tuple(value) for doc_id, value in data['documents'].items()}
+        self._total_length = sum(self._lengths.values())
+
+    def _replay(self):
+        offset = 0
+        with open(self.log_path, 'r+b') as f:
+            for line in f:
+                try:
+                    change = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    # A write cut short by a crash: drop it so later appends stay readable
+                    f.truncate(offset)
+                    break
+                offset += len(line)
+                if 'add' in change:
+                    self.add(change['add'], change['text'], change['metadata'])
+                else:
+                    self.remove(change['remove'])
+        self._changes = []
+
+
+def reciprocal_rank_fusion(result_lists, k=3, rrf_k=60):
+    """Merge ranked Document lists by reciprocal rank fusion and return the top k.
+
+    Documents are matched across lists by their chunk_id metadata (or their
+    content when it is missing).
+    """
+    scores = defaultdict(float)
+    documents = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            key = doc.metadata.get('chunk_id') or doc.page_content
+            scores[key] += 1.0 / (rrf_k + rank + 1)
+            documents.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[key] for key in ranked]
@@ -1,38 +1,99 @@
 import gradio as gr
+import asyncio
 import os
 import datetime
+import hashlib
 import shutil
+import time
+import uuid
 
 import dashscope
 
 import gradio as gr
-from http import HTTPStatus
-from llm_service import LLMService
+from async_pipeline import concurrency_limit, run_blocking
+from dashscope_async import DashScopeError, stream_multimodal
+from hashing import file_sha256
+from history_manager import count_tokens
+from model_router import get_router
 from oss_url import upload_image_to_oss
-from intelligent_speech import IntelligentSpeech
+from services import get_job_queue, get_nls_client, get_solver, readiness, start_warm_up, warm_up_enabled
+from staging import StagingDirectory
+from image_preprocess import ImagePreprocessor
+from PIL import Image
+from result_cache import TieredCache
+from streaming import StreamStats
+from tracing import register_collector, render_metrics, span, traced
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
 dashscope.api_key = os.environ.get("DASHSCOPE_API_KEY")
-dashscope.base_http_api_url = 'https://dashscope-intl.aliyuncs.com/api/v1'
+dashscope.base_http_api_url = os.getenv('DASHSCOPE_HTTP_BASE_URL', 'https://dashscope-intl.aliyuncs.com/api/v1')
 
 
 def get_file_extension(file_path: str) -> str:
     _, file_extension = os.path.splitext(file_path)
     return file_extension.lower()
 
-# Initialize the LLMService object with the configuration
-solver = LLMService()
-
-nls_client = IntelligentSpeech()
-
-def transcribe_and_process_audio(audio_file_path):
-    transcription = nls_client.audio_transcription(audio_file_path)
-    return process_text(transcription)
-
-def process_text(text_content, history=[]):
+# LLMService and IntelligentSpeech are created on first use (or by the
+# background warm-up), so the UI comes up without waiting for the backends
+
+image_staging = StagingDirectory("images")
+
+image_preprocessor = ImagePreprocessor()
+image_preprocessing_enabled = os.getenv('IMAGE_PREPROCESS', 'true').lower() == 'true'
+
+# Supported audio and image formats in chat messages
+AUDIO_FORMATS = ['.mp3', '.wav', '.m4a', '.flac']
+IMAGE_FORMATS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp']
+
+# Picks the Qwen-VL model tier per question
+vl_router = get_router('vl')
+# Qwen-VL answers keyed by image content, prompt and model
+vl_cache = TieredCache('vl', ttl=24 * 3600)
+register_collector('vl_cache', vl_cache.stats)
+
+def vl_prompt(caption: str) -> str:
+    return "Please answer me in English. " + (caption or "")
+
+def route_vl(image_paths, caption: str):
+    """Pick the Qwen-VL model from the image count, the largest image and the question length."""
+    pixels = []
+    for path in image_paths:
+        try:
+            # Only the header is read to get the size
+            with Image.open(path) as image:
+                pixels.append(image.size[0] * image.size[1])
+        except Exception:
+            pixels.append(None)
+    return vl_router.route(
+        images=len(image_paths),
+        image_pixels=None if None in pixels or not pixels else max(pixels),
+        prompt_tokens=count_tokens(caption),
+    )
+
+def lookup_vl_answer(image_paths, caption: str):
+    """Return (route, cache key, cached answer or None) for a question about local images."""
+    route = route_vl(image_paths, caption)
+    if not vl_cache.enabled:
+        # Hashing the images is wasted work without a cache
+        return route, None, None
+    prompt_hash = hashlib.sha256(vl_prompt(caption).encode('utf-8')).hexdigest()
+    # The model sees the preprocessed image, so the preprocessing settings are part of the key
+    preprocessing = image_preprocessor.settings_key() if image_preprocessing_enabled else 'original'
+    key = ':'.join([route.model, preprocessing, *(file_sha256(path) for path in image_paths), prompt_hash])
+    return route, key, vl_cache.get(key)
+
+@traced('transcribe_and_process_audio')
+async def transcribe_and_process_audio(audio_file_path):
+    nls_client = await run_blocking('chat', get_nls_client)
+    transcription = await nls_client.audio_transcription_async(audio_file_path)
+    async for response in process_text(transcription):
+        yield response
+
+@traced('process_text')
+async def process_text(text_content, history=[]):
     # history_langchain_format = []
     # for human, ai in history:
     #     history_langchain_format.append(HumanMessage(content=human))
@@ -44,14 +105,18 @@ def process_text(text_content, history=[]):
     # prompt += "\n" + text_content  # Add the latest message from the user
     # prompt = prompt.strip()  # Remove any leading/trailing whitespace
     
-    # Use the invoke method instead of __call__
+    # Stream the answer, yielding the accumulated text so Gradio renders it as it grows
+    llm_response = ""
     try:
-        llm_response = solver.content_query(text_content, history)  # Assuming the prompt is correctly formatted as a string
-        return llm_response  # You may need to adjust this based on how llm.invoke returns the response
+        solver = await run_blocking('chat', get_solver)
+        async for chunk in solver.content_query_astream(text_content, history):
+            llm_response += chunk
+            yield llm_response
     except Exception as e:
-        return f"An error occurred: {str(e)}"    
+        yield f"An error occurred: {str(e)}"
 
-def upload_knowledge(file_path: str) -> str:
+@traced('upload_knowledge')
+async def upload_knowledge(file_path: str) -> str:
     if file_path is None:
         return "No file was uploaded."
 
@@ -64,95 +129,224 @@ def upload_knowledge(file_path: str) -> str:
     
     # Use a unique timestamp to save the uploaded file to prevent overwriting
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    safe_file_name = f"uploaded_{timestamp}{file_extension}"
+    safe_file_name = f"uploaded_{timestamp}_{uuid.uuid4().hex[:8]}{file_extension}"
     save_path = os.path.join("uploads", safe_file_name)
     
     # Ensure uploads directory exists
     os.makedirs(os.path.dirname(save_path), exist_ok=True)
 
     # Copy the original image file to the new location
-    shutil.copy(file_path, save_path)
+    await run_blocking('upload', shutil.copy, file_path, save_path)
         
-    # Custom knowledge uploading logic here (adjust as needed)
-    solver.upload_file_knowledge(save_path)
-    
-    return "Successfully uploaded and processed the knowledge document."
+    # Ingestion runs on the background job queue; the job id comes back right away
+    job_queue = await run_blocking('upload', get_job_queue)
+    job_id = await run_blocking('upload', job_queue.submit, save_path, os.path.basename(file_path))
+
+    return f"Queued as job {job_id}. Progress is shown under Ingestion jobs."
+
+def format_jobs(jobs) -> str:
+    """Markdown table of ingestion jobs for the status panel."""
+    if not jobs:
+        return "No ingestion jobs yet."
+    lines = [
+        "| Job | File | Status | Pages | Chunks | Embedded | Inserted | Rows/s | Elapsed |",
+        "|---|---|---|---|---|---|---|---|---|",
+    ]
+    for job in jobs:
+        status = job['status'] if not job['error'] else f"{job['status']}: {job['error']}"
+        lines.append(f"| {job['id']} | {job['name']} | {status} | {job['pages']} | {job['chunks_total']} "
+                     f"| {job['chunks_embedded']} | {job['rows_inserted']} | {job['rows_per_second']:.1f} "
+                     f"| {job['elapsed']:.0f} s |")
+    return "\n".join(lines)
 
+async def job_status() -> str:
+    job_queue = await run_blocking('upload', get_job_queue)
+    jobs = await run_blocking('upload', job_queue.list_jobs, 10)
+    return format_jobs(jobs)
 
 
-def process_file(file_path: str, caption: str, history) -> str:
+
+@traced('process_file')
+async def process_file(file_path: str, caption: str, history):
     """Determines file format and delegates to specific processing functions."""
-    _, file_extension = os.path.splitext(file_path)
-    # Lists of supported audio and image formats
-    audio_formats = ['.mp3', '.wav', '.m4a', '.flac']
-    image_formats = ['.jpg', '.jpeg', '.png', '.gif', '.bmp']
-    
-    if file_extension in audio_formats:
-        return process_audio_file(file_path, history)
-    elif file_extension in image_formats:
-        return process_image_file(file_path, caption)
+    file_extension = get_file_extension(file_path)
+
+    if file_extension in AUDIO_FORMATS:
+        responses = process_audio_file(file_path, history)
+    elif file_extension in IMAGE_FORMATS:
+        responses = process_image_file(file_path, caption)
     else:
-        return "Unsupported file format."
+        yield "Unsupported file format."
+        return
+    async for response in responses:
+        yield response
+
+@traced('process_files')
+async def process_files(file_paths, caption: str, history):
+    """Answers one message carrying several files.
+
+    Audio files are transcribed in parallel and their transcripts are merged
+    with the text into one question. With images, that question and all the
+    images go to Qwen-VL in a single call, and the image uploads overlap the
+    transcriptions; without images it goes to content_query. The files are
+    processed concurrently, so the wait is set by the slowest one.
+    """
+    unsupported = [os.path.basename(path) for path in file_paths
+                   if get_file_extension(path) not in AUDIO_FORMATS + IMAGE_FORMATS]
+    if unsupported:
+        yield f"Unsupported file format: {', '.join(unsupported)}"
+        return
+    audio_paths = [path for path in file_paths if get_file_extension(path) in AUDIO_FORMATS]
+    image_paths = [path for path in file_paths if get_file_extension(path) in IMAGE_FORMATS]
+
+    # With audio, start the image uploads now so they overlap the transcriptions
+    preparing = asyncio.ensure_future(prepare_images(image_paths)) if audio_paths and image_paths else None
+    route = cache_key = cached = None
+    try:
+        transcriptions = await transcribe_audio_files(audio_paths)
+        question = "\n".join(part for part in [caption, *transcriptions] if part)
+        if image_paths:
+            # The answer cache needs the full question, so it is checked once the transcripts are in
+            route, cache_key, cached = await run_blocking('chat', lookup_vl_answer, image_paths, question)
+            if cached is None:
+                image_urls = await (preparing or prepare_images(image_paths))
+    except Exception as e:
+        if preparing is not None:
+            preparing.cancel()
+        yield f"An error occurred: {str(e)}"
+        return
+
+    if cached is not None:
+        if preparing is not None:
+            preparing.cancel()
+        yield cached
+        return
+    if image_paths:
+        responses = answer_images(image_urls, question, route, cache_key)
+    else:
+        responses = process_text(question, history)
+    async for response in responses:
+        yield response
+
+async def transcribe_audio_files(file_paths):
+    """Transcribe several audio files concurrently, keeping their order."""
+    if not file_paths:
+        return []
+    nls_client = await run_blocking('chat', get_nls_client)
+    return await asyncio.gather(*(nls_client.audio_transcription_async(path) for path in file_paths))
+
+@traced('process_audio_file')
+async def process_audio_file(audio_file_path: str, history):
+    try:
+        nls_client = await run_blocking('chat', get_nls_client)
+        transcription = await nls_client.audio_transcription_async(audio_file_path)
+    except Exception as e:
+        yield f"An error occurred: {str(e)}"
+        return
+    async for response in process_text(transcription, history):
+        yield response
 
-def process_audio_file(audio_file_path: str, history) -> str:
-    transcription = nls_client.audio_transcription(audio_file_path)
-    return process_text(transcription, history)
+@traced('prepare_image')
+def prepare_image(file_path: str) -> str:
+    """Preprocess an image and return the reference to send to Qwen-VL.
 
-def process_image_file(file_path: str, caption: str) -> str:
-    # Create images folder if it does not exist
-    images_dir = "images"
-    if not os.path.exists(images_dir):
-        os.makedirs(images_dir)
-        
-    # Get the file extension and construct the new image file name with a timestamp to avoid overwriting
-    extension = get_file_extension(file_path)
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    image_file_name = f"input_image_{timestamp}{extension}"
-    image_file_path = os.path.join(images_dir, image_file_name)
-    
-    # Copy the original image file to the new location
-    shutil.copy(file_path, image_file_path)
-    
-    # Construct the prompt and the message payload
-    prompt = "Please answer me in English. " + caption
+    Small results are returned inline as a data URI; everything else is staged
+    and uploaded to OSS, and its public URL is returned.
+    """
+    if not image_preprocessing_enabled:
+        image_file_path, content_hash = image_staging.stage(file_path)
+        try:
+            return upload_image_to_oss(os.path.abspath(image_file_path), content_hash=content_hash)
+        finally:
+            image_staging.release(image_file_path)
+
+    with span('image_preprocess'):
+        prepared = image_preprocessor.process(file_path)
+    if prepared.inline:
+        print(f"Image preprocessing (inline): {prepared.report()}")
+        return prepared.data_uri()
+
+    # Stage a content-addressed copy in the bounded images folder
+    image_file_path, content_hash = image_staging.stage_bytes(prepared.data, prepared.extension)
+    start_time = time.perf_counter()
+    try:
+        public_url = upload_image_to_oss(os.path.abspath(image_file_path), content_hash=content_hash)
+    finally:
+        image_staging.release(image_file_path)
+    prepared.timings['upload'] = time.perf_counter() - start_time
+    print(f"Image preprocessing: {prepared.report()}")
+    return public_url
+
+async def prepare_images(file_paths):
+    """Preprocess and upload several images concurrently, keeping their order."""
+    return await asyncio.gather(*(run_blocking('chat', prepare_image, path) for path in file_paths))
+
+@traced('process_image_file')
+async def process_image_file(file_path: str, caption: str):
     """Sample of use local file.
        linux&mac file schema: file:///home/images/test.png
        windows file schema: file://D:/images/abc.png
     """
-    public_url = upload_image_to_oss(os.path.abspath(image_file_path))
+    # A repeated image and question is answered from the result cache
+    route, cache_key, cached = await run_blocking('chat', lookup_vl_answer, [file_path], caption)
+    if cached is not None:
+        yield cached
+        return
+    # Preprocessing and the OSS upload are blocking SDK work
+    public_url = await run_blocking('chat', prepare_image, file_path)
+    async for response in answer_images([public_url], caption, route, cache_key):
+        yield response
+
+async def answer_images(image_urls, caption: str, route, cache_key=None):
+    """Ask the routed Qwen-VL model about one or more prepared images in a single call.
+
+    A complete answer is stored in the result cache under ``cache_key``.
+    """
+    # Construct the prompt and the message payload
+    prompt = vl_prompt(caption)
     messages = [
         {
             "role": "user",
-            "content": [
-                {"image": public_url},
-                {"text": prompt}
-            ]
+            "content": [{"image": image_url} for image_url in image_urls] + [{"text": prompt}]
         }
     ]
     
-    # Call the API with the message
-    response = dashscope.MultiModalConversation.call(model='qwen-vl-max',
-                                                     messages=messages)
-    # Check if the response is OK and extract the text, otherwise return the error code and message
-    if response.status_code == HTTPStatus.OK:
-        result_text = response["output"]["choices"][0]["message"]["content"][0]["text"]
-    else:
-        result_text = f"Error {response.code}: {response.message}"
-    return result_text
-
-def process_input(message_dict, history):
+    # Call the API with the message and stream the answer back
+    print(f"Routing images to {route.model} ({route.tier}, {route.reason})")
+    stats = StreamStats(route.model)
+    result_text = ""
+    try:
+        async for text in vl_router.astream(route, lambda model: stream_multimodal(model, messages)):
+            stats.observe(text)
+            result_text += text
+            yield result_text
+    except DashScopeError as e:
+        # Return the error code and message
+        yield str(e)
+        return
+    except Exception as e:
+        yield f"An error occurred: {str(e)}"
+        return
+    stats.finish()
+    if cache_key is not None and result_text:
+        await run_blocking('chat', vl_cache.set, cache_key, result_text)
+
+@traced('process_input')
+async def process_input(message_dict, history):
     files = message_dict.get('files', [])
     text_content = message_dict.get('text')
-    if len(files) == 1:
-        file_path = files[0]["path"]
-        if os.path.isfile(file_path):
-            return process_file(file_path, text_content, history)
-        else:
-            return "The file does not exist."
-    elif len(files) > 1:
-        return "Please provide only one file."
+    file_paths = [file["path"] for file in files]
+    if not all(os.path.isfile(file_path) for file_path in file_paths):
+        yield "The file does not exist."
+        return
+    if len(file_paths) == 1:
+        responses = process_file(file_paths[0], text_content, history)
+    elif len(file_paths) > 1:
+        responses = process_files(file_paths, text_content, history)
     else:
-        return process_text(text_content, history)
+        responses = process_text(text_content, history)
+    async for response in responses:
+        yield response
         
 
 # Custom HTML and CSS for the footer
@@ -202,10 +396,19 @@ with gr.Blocks(
 
             # Before starting the Blocks context
             output_text = gr.Text(label="Upload Result")
+            gr.Markdown("**Ingestion jobs**")
+            job_status_panel = gr.Markdown("No ingestion jobs yet.")
 
             # Link the file input and button with the upload_knowledge function
             # Correct the use of output component in the .click() function
-            submit_button.click(fn=upload_knowledge, inputs=file_input, outputs=output_text)
+            submit_button.click(fn=upload_knowledge, inputs=file_input, outputs=output_text,
+                                concurrency_limit=concurrency_limit('upload')
+                                ).then(fn=job_status, outputs=job_status_panel, show_progress='hidden')
+
+            # Progress of background ingestion, refreshed every few seconds
+            job_status_timer = gr.Timer(float(os.getenv('JOB_STATUS_REFRESH_SECONDS', 3)))
+            job_status_timer.tick(fn=job_status, outputs=job_status_panel, show_progress='hidden',
+                                  concurrency_limit=None)
             
         
         with gr.Column(scale=7):
@@ -213,7 +416,9 @@ with gr.Blocks(
                         title="Alibaba Cloud Multimodal GenAI Smart Assistant Te",
                         description="The test environment for RAG, Vision LLM and Audio capabilities. <br> By Product and Solution Team",
                         examples=[{"text": "Hello", "files": []}, {"text": "Who are you", "files": []}],
-                        multimodal=True
+                        multimodal=True,
+                        textbox=gr.MultimodalTextbox(file_count="multiple", placeholder="Type a message or attach images and audio files..."),
+                        concurrency_limit=concurrency_limit('chat')
                        )
         
 
@@ -222,15 +427,43 @@ with gr.Blocks(
     gr.HTML(custom_footer_html)
 
 app.queue()
-# Launch the app with specific server and SSL configurations
-app.launch(
-    server_name="0.0.0.0",
-    server_port=8080,
-    allowed_paths=["/"]
-    # ssl_certfile="/root/multimodal/keys/cert.pem",
-    # ssl_keyfile="/root/multimodal/keys/key.pem",
-    # ssl_verify=False
-)
+
+
+def create_server():
+    """FastAPI app serving the Gradio UI at /, the readiness probe at /ready and
+    Prometheus metrics at /metrics."""
+    from fastapi import FastAPI
+    from fastapi.responses import JSONResponse, PlainTextResponse
+
+    server = FastAPI()
+
+    @server.get("/ready")
+    def ready():
+        status = readiness()
+        return JSONResponse(status, status_code=200 if status['ready'] else 503)
+
+    @server.get("/metrics")
+    def metrics():
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+    return gr.mount_gradio_app(server, app, path="/", allowed_paths=["/"])
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    if warm_up_enabled():
+        start_warm_up()
+    # Resume ingestion jobs interrupted by the last shutdown
+    get_job_queue()
+    # Launch the app with specific server and SSL configurations
+    uvicorn.run(
+        create_server(),
+        host="0.0.0.0",
+        port=8080,
+        # ssl_certfile="/root/multimodal/keys/cert.pem",
+        # ssl_keyfile="/root/multimodal/keys/key.pem",
+    )
 
 
 
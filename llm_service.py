@@ -1,32 +1,92 @@
-import dashscope
-from langchain_community.embeddings import DashScopeEmbeddings
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.document_loaders import DirectoryLoader, CSVLoader, UnstructuredMarkdownLoader, TextLoader, PyPDFLoader, UnstructuredHTMLLoader
-from langchain_community.vectorstores import AnalyticDB
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_community.chat_models.tongyi import ChatTongyi
-from langchain_community.llms import Tongyi
-from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
-from langchain.prompts import PromptTemplate
+# The langchain_community backends are imported where they are first used, so
+# importing this module (and starting the UI) stays fast
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.prompts import PromptTemplate
+import contextvars
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from dotenv import load_dotenv
 
+from answer_cache import SemanticAnswerCache
+from async_pipeline import run_blocking
+from chunk_dedup import ChunkDeduplicator
+from context_compression import ContextCompressor
+from embedding_cache import CachedEmbeddings
+from document_loading import assign_chunk_ids, ingest_hash, load_documents, split_documents
+from history_manager import HistoryManager, count_tokens
+from ingest_manifest import IngestManifest, chunk_id_for
+from ingest_pipeline import IngestionPipeline
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from model_router import get_router
+from resilience import get_backend
+from streaming import StreamStats
+from tracing import register_collector, span, traced
+
 # Load environment variables from .env file
 load_dotenv()
 
+# System prompt for content_query; PROMPT_TEMPLATE overrides it and must use {context} and {question}
+DEFAULT_PROMPT_TEMPLATE = ("Given below context and question; Please answer the question:\n\n"
+                           "Context: {context}\n\nQuestion: {question}\n\nAnswer:")
+
 class LLMService:
     def __init__(self) -> None:
-        self.vector_db = self.connect_adb()
+        self.vector_db = self.connect_vector_store()
         self.llm = self.activate_llm()
+        # Timeouts, retries and a circuit breaker for generation calls
+        self.chat_backend = get_backend('chat', timeout=60)
+        # Picks the chat model tier per question
+        self.chat_router = get_router('chat')
+        self.manifest = IngestManifest()
+        self.answer_cache = SemanticAnswerCache()
+        self.history_manager = HistoryManager(self.llm, backend=self.chat_backend, router=self.chat_router)
+        self.prompt = PromptTemplate.from_template(os.getenv('PROMPT_TEMPLATE', DEFAULT_PROMPT_TEMPLATE))
+        self.context_compressor = ContextCompressor(self.vector_db.embeddings)
+        self.lexical_index = BM25Index()
+        self.deduplicator = ChunkDeduplicator() if os.getenv('DEDUP_ENABLED', 'true').lower() == 'true' else None
+        self._retrieval_pool = ThreadPoolExecutor(max_workers=int(os.getenv('RETRIEVAL_THREADS', 8)))
+
+        # Exported as gauges on the /metrics endpoint
+        if isinstance(self.vector_db.embeddings, CachedEmbeddings):
+            register_collector('embedding_cache', self.vector_db.embeddings.stats)
+        register_collector('answer_cache', self.answer_cache.stats)
+        register_collector('context_compression', self.context_compressor.stats)
+        if self.deduplicator is not None:
+            register_collector('dedup', self.deduplicator.stats)
 
     def activate_llm(self):
-        dashscope.base_http_api_url = 'https://dashscope-intl.aliyuncs.com/api/v1'
+        import dashscope
+        from langchain_community.chat_models.tongyi import ChatTongyi
+        dashscope.base_http_api_url = os.getenv('DASHSCOPE_HTTP_BASE_URL', 'https://dashscope-intl.aliyuncs.com/api/v1')
 
-        tongyi_chat = ChatTongyi(streaming=False)
+        # One attempt per call: retries are made by the chat backend, under its budget
+        tongyi_chat = ChatTongyi(streaming=False, max_retries=1)
         return tongyi_chat
 
+    def connect_vector_store(self):
+        # VECTOR_STORE=local keeps embeddings in a memory-mapped file instead of AnalyticDB
+        if os.getenv('VECTOR_STORE', 'adb').lower() == 'local':
+            from local_vector_store import MmapVectorStore
+            return MmapVectorStore(
+                embedding_function=self.create_embeddings(),
+                dimension=int(os.getenv('EMBEDDING_DIMENSION')),
+            )
+        return self.connect_adb()
+
+    def create_embeddings(self):
+        from langchain_community.embeddings import DashScopeEmbeddings
+        # Cache embeddings on disk and batch the misses
+        return CachedEmbeddings(
+            DashScopeEmbeddings(
+                model=os.getenv('EMBEDDING_MODEL'),
+            ),
+            model_name=os.getenv('EMBEDDING_MODEL'),
+        )
+
     def connect_adb(self):
+        from langchain_community.vectorstores import AnalyticDB
         connection_string = AnalyticDB.connection_string_from_db_params(
             host=os.getenv('PG_HOST'),
             database=os.getenv('PG_DATABASE'),
@@ -36,9 +96,7 @@ class LLMService:
             port=5432
         )
 
-        embedding = DashScopeEmbeddings(
-            model=os.getenv('EMBEDDING_MODEL'),
-        )
+        embedding = self.create_embeddings()
 
         vector_db = AnalyticDB(
             embedding_function=embedding,
@@ -47,77 +105,280 @@ class LLMService:
         )
         return vector_db
 
+    @traced('ingest_file')
     def upload_file_knowledge(self, file):
+        path = os.path.abspath(file)
+        content_hash = ingest_hash(path, 1000, 0)
+        if self.manifest.file_hash(path) == content_hash:
+            print(f"Skipping unchanged file: {file}")
+            return
+
         # Load file based on extension
-        if file.lower().endswith('.csv'):
-            documents = CSVLoader(file).load()
-        elif file.lower().endswith('.md'):
-            documents = UnstructuredMarkdownLoader(file).load()
-        elif file.lower().endswith('.txt'):
-            documents = TextLoader(file).load()
-        elif file.lower().endswith('.pdf'):
-            documents = PyPDFLoader(file).load()
-        elif file.lower().endswith('.html'):
-            documents = UnstructuredHTMLLoader(file).load()
-        else:
-            raise ValueError(f"Unsupported file extension: {file.lower()}")
-        text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
-        docs = text_splitter.split_documents(documents)
-        start_time = time.time()
-        self.vector_db.add_documents(docs)
-        end_time = time.time()
-        print(f"Insert into AnalyticDB Success. Cost time: {end_time - start_time} s")
+        documents = load_documents(file)
+        docs = split_documents(documents, chunk_size=1000, chunk_overlap=0)
+        self._sync_chunks(path, content_hash, docs)
     
+    @traced('ingest_directory')
     def upload_directory(self, dir_path):
-        docs = DirectoryLoader(dir_path, glob=os.getenv('GLOB_PATTERN', '*'), show_progress=True).load()
-        text_splitter = CharacterTextSplitter(chunk_size=int(os.getenv('CHUNK_SIZE', 1000)), chunk_overlap=int(os.getenv('CHUNK_OVERLAP', 0)))
-        docs = text_splitter.split_documents(docs)
+        dir_path = os.path.abspath(dir_path)
+        chunk_size = int(os.getenv('CHUNK_SIZE', 1000))
+        chunk_overlap = int(os.getenv('CHUNK_OVERLAP', 0))
+        # Same file selection as DirectoryLoader; files are parsed in parallel and
+        # their chunks streamed into the vector store in batches
+        paths = sorted(str(p) for p in Path(dir_path).glob(os.getenv('GLOB_PATTERN', '*'))
+                       if p.is_file() and not p.name.startswith('.'))
+        IngestionPipeline(self).run(paths, chunk_size, chunk_overlap)
+
+        # Drop chunks of files that were deleted from the directory
+        for path in self.manifest.files_under(dir_path):
+            if not os.path.exists(path):
+                _, to_delete = self.manifest.plan(path, [])
+                self._delete_chunks(to_delete)
+                self.manifest.remove(path)
+                self.lexical_index.save()
+                print(f"Removed {len(to_delete)} chunks of deleted file: {path}")
+
+    def _sync_chunks(self, path, content_hash, docs):
+        """Insert only new chunks of a file and delete the ones it no longer has."""
+        assign_chunk_ids(docs)
+        new_docs, chunk_ids, to_delete, dropped = self._plan_file(path, docs)
+
         start_time = time.time()
-        self.vector_db.add_documents(docs)
+        self._delete_chunks(to_delete)
+        self._insert_chunks(new_docs)
+        self._commit_file(path, content_hash, chunk_ids)
         end_time = time.time()
-        print(f"Insert into AnalyticDB Success. Cost time: {end_time - start_time} s")
+        print(f"Insert into vector store Success. {len(new_docs)} inserted, {len(to_delete)} deleted, "
+              f"{len(chunk_ids) - len(new_docs) - dropped} unchanged, {dropped} duplicates dropped. "
+              f"Cost time: {end_time - start_time} s")
+
+    def _plan_file(self, path, docs, adjust=None):
+        """Deduplicate a file's chunks and plan them against the manifest.
+
+        Returns (new_docs, chunk_ids, to_delete, dropped): the chunks to
+        insert, in order and without repeats, the ids the file references,
+        the ids it no longer has, and the number of duplicates dropped.
+        ``adjust(chunk_ids, to_insert, to_delete)`` may rewrite the plan
+        first, for callers that track chunks the manifest does not know
+        about yet.
+        """
+        docs, chunk_ids, dropped = self._deduplicate(path, docs)
+        to_insert, to_delete = self.manifest.plan(path, chunk_ids)
+        if adjust is not None:
+            to_insert, to_delete = adjust(chunk_ids, to_insert, to_delete)
+
+        pending = set(to_insert)
+        new_docs = []
+        for doc in docs:
+            if doc.metadata['chunk_id'] in pending:
+                pending.discard(doc.metadata['chunk_id'])
+                new_docs.append(doc)
+        return new_docs, chunk_ids, to_delete, dropped
+
+    def _commit_file(self, path, content_hash, chunk_ids):
+        """Record a file as ingested once all of its chunks are inserted."""
+        # The manifest must not list chunks the lexical index has not persisted
+        self.lexical_index.save()
+        self.manifest.commit(path, content_hash, chunk_ids)
+
+    def _deduplicate(self, path, docs):
+        """Drop exact and near-duplicate chunks; returns (docs, chunk_ids, dropped).
+
+        chunk_ids are what the file references in the manifest, including the
+        originals that stand in for its dropped chunks.
+        """
+        if self.deduplicator is None:
+            return docs, [doc.metadata['chunk_id'] for doc in docs], 0
+        # The file's own outgoing chunks are about to be deleted, so they cannot stand in
+        new_ids = {doc.metadata['chunk_id'] for doc in docs}
+        outgoing = set(self.manifest.chunk_ids(path)) - new_ids
+        return self.deduplicator.deduplicate(docs, exclude=outgoing)
+
+    @traced('vector_insert')
+    def _insert_chunks(self, docs):
+        """Embed and insert chunks that already carry a chunk_id; the lexical index is not saved."""
+        if docs:
+            ids = [doc.metadata['chunk_id'] for doc in docs]
+            try:
+                self.vector_db.add_documents(docs, ids=ids)
+            except Exception:
+                if self.deduplicator is not None:
+                    self.deduplicator.remove(ids)
+                raise
+            for doc in docs:
+                self.lexical_index.add(doc.metadata['chunk_id'], doc.page_content, doc.metadata)
     
+    @traced('vector_delete')
+    def _delete_chunks(self, chunk_ids):
+        if chunk_ids:
+            self.vector_db.delete(chunk_ids)
+            for chunk_id in chunk_ids:
+                self.lexical_index.remove(chunk_id)
+            if self.deduplicator is not None:
+                self.deduplicator.remove(chunk_ids)
+
+    @traced('retrieve')
+    def retrieve(self, question):
+        """Hybrid retrieval: vector and BM25 search in parallel, merged by reciprocal rank fusion.
+
+        Returns (question_embedding, docs).
+        """
+        k = int(os.getenv('RETRIEVAL_K', 3))
+        candidates = int(os.getenv('RETRIEVAL_CANDIDATES', 2 * k))
+        lexical_future = self._retrieval_pool.submit(contextvars.copy_context().run,
+                                                     self._lexical_search, question, candidates)
+
+        with span('embed_query'):
+            question_embedding = self.vector_db.embeddings.embed_query(question)
+        with span('vector_search', k=candidates):
+            vector_docs = self._vector_search(question_embedding, candidates)
+        lexical_docs = [doc for doc, _ in lexical_future.result()]
+
+        docs = reciprocal_rank_fusion([vector_docs, lexical_docs], k=k, rrf_k=int(os.getenv('RRF_K', 60)))
+        return question_embedding, docs
+
+    def _vector_search(self, embedding, k):
+        """Vector hits, best first, with their cosine similarity in metadata['score']."""
+        if hasattr(self.vector_db, 'similarity_search_by_vector_with_score'):
+            # MmapVectorStore scores are cosine similarities
+            hits = self.vector_db.similarity_search_by_vector_with_score(embedding, k=k)
+        else:
+            # AnalyticDB returns the L2 distance; for unit-length embeddings cosine = 1 - d^2 / 2
+            hits = [(doc, 1 - distance ** 2 / 2)
+                    for doc, distance in self.vector_db.similarity_search_with_score_by_vector(embedding, k=k)]
+        for doc, score in hits:
+            doc.metadata['score'] = float(score)
+        return [doc for doc, _ in hits]
+
+    @traced('lexical_search')
+    def _lexical_search(self, question, k):
+        return self.lexical_index.search(question, k)
+
+    @traced('content_query')
     def content_query(self, question, history):
+        history_messages, cached_answer, cache_key, route = self._prepare_query(question, history)
+        if cached_answer is not None:
+            return cached_answer
+
+        # Invoke the routed model with chat history and the new question
+        start_time = time.time()
+        with span('llm_generate', model=route.model):
+            answer = self.chat_router.run(
+                route, lambda model: self.chat_backend.call(self.llm.invoke, history_messages, model=model).content)
+        if cache_key is not None:
+            self.answer_cache.store(*cache_key, answer, time.time() - start_time)
+        
+        return answer
+
+    @traced('content_query')
+    def content_query_stream(self, question, history):
+        """Like content_query, but yields the answer in pieces as they are generated."""
+        history_messages, cached_answer, cache_key, route = self._prepare_query(question, history)
+        if cached_answer is not None:
+            yield cached_answer
+            return
+
+        def stream_model(model):
+            for chunk in self.chat_backend.stream(lambda: self.llm.stream(history_messages, model=model)):
+                if chunk.content:
+                    yield chunk.content
+
+        stats = StreamStats('content_query')
+        answer = ""
+        with span('llm_generate', model=route.model):
+            for piece in self.chat_router.stream(route, stream_model):
+                stats.observe(piece)
+                answer += piece
+                yield piece
+        stats.finish()
+        if cache_key is not None:
+            self.answer_cache.store(*cache_key, answer, stats.elapsed)
+
+    @traced('content_query')
+    async def content_query_astream(self, question, history):
+        """Async variant of content_query_stream.
 
-        # Prepare history messages
-        history_messages = []
-        for msg in history:
-            if msg[0] is not None:  # This checks the first item in the tuple
-                history_messages.append(HumanMessage(content=msg[0]))  # Assuming the first item of tuple is where you want the content
-            if msg[1] is not None:  # This checks the second item in the tuple
-                history_messages.append(AIMessage(content=msg[1]))  # Directly using the strings
+        Retrieval runs on the chat thread pool and generation uses
+        ChatTongyi.astream, so the event loop is never blocked.
+        """
+        history_messages, cached_answer, cache_key, route = await run_blocking(
+            'chat', self._prepare_query, question, history)
+        if cached_answer is not None:
+            yield cached_answer
+            return
+
+        async def stream_model(model):
+            async for chunk in self.chat_backend.astream(lambda: self.llm.astream(history_messages, model=model)):
+                if chunk.content:
+                    yield chunk.content
+
+        stats = StreamStats('content_query')
+        answer = ""
+        with span('llm_generate', model=route.model):
+            async for piece in self.chat_router.astream(route, stream_model):
+                stats.observe(piece)
+                answer += piece
+                yield piece
+        stats.finish()
+        if cache_key is not None:
+            self.answer_cache.store(*cache_key, answer, stats.elapsed)
+
+    @traced('prepare_query')
+    def _prepare_query(self, question, history):
+        """Build the LLM messages; returns (messages, cached_answer, answer_cache_key, route)."""
+
+        # Prepare history messages: recent turns verbatim, older ones summarized
+        with span('history'):
+            history_summary, history_messages = self.history_manager.build(history)
         history_messages.append(HumanMessage(content=question))
                 
         # Get context from vector db
-        docs = self.vector_db.similarity_search(question, k=3)
+        question_embedding, docs = self.retrieve(question)
+
+        # Answers only depend on the question and its context when there is no history
+        cache_key = None
+        if not history:
+            scope = tuple(doc.metadata.get('chunk_id') or chunk_id_for(doc.page_content) for doc in docs)
+            cached_answer = self.answer_cache.lookup(question_embedding, scope)
+            if cached_answer is not None:
+                return None, cached_answer, None, None
+            cache_key = (question_embedding, scope)
+
+        # Only the sentences relevant to the question go into the prompt
+        with span('compress_context'):
+            context = self.context_compressor.compress(question, [doc.page_content for doc in docs],
+                                                       question_embedding)
+        print(context.report())
         context_docs = ""
-        for idx, doc in enumerate(docs):
-            context_docs += f"-----\n\n{idx+1}.\n{doc.page_content}"
+        for idx, text in enumerate(context.texts):
+            context_docs += f"-----\n\n{idx+1}.\n{text}"
         context_docs += "\n\n-----\n\n"
 
-        # Define the prompt template
-        template = """
-You are a QA assistant.
-The original query is as follows: {question}
-Given the context information and not prior knowledge, answer the query
-------------
-{context}
-------------
-
-Given the context information and is prior knowledge, answer the query. 
- Answer: 
-"""
-        os.getenv('PROMPT_TEMPLATE', "Given below context and question; Please answer the question:\n\nContext: {context}\n\nQuestion: {question}\n\nAnswer:")
-        prompt = PromptTemplate(template=template, input_variables=["context", "question"])
-        
         # Add system message at the beginning
-        system_message = SystemMessage(content=f"Context: {context_docs}\n\nQuestion: {question}")
+        system_content = self.prompt.format(context=context_docs, question=question)
+        context_tokens = count_tokens(system_content)
+        if history_summary:
+            system_content = f"Summary of the earlier conversation: {history_summary}\n\n{system_content}"
+        system_message = SystemMessage(content=system_content)
         history_messages.insert(0, system_message)
-        
-        # Invoke the LLM with chat history and the new question
-        response = self.llm.invoke(history_messages)
-        
-        return response.content
+
+        if history:
+            full_tokens = context_tokens + count_tokens(question) + sum(
+                count_tokens(user) + count_tokens(assistant) for user, assistant in history)
+            sent_tokens = sum(count_tokens(message.content) for message in history_messages)
+            print(f"Prompt tokens: {full_tokens} with full history, {sent_tokens} sent "
+                  f"({len(history)} turns, {len(history_messages) - 2} history messages verbatim)")
+
+        # Lexical-only hits carry no vector score
+        scores = [doc.metadata['score'] for doc in docs if 'score' in doc.metadata]
+        route = self.chat_router.route(
+            prompt_tokens=count_tokens(question),
+            history_turns=len(history),
+            retrieval_score=max(scores) if scores else None,
+            context_tokens=context_tokens,
+        )
+        print(f"Routing chat to {route.model} ({route.tier}, {route.reason})")
+        return history_messages, None, cache_key, route
     
 if __name__ == "__main__":
     is_upload_file = False
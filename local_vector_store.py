@@ -0,0 +1,283 @@
+import json
+import os
+import threading
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Rows scored per matrix product in a flat scan, to bound temporary memory
+SCAN_BLOCK_ROWS = 65536
+
+
+class MmapVectorStore(VectorStore):
+    """Local vector store on a memory-mapped float32 matrix.
+
+    Files under ``path``:
+
+    - ``vectors.f32``: L2-normalized embeddings, one row per chunk, appended
+    - ``meta.jsonl`` and ``offsets.i64``: id, text and metadata per row, and
+      the byte offset of each row's line so results are read on demand
+    - ``deleted.i64``: tombstoned row numbers
+    - ``ivf.npz``: optional inverted-file index (k-means centroids and rows
+      grouped by centroid), used when ``ivf_lists`` > 0
+
+    Opening a store maps the matrix without reading it, so startup does not
+    depend on corpus size. Search is cosine similarity via a dot product,
+    either over all rows or over the ``nprobe`` closest IVF lists plus any
+    rows appended since the index was built.
+    """
+
+    def __init__(self, embedding_function, path=None, dimension=None,
+                 ivf_lists=None, nprobe=None):
+        self.embedding_function = embedding_function
+        self.path = path or os.getenv('LOCAL_VECTOR_STORE_PATH', os.path.join('.vector_store', 'default'))
+        self.dimension = int(dimension or os.getenv('EMBEDDING_DIMENSION'))
+        self.ivf_lists = int(ivf_lists if ivf_lists is not None else os.getenv('LOCAL_VECTOR_IVF_LISTS', 0))
+        self.nprobe = int(nprobe or os.getenv('LOCAL_VECTOR_NPROBE', 8))
+        os.makedirs(self.path, exist_ok=True)
+
+        self._vectors_path = os.path.join(self.path, 'vectors.f32')
+        self._meta_path = os.path.join(self.path, 'meta.jsonl')
+        self._offsets_path = os.path.join(self.path, 'offsets.i64')
+        self._deleted_path = os.path.join(self.path, 'deleted.i64')
+        self._ivf_path = os.path.join(self.path, 'ivf.npz')
+
+        self._lock = threading.RLock()
+        self._ids = None  # id -> row, loaded on the first write
+        self._ivf = None
+        self._load()
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    def __len__(self):
+        return int(self._alive.sum())
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        embeddings = self.embedding_function.embed_documents(texts)
+        return self.add_embeddings(texts, embeddings, metadatas, ids)
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None):
+        """Append rows; an id that already exists replaces the old row."""
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        vectors = self._normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(texts), self.dimension))
+
+        with self._lock:
+            ids_by_row = self._load_ids()
+            replaced = [doc_id for doc_id in ids if doc_id in ids_by_row]
+            if replaced:
+                self._delete_locked(replaced)
+
+            # Rows left half-written by a crash are cut off, so new rows line up again
+            self._truncate(self._vectors_path, self._rows * 4 * self.dimension)
+            self._truncate(self._offsets_path, self._rows * 8)
+            # The meta lines go last: a row only exists once its vector, its offset
+            # and a complete meta line are all on disk
+            records = [json.dumps({'id': doc_id, 'text': text, 'metadata': metadata},
+                                  ensure_ascii=False).encode('utf-8') + b'\n'
+                       for doc_id, text, metadata in zip(ids, texts, metadatas)]
+            position = os.path.getsize(self._meta_path) if os.path.exists(self._meta_path) else 0
+            offsets = position + np.cumsum([0] + [len(line) for line in records[:-1]], dtype=np.int64)
+            with open(self._vectors_path, 'ab') as f:
+                vectors.tofile(f)
+            with open(self._offsets_path, 'ab') as f:
+                offsets.astype('<i8').tofile(f)
+            with open(self._meta_path, 'ab') as f:
+                f.write(b''.join(records))
+
+            first_row = self._rows
+            for i, doc_id in enumerate(ids):
+                ids_by_row[doc_id] = first_row + i
+            self._grow(first_row + len(ids))
+
+            if self.ivf_lists and self._rows >= 10 * self.ivf_lists:
+                indexed_rows = self._ivf[3] if self._ivf else 0
+                if self._rows - indexed_rows > 0.2 * self._rows:
+                    self.build_index()
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        if not ids:
+            return False
+        with self._lock:
+            self._load_ids()
+            return self._delete_locked(ids)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k=k)
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector_with_score(self.embedding_function.embed_query(query), k=k)
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k=k)]
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4):
+        rows, scores = self.search(embedding, k)
+        return [(doc, float(score)) for doc, score in zip(self._read_documents(rows), scores)]
+
+    def search(self, embedding, k=4):
+        """Return (rows, cosine scores) of the top-k live rows, best first."""
+        query = self._normalize(np.asarray(embedding, dtype=np.float32).reshape(1, -1))[0]
+        # Snapshot the current state so concurrent appends do not affect this search
+        vectors, alive, ivf = self._vectors, self._alive, self._ivf
+        total_rows = min(len(vectors), len(alive))
+        alive = alive[:total_rows]
+
+        if ivf is not None:
+            centroids, order, list_offsets, indexed_rows = ivf
+            probe = np.argsort(-(centroids @ query))[:self.nprobe]
+            candidates = np.concatenate(
+                [order[list_offsets[c]:list_offsets[c + 1]] for c in probe]
+                + [np.arange(indexed_rows, total_rows)])
+            # Sorted row order keeps the memory-mapped reads sequential
+            candidates = np.sort(candidates[alive[candidates]])
+            scores = vectors[candidates] @ query if len(candidates) else np.empty(0, np.float32)
+        else:
+            candidates = np.flatnonzero(alive) if not alive.all() else None
+            scores = np.concatenate([vectors[i:i + SCAN_BLOCK_ROWS] @ query
+                                     for i in range(0, total_rows, SCAN_BLOCK_ROWS)] or [np.empty(0, np.float32)])
+            if candidates is not None:
+                scores = scores[candidates]
+
+        if len(scores) == 0:
+            return np.empty(0, dtype=np.int64), scores
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        rows = candidates[top] if candidates is not None else top
+        return rows, scores[top]
+
+    def build_index(self, iterations=10, sample_size=100000, seed=0):
+        """(Re)build the IVF index with spherical k-means over the live rows."""
+        with self._lock:
+            live_rows = np.flatnonzero(self._alive)
+            lists = min(self.ivf_lists, len(live_rows))
+            if lists == 0:
+                return
+            rng = np.random.default_rng(seed)
+            sample_rows = np.sort(rng.choice(live_rows, min(sample_size, len(live_rows)), replace=False))
+            sample = np.asarray(self._vectors[sample_rows])
+
+            centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+            for _ in range(iterations):
+                assignment = np.argmax(sample @ centroids.T, axis=1)
+                for c in range(lists):
+                    members = sample[assignment == c]
+                    if len(members):
+                        centroids[c] = members.mean(axis=0)
+                centroids = self._normalize(centroids)
+
+            # Assign every row (deleted ones too, they are filtered at search time)
+            assignment = np.concatenate([np.argmax(self._vectors[i:i + SCAN_BLOCK_ROWS] @ centroids.T, axis=1)
+                                         for i in range(0, self._rows, SCAN_BLOCK_ROWS)])
+            order = np.argsort(assignment, kind='stable')
+            list_offsets = np.searchsorted(assignment[order], np.arange(lists + 1))
+            np.savez(self._ivf_path, centroids=centroids, order=order,
+                     list_offsets=list_offsets, indexed_rows=self._rows)
+            self._ivf = (centroids, order, list_offsets, self._rows)
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, **kwargs):
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    def _load(self):
+        rows = 0
+        if all(os.path.exists(path) for path in (self._vectors_path, self._offsets_path, self._meta_path)):
+            rows = min(os.path.getsize(self._vectors_path) // (4 * self.dimension),
+                       os.path.getsize(self._offsets_path) // 8)
+            if rows:
+                # Rows whose meta line did not make it to disk before a crash do not exist
+                offsets = np.fromfile(self._offsets_path, dtype='<i8', count=rows)
+                meta_size = os.path.getsize(self._meta_path)
+                rows = int(np.searchsorted(offsets, meta_size))
+                if rows:
+                    with open(self._meta_path, 'rb') as f:
+                        f.seek(int(offsets[rows - 1]))
+                        if not f.readline().endswith(b'\n'):
+                            rows -= 1
+        self._rows = 0
+        self._alive = np.ones(0, dtype=bool)
+        self._grow(rows)
+
+        if os.path.exists(self._deleted_path):
+            deleted = np.fromfile(self._deleted_path, dtype='<i8')
+            self._alive[deleted[deleted < rows]] = False
+
+        if self._ivf is None and self.ivf_lists and os.path.exists(self._ivf_path):
+            with np.load(self._ivf_path) as ivf:
+                self._ivf = (ivf['centroids'], ivf['order'], ivf['list_offsets'], int(ivf['indexed_rows']))
+
+    def _grow(self, rows):
+        """Map ``rows`` rows; rows added since the last call are alive."""
+        if rows:
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r', shape=(rows, self.dimension))
+            self._offsets = np.memmap(self._offsets_path, dtype='<i8', mode='r', shape=(rows,))
+        else:
+            self._vectors = np.empty((0, self.dimension), dtype=np.float32)
+            self._offsets = np.empty(0, dtype='<i8')
+        # A new array, so searches holding the old one are not affected
+        self._alive = np.concatenate([self._alive[:rows], np.ones(rows - min(self._rows, rows), dtype=bool)])
+        self._rows = rows
+
+    @staticmethod
+    def _truncate(path, size):
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+
+    def _load_ids(self):
+        if self._ids is None:
+            ids = {}
+            if self._rows:
+                with open(self._meta_path, 'rb') as f:
+                    for row in range(self._rows):
+                        # Lines are read in order; a torn line left by a crash is skipped
+                        offset = int(self._offsets[row])
+                        if f.tell() != offset:
+                            f.seek(offset)
+                        line = f.readline()
+                        if self._alive[row]:
+                            ids[json.loads(line)['id']] = row
+            self._ids = ids
+        return self._ids
+
+    def _delete_locked(self, ids):
+        rows = [self._ids.pop(doc_id) for doc_id in ids if doc_id in self._ids]
+        if not rows:
+            return False
+        with open(self._deleted_path, 'ab') as f:
+            np.asarray(rows, dtype='<i8').tofile(f)
+        alive = self._alive.copy()
+        alive[rows] = False
+        self._alive = alive
+        return True
+
+    def _read_documents(self, rows):
+        documents = []
+        with open(self._meta_path, 'rb') as f:
+            for row in rows:
+                f.seek(int(self._offsets[row]))
+                record = json.loads(f.readline())
+                documents.append(Document(page_content=record['text'], metadata=record['metadata']))
+        return documents
+
+    @staticmethod
+    def _normalize(vectors):
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
@@ -0,0 +1,239 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict
+
+from dotenv import load_dotenv
+
+from tracing import observe, register_collector
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Tiers are listed from fastest to strongest; the cascade escalates one tier
+# at a time. A rule matches when all of its conditions hold: "<feature>_max"
+# and "<feature>_min" bound a feature, and a missing feature never matches.
+# The first matching rule picks the tier, otherwise "default" is used. The
+# default tiers are the models used before routing (ChatTongyi's qwen-turbo
+# and qwen-vl-max), so unmatched requests keep their latency and cost.
+DEFAULT_CONFIG = {
+    'chat': {
+        'tiers': {'fast': 'qwen-turbo', 'strong': 'qwen-plus'},
+        'default': 'fast',
+        'rules': [
+            # Long, detailed questions
+            {'tier': 'strong', 'when': {'prompt_tokens_min': 256}},
+            # Questions the knowledge base barely covers, past small talk
+            {'tier': 'strong', 'when': {'prompt_tokens_min': 24, 'retrieval_score_max': 0.5}},
+        ],
+        'cascade': False,
+    },
+    'vl': {
+        'tiers': {'fast': 'qwen-vl-plus', 'strong': 'qwen-vl-max'},
+        'default': 'strong',
+        'rules': [
+            # One small image with a short question
+            {'tier': 'fast', 'when': {'images_max': 1, 'image_pixels_max': 640 * 640, 'prompt_tokens_max': 32}},
+        ],
+        'cascade': False,
+    },
+}
+
+# Signs that an answer from a smaller model should be retried on a larger one
+UNCERTAIN_PHRASES = (
+    "i don't know", "i do not know", "i'm not sure", "i am not sure", "not enough information",
+    "cannot determine", "can't determine", "unable to answer", "no information",
+    "不知道", "不确定", "无法回答", "无法确定",
+)
+
+
+def load_config():
+    """DEFAULT_CONFIG, updated per kind from MODEL_ROUTER_CONFIG (a JSON file path or inline JSON)."""
+    config = {kind: dict(settings) for kind, settings in DEFAULT_CONFIG.items()}
+    source = os.getenv('MODEL_ROUTER_CONFIG', '').strip()
+    if source:
+        if not source.startswith('{'):
+            with open(source, 'r', encoding='utf-8') as f:
+                source = f.read()
+        for kind, settings in json.loads(source).items():
+            config.setdefault(kind, {}).update(settings)
+    return config
+
+
+@dataclass
+class Route:
+    tier: str
+    model: str
+    reason: str
+    features: Dict[str, float] = field(default_factory=dict)
+
+
+class TierStats:
+    def __init__(self):
+        self.requests = 0
+        self.escalations = 0
+        self.latencies = deque(maxlen=500)
+
+
+class ModelRouter:
+    """Picks a model tier per request from cheap local features.
+
+    Rules (see DEFAULT_CONFIG) look at features such as prompt length,
+    history length, retrieval score or image size. With the cascade on, an
+    answer from a lower tier that fails the confidence heuristic is
+    regenerated on the next tier up. Latency and escalations are counted per
+    tier and exported on /metrics.
+    """
+
+    def __init__(self, kind, config=None, enabled=None):
+        config = config or load_config()[kind]
+        self.kind = kind
+        self.tiers = dict(config['tiers'])
+        self.order = list(self.tiers)
+        self.default = config.get('default', self.order[-1])
+        self.rules = list(config.get('rules', []))
+        self.enabled = (enabled if enabled is not None
+                        else os.getenv('MODEL_ROUTING', 'true').lower() == 'true')
+        self.cascade = bool(config.get('cascade', False)) and self.enabled
+        self.min_answer_chars = int(config.get('min_answer_chars', 8))
+        self.uncertain_phrases = tuple(phrase.lower() for phrase in config.get('uncertain_phrases', UNCERTAIN_PHRASES))
+        for tier in [self.default] + [rule['tier'] for rule in self.rules]:
+            if tier not in self.tiers:
+                raise ValueError(f"Unknown {kind} model tier in router config: {tier}")
+
+        self._lock = threading.Lock()
+        self._stats = {tier: TierStats() for tier in self.order}
+        register_collector(f'router_{kind}', self.stats)
+
+    def route(self, **features):
+        """Return the Route for a request with the given features."""
+        if self.enabled:
+            for index, rule in enumerate(self.rules):
+                if self._matches(rule['when'], features):
+                    tier = rule['tier']
+                    return Route(tier, self.tiers[tier], f"rule {index}", features)
+        return Route(self.default, self.tiers[self.default], 'default', features)
+
+    def confident(self, answer):
+        """Cheap confidence heuristic: a non-trivial answer without hedging phrases."""
+        text = (answer or '').strip().lower()
+        if len(text) < self.min_answer_chars:
+            return False
+        return not any(phrase in text for phrase in self.uncertain_phrases)
+
+    def run(self, route, generate):
+        """Return generate(model) for the routed tier, escalating unconfident answers when cascading."""
+        tier = route.tier
+        while True:
+            start_time = time.perf_counter()
+            answer = generate(self.tiers[tier])
+            next_tier = self._next_tier(tier)
+            escalate = next_tier is not None and not self.confident(answer)
+            self._record(tier, time.perf_counter() - start_time, escalate)
+            if not escalate:
+                return answer
+            tier = next_tier
+
+    def stream(self, route, stream_model):
+        """Yield the pieces of stream_model(model) for the routed tier.
+
+        When the cascade may escalate, a lower tier's answer is collected
+        first and only released if it passes the confidence check.
+        """
+        tier = route.tier
+        while True:
+            start_time = time.perf_counter()
+            next_tier = self._next_tier(tier)
+            if next_tier is None:
+                yield from stream_model(self.tiers[tier])
+                self._record(tier, time.perf_counter() - start_time, False)
+                return
+            pieces = list(stream_model(self.tiers[tier]))
+            escalate = not self.confident(''.join(pieces))
+            self._record(tier, time.perf_counter() - start_time, escalate)
+            if not escalate:
+                yield from pieces
+                return
+            tier = next_tier
+
+    async def astream(self, route, stream_model):
+        """Async variant of stream; stream_model(model) returns an async iterator."""
+        tier = route.tier
+        while True:
+            start_time = time.perf_counter()
+            next_tier = self._next_tier(tier)
+            if next_tier is None:
+                async for piece in stream_model(self.tiers[tier]):
+                    yield piece
+                self._record(tier, time.perf_counter() - start_time, False)
+                return
+            pieces = [piece async for piece in stream_model(self.tiers[tier])]
+            escalate = not self.confident(''.join(pieces))
+            self._record(tier, time.perf_counter() - start_time, escalate)
+            if not escalate:
+                for piece in pieces:
+                    yield piece
+                return
+            tier = next_tier
+
+    def stats(self):
+        with self._lock:
+            entries = []
+            for tier in self.order:
+                stats = self._stats[tier]
+                latencies = sorted(stats.latencies)
+                entries.append({
+                    'kind': self.kind,
+                    'tier': tier,
+                    'model': self.tiers[tier],
+                    'requests': stats.requests,
+                    'escalations': stats.escalations,
+                    'escalation_rate': stats.escalations / stats.requests if stats.requests else 0.0,
+                    'latency_mean_seconds': sum(latencies) / len(latencies) if latencies else 0.0,
+                    'latency_p95_seconds': latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0,
+                })
+            return entries
+
+    def _next_tier(self, tier):
+        if not self.cascade:
+            return None
+        index = self.order.index(tier)
+        return self.order[index + 1] if index + 1 < len(self.order) else None
+
+    def _record(self, tier, seconds, escalated):
+        observe(f"route.{self.kind}.{tier}", seconds)
+        with self._lock:
+            stats = self._stats[tier]
+            stats.requests += 1
+            stats.escalations += int(escalated)
+            stats.latencies.append(seconds)
+
+    @staticmethod
+    def _matches(conditions, features):
+        for name, bound in conditions.items():
+            match = re.fullmatch(r'(.+)_(min|max)', name)
+            if match is None:
+                raise ValueError(f"Router condition must end in _min or _max: {name}")
+            value = features.get(match.group(1))
+            if value is None:
+                return False
+            if match.group(2) == 'min' and value < bound or match.group(2) == 'max' and value > bound:
+                return False
+        return True
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(kind):
+    """The process-wide router for 'chat' or 'vl'."""
+    with _routers_lock:
+        router = _routers.get(kind)
+        if router is None:
+            router = _routers[kind] = ModelRouter(kind)
+        return router
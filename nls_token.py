@@ -0,0 +1,216 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from aliyunsdkcore.acs_exception.exceptions import ClientException
+from aliyunsdkcore.client import AcsClient
+from aliyunsdkcore.request import CommonRequest
+
+from dotenv import load_dotenv
+
+from resilience import get_backend, transient_error
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to per-process single-flight only
+    fcntl = None
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+class NLSTokenManager:
+    """Caches the NLS access token and refreshes it before it expires.
+
+    The token is fetched lazily on first use and then kept fresh by a
+    background thread. Refreshes are single-flight: concurrent callers in one
+    process share a lock, and worker processes share the token through a small
+    JSON cache file guarded by a file lock.
+    """
+
+    def __init__(self, region="ap-southeast-1",
+                 domain="nlsmeta.ap-southeast-1.aliyuncs.com",
+                 refresh_margin=None, cache_path=None):
+        self.region = region
+        self.domain = domain
+        # Refresh this many seconds before ExpireTime (at most half the token's lifetime)
+        self.refresh_margin = int(refresh_margin if refresh_margin is not None
+                                  else os.getenv('NLS_TOKEN_REFRESH_MARGIN', 600))
+        self.cache_path = cache_path or os.getenv(
+            'NLS_TOKEN_CACHE_PATH',
+            os.path.join(tempfile.gettempdir(), 'nls_token_cache.json'))
+
+        self._token = None
+        self._expire_time = 0
+        self._lifetime = None  # seconds a freshly fetched token is valid for
+        self._rejected = None
+        self._lock = threading.Lock()
+        self._refresher = None
+        self._stop = threading.Event()
+
+    def get_token(self):
+        """Return a valid token, fetching one only if none is cached yet."""
+        if not self._is_fresh(self._expire_time):
+            self.refresh()
+        self._start_refresher()
+        return self._token
+
+    def refresh(self, force=False):
+        """Refresh the token unless another caller already did (single-flight)."""
+        with self._lock:
+            if not force and self._is_fresh(self._expire_time):
+                return self._token
+
+            # Another worker process may have refreshed it already
+            cached = self._read_cache()
+            if not force and self._usable(cached):
+                self._token, self._expire_time, self._lifetime = cached
+                return self._token
+
+            with self._file_lock():
+                cached = self._read_cache()
+                if not force and self._usable(cached):
+                    self._token, self._expire_time, self._lifetime = cached
+                else:
+                    fetched_at = time.time()
+                    self._token, self._expire_time = self.fetch_token()
+                    self._lifetime = self._expire_time - fetched_at
+                    self._write_cache(self._token, self._expire_time, fetched_at)
+            return self._token
+
+    def invalidate(self, token):
+        """Drop the token if the gateway rejected it, so the next call refetches."""
+        with self._lock:
+            self._rejected = token
+            if self._token == token:
+                self._expire_time = 0
+
+    def fetch_token(self):
+        """Call CreateToken and return (token, expire_time)."""
+        # Create an AcsClient instance. Retries are left to the token backend
+        # below, so they share its budget and circuit breaker.
+        client = AcsClient(
+            os.getenv('ALIBABA_ACCESS_KEY_ID'),
+            os.getenv('ALIBABA_ACCESS_KEY_SECRET'),
+            self.region,
+            auto_retry=False
+        )
+
+        # Create a request and configure request parameters.
+        request = CommonRequest()
+        request.set_method('POST')
+        request.set_domain(self.domain)
+        request.set_version('2019-07-17')
+        request.set_action_name('CreateToken')
+
+        # Network errors surface as ClientException with the SDK.HttpError code
+        backend = get_backend('nls_token', timeout=10,
+                              retryable=lambda e: transient_error(e) or (
+                                  isinstance(e, ClientException) and e.get_error_code() == 'SDK.HttpError'))
+        response = backend.call(client.do_action_with_exception, request)
+        jss = json.loads(response)
+        token = jss.get('Token') or {}
+        if 'Id' not in token or 'ExpireTime' not in token:
+            raise RuntimeError(f"Unexpected CreateToken response: {jss}")
+        return token['Id'], int(token['ExpireTime'])
+
+    def stop(self):
+        self._stop.set()
+
+    def _margin(self, lifetime=None):
+        # A margin longer than the token lives would make every token stale on
+        # arrival and refresh in a tight loop
+        lifetime = self._lifetime if lifetime is None else lifetime
+        if lifetime is None:
+            return self.refresh_margin
+        return min(self.refresh_margin, max(lifetime, 0) / 2)
+
+    def _is_fresh(self, expire_time, lifetime=None):
+        return expire_time - self._margin(lifetime) > time.time()
+
+    def _usable(self, cached):
+        return (cached is not None and cached[0] != self._rejected
+                and self._is_fresh(cached[1], cached[2]))
+
+    def _start_refresher(self):
+        if self._refresher is not None:
+            return
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh_loop,
+                                                   name='nls-token-refresher',
+                                                   daemon=True)
+                self._refresher.start()
+
+    def _refresh_loop(self):
+        retry_delay = 5
+        while not self._stop.is_set():
+            wait = self._expire_time - self._margin() - time.time()
+            if wait > 0:
+                self._stop.wait(wait)
+                continue
+            try:
+                self.refresh()
+                retry_delay = 5
+            except Exception as e:
+                print(f"NLS token refresh failed: {e}")
+                self._stop.wait(retry_delay)
+                retry_delay = min(retry_delay * 2, 60)
+
+    def _read_cache(self):
+        try:
+            with open(self.cache_path, 'r') as f:
+                data = json.load(f)
+            expire_time = int(data['expire_time'])
+            # Files written before fetched_at was recorded carry no lifetime
+            fetched_at = data.get('fetched_at')
+            lifetime = expire_time - float(fetched_at) if fetched_at is not None else None
+            return data['token'], expire_time, lifetime
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _write_cache(self, token, expire_time, fetched_at):
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'token': token, 'expire_time': expire_time, 'fetched_at': fetched_at}, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def _file_lock(self):
+        return _FileLock(self.cache_path + '.lock')
+
+
+class _FileLock:
+    """Exclusive advisory lock so only one worker process calls CreateToken."""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+# Process-wide manager shared by every IntelligentSpeech instance
+_default_manager = None
+_default_manager_lock = threading.Lock()
+
+
+def get_token_manager():
+    global _default_manager
+    if _default_manager is None:
+        with _default_manager_lock:
+            if _default_manager is None:
+                _default_manager = NLSTokenManager()
+    return _default_manager
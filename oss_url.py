@@ -1,7 +1,13 @@
 import os
+import threading
+
 import oss2
 from dotenv import load_dotenv
 
+from hashing import file_sha256
+from resilience import get_backend, transient_error
+from tracing import traced
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -11,19 +17,98 @@ ALIBABA_ACCESS_KEY_SECRET = os.getenv('ALIBABA_ACCESS_KEY_SECRET')
 OSS_BUCKET_NAME = os.getenv('OSS_BUCKET_NAME')
 OSS_ENDPOINT = os.getenv('OSS_ENDPOINT')
 
-def upload_image_to_oss(local_file_path):
-    # Create an instance of the OSS bucket
-    auth = oss2.Auth(ALIBABA_ACCESS_KEY_ID, ALIBABA_ACCESS_KEY_SECRET)
-    bucket = oss2.Bucket(auth, OSS_ENDPOINT, OSS_BUCKET_NAME)
+# Files at least this large go through resumable multipart upload
+OSS_MULTIPART_THRESHOLD = int(os.getenv('OSS_MULTIPART_THRESHOLD', 10 * 1024 * 1024))
+OSS_PART_SIZE = int(os.getenv('OSS_PART_SIZE', 2 * 1024 * 1024))
+OSS_UPLOAD_INDEX = os.getenv('OSS_UPLOAD_INDEX', os.path.join('.oss', 'uploaded_keys.txt'))
+OSS_RESUME_DIR = os.getenv('OSS_RESUME_DIR', os.path.join('.oss', 'resume'))
+
+_bucket = None
+_bucket_lock = threading.Lock()
+
+# oss2 raises RequestError (status -2) for connection failures and timeouts.
+# Uploads are idempotent (the key is the content hash), so they may be hedged.
+oss_backend = get_backend('oss', timeout=30, hedge=True,
+                          retryable=lambda e: isinstance(e, oss2.exceptions.RequestError) or transient_error(e))
+
+
+def get_bucket():
+    """Return the process-wide OSS bucket client, reusing its HTTP session."""
+    global _bucket
+    if _bucket is None:
+        with _bucket_lock:
+            if _bucket is None:
+                auth = oss2.Auth(ALIBABA_ACCESS_KEY_ID, ALIBABA_ACCESS_KEY_SECRET)
+                _bucket = oss2.Bucket(auth, OSS_ENDPOINT, OSS_BUCKET_NAME)
+    return _bucket
+
+
+class UploadIndex:
+    """Append-only local record of object keys known to exist in the bucket."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._keys = set()
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                self._keys = {line.strip() for line in f if line.strip()}
 
-    # Define the target folder and get the filename
+    def __contains__(self, key):
+        return key in self._keys
+
+    def add(self, key):
+        with self._lock:
+            if key in self._keys:
+                return
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(key + '\n')
+            self._keys.add(key)
+
+
+_upload_index = None
+
+
+def get_upload_index():
+    global _upload_index
+    if _upload_index is None:
+        with _bucket_lock:
+            if _upload_index is None:
+                _upload_index = UploadIndex(OSS_UPLOAD_INDEX)
+    return _upload_index
+
+
+@traced('oss_upload')
+def upload_image_to_oss(local_file_path, content_hash=None):
+    bucket = get_bucket()
+    index = get_upload_index()
+
+    # Name the object after its content so repeated images map to one key
     folder_name = 'multimodal_images'
-    file_name = os.path.basename(local_file_path)
-    oss_file_path = f"{folder_name}/{file_name}"
+    extension = os.path.splitext(local_file_path)[1].lower()
+    content_hash = content_hash or file_sha256(local_file_path)
+    oss_file_path = f"{folder_name}/{content_hash}{extension}"
 
-    # Upload the file to OSS with public-read ACL
-    with open(local_file_path, 'rb') as file:
-        bucket.put_object(oss_file_path, file, headers={'x-oss-object-acl': 'public-read'})
+    if oss_file_path not in index:
+        if not oss_backend.call(bucket.object_exists, oss_file_path):
+            # Upload the file to OSS with public-read ACL
+            headers = {'x-oss-object-acl': 'public-read'}
+            if os.path.getsize(local_file_path) >= OSS_MULTIPART_THRESHOLD:
+                # Neither hedged nor timed out; a retry resumes from the uploaded parts
+                oss_backend.call(oss2.resumable_upload, bucket, oss_file_path, local_file_path,
+                                 store=oss2.ResumableStore(root=OSS_RESUME_DIR),
+                                 headers=headers,
+                                 multipart_threshold=OSS_MULTIPART_THRESHOLD,
+                                 part_size=OSS_PART_SIZE,
+                                 num_threads=4,
+                                 hedge=False, timeout=0)
+            else:
+                def put():
+                    with open(local_file_path, 'rb') as file:
+                        return bucket.put_object(oss_file_path, file, headers=headers)
+                oss_backend.call(put)
+        index.add(oss_file_path)
 
     # Construct the public URL
     public_url = f"http://{OSS_BUCKET_NAME}.{OSS_ENDPOINT}/{oss_file_path}"
@@ -33,7 +118,7 @@ def upload_image_to_oss(local_file_path):
 # Example usage (make sure to set the correct paths and credentials):
 if __name__ == "__main__":
     local_path = '/root/multimodal/images/input_image_20240906_120427.jpeg'
-    
+
     try:
         public_url = upload_image_to_oss(local_path)
         print(f"Image uploaded successfully. Public URL: {public_url}")
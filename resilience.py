@@ -0,0 +1,539 @@
+import asyncio
+import contextvars
+import http.client
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import aiohttp
+import requests
+from dotenv import load_dotenv
+
+from tracing import register_collector
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the backend while its circuit breaker is open."""
+
+    def __init__(self, backend, retry_in):
+        super().__init__(f"{backend} is unavailable (circuit open, retrying in {retry_in:.0f} s)")
+        self.backend = backend
+        self.retry_in = retry_in
+
+
+class CallTimeout(TimeoutError):
+    pass
+
+
+class HTTPStatusError(RuntimeError):
+    """An HTTP error response, raised so that 429 and 5xx responses are retried."""
+
+    def __init__(self, status, message=''):
+        super().__init__(f"HTTP {status}: {message}" if message else f"HTTP {status}")
+        self.status = status
+
+
+def status_of(exc):
+    """The HTTP status carried by an exception from any of the SDKs we use, if any."""
+    for value in (getattr(exc, 'status', None), getattr(exc, 'status_code', None),
+                  getattr(getattr(exc, 'response', None), 'status_code', None)):
+        if isinstance(value, int):
+            return value
+    if callable(getattr(exc, 'get_http_status', None)):
+        return exc.get_http_status()
+    return None
+
+
+# Timeouts and connection failures of the standard library, aiohttp and
+# requests (used by the dashscope and oss2 SDKs)
+TRANSIENT_ERRORS = (TimeoutError, asyncio.TimeoutError, ConnectionError, http.client.HTTPException,
+                    aiohttp.ClientConnectionError, requests.ConnectionError, requests.Timeout)
+
+
+def transient_error(exc):
+    """Default retry predicate: timeouts, connection failures, throttling and 5xx."""
+    if isinstance(exc, TRANSIENT_ERRORS):
+        return True
+    status = status_of(exc)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+
+class RetryBudget:
+    """Token bucket capping retries and hedges at ``ratio`` of recent calls.
+
+    Every call deposits ``ratio`` tokens and every retry or hedge spends one,
+    so a struggling backend sees at most ~(1 + ratio)x its normal load.
+    ``per_second`` tokens are added over time so quiet backends can still retry.
+    """
+
+    def __init__(self, ratio=0.2, per_second=1.0, capacity=10):
+        self.ratio = ratio
+        self.per_second = per_second
+        self.capacity = capacity
+        self._balance = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._refill()
+            self._balance = min(self.capacity, self._balance + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            self._refill()
+            if self._balance >= 1:
+                self._balance -= 1
+                return True
+            return False
+
+    def _refill(self):
+        now = time.monotonic()
+        self._balance = min(self.capacity, self._balance + (now - self._updated) * self.per_second)
+        self._updated = now
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive transient failures.
+
+    While open, calls fail fast. After ``reset_seconds`` one probe call is let
+    through (half-open): its success closes the circuit, its failure opens it
+    again, and a probe that ends without an outcome (e.g. cancelled) is
+    released so the next call can probe.
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.opened = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def admit(self):
+        """'call' or 'probe' when a call may go ahead, None when it must fail fast."""
+        with self._lock:
+            if self.state == 'closed':
+                return 'call'
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+                self._probing = False
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return 'probe'
+            return None
+
+    def release(self):
+        """Give back the probe slot of a call that ended without an outcome."""
+        with self._lock:
+            self._probing = False
+
+    def retry_in(self):
+        return max(0.0, self.reset_seconds - (time.monotonic() - self._opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            self.state = 'closed'
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == 'half_open' or (self.state == 'closed' and self._failures >= self.failure_threshold):
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+                self.opened += 1
+
+
+# Default number of threads each backend runs sync attempts on, so a call can be timed out or hedged
+RESILIENCE_THREADS = int(os.getenv('RESILIENCE_THREADS', 32))
+_END = object()
+
+
+class Backend:
+    """Timeouts, retries, hedging and a circuit breaker for one remote service.
+
+    ``call`` / ``acall`` wrap a sync function or a coroutine function;
+    ``stream`` / ``astream`` wrap a factory returning a fresh (async)
+    iterator, and apply all of this to the time to the first item only, since
+    a stream cannot be replayed once it has been consumed.
+
+    Failed attempts are retried with full-jitter exponential backoff when
+    ``retryable(exc)`` is true, up to ``max_attempts`` and as long as the
+    retry budget allows. With hedging on, an attempt still running after the
+    p95 of recent latencies gets a duplicate; whichever finishes first wins.
+    Only use hedging for idempotent calls. A per-call ``timeout`` overrides
+    the backend's; 0 means no limit.
+
+    Sync attempts run on the backend's own pool of ``max_threads`` threads.
+    A thread cannot be stopped, so an attempt that times out or loses a hedge
+    keeps its thread until it returns; with a pool per backend, one hanging
+    service cannot starve the others. Settings can be overridden by
+    ``<NAME>_BACKEND_*`` environment variables (e.g. NLS_BACKEND_TIMEOUT).
+    """
+
+    def __init__(self, name, timeout=30, max_attempts=3, base_delay=0.2, max_delay=5,
+                 hedge=False, hedge_quantile=0.95, hedge_min_samples=20, hedge_min_delay=0.05,
+                 failure_threshold=5, reset_seconds=30, retry_ratio=0.2, retryable=transient_error,
+                 max_threads=None):
+        prefix = f"{name.upper()}_BACKEND"
+        self.name = name
+        self.timeout = float(os.getenv(f'{prefix}_TIMEOUT', timeout))
+        self.max_attempts = int(os.getenv(f'{prefix}_MAX_ATTEMPTS', max_attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = os.getenv(f'{prefix}_HEDGE', str(hedge)).lower() == 'true'
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.retryable = retryable
+        self.breaker = CircuitBreaker(int(os.getenv(f'{prefix}_FAILURE_THRESHOLD', failure_threshold)),
+                                      float(os.getenv(f'{prefix}_RESET_SECONDS', reset_seconds)))
+        self.budget = RetryBudget(float(os.getenv(f'{prefix}_RETRY_RATIO', retry_ratio)))
+        self.max_threads = int(os.getenv(f'{prefix}_MAX_THREADS', max_threads or RESILIENCE_THREADS))
+        # Attempts are only submitted once a slot is free, so they never queue behind stragglers
+        self._threads = threading.BoundedSemaphore(self.max_threads)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix=f'{name}-call')
+        self.threads_busy = 0
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=200)
+        self._hedge_delay = None
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.retries_denied = 0
+        self.timeouts = 0
+        self.short_circuited = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def hedge_delay(self):
+        """Seconds after which a slow attempt is hedged, or None (hedging off or too few samples)."""
+        return self._hedge_delay if self.hedge else None
+
+    def call(self, fn, *args, hedge=True, timeout=None, discard=None, **kwargs):
+        """Call fn with retries; ``discard(result)`` cleans up the result of a losing hedge."""
+        probe = self._admit()
+        settled = False
+        try:
+            attempt = 0
+            while True:
+                attempt += 1
+                start = time.perf_counter()
+                try:
+                    result = self._attempt(fn, args, kwargs, hedge, timeout, discard)
+                except Exception as e:
+                    delay = self._after_failure(e, attempt)
+                    settled = True
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    continue
+                self._after_success(time.perf_counter() - start)
+                settled = True
+                return result
+        finally:
+            # A probe interrupted before any outcome (e.g. KeyboardInterrupt) must not hold the circuit
+            if probe and not settled:
+                self.breaker.release()
+
+    async def acall(self, fn, *args, hedge=True, timeout=None, discard=None, **kwargs):
+        """Async variant of call."""
+        probe = self._admit()
+        settled = False
+        try:
+            attempt = 0
+            while True:
+                attempt += 1
+                start = time.perf_counter()
+                try:
+                    result = await self._aattempt(fn, args, kwargs, hedge, timeout, discard)
+                except Exception as e:
+                    delay = self._after_failure(e, attempt)
+                    settled = True
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    continue
+                self._after_success(time.perf_counter() - start)
+                settled = True
+                return result
+        finally:
+            # A probe cancelled before any outcome (e.g. the client went away) must not hold the circuit
+            if probe and not settled:
+                self.breaker.release()
+
+    def stream(self, factory, hedge=True, timeout=None):
+        iterator, first = self.call(_first_item, factory, hedge=hedge, timeout=timeout, discard=_close_stream)
+        if first is _END:
+            return
+        try:
+            yield first
+            yield from iterator
+        finally:
+            _close_stream((iterator, first))
+
+    async def astream(self, factory, hedge=True, timeout=None):
+        iterator, first = await self.acall(_afirst_item, factory, hedge=hedge, timeout=timeout,
+                                           discard=_aclose_stream)
+        if first is _END:
+            return
+        try:
+            yield first
+            async for item in iterator:
+                yield item
+        finally:
+            await _aclose_stream((iterator, first))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': self.name,
+                'state': self.breaker.state,
+                'circuit_open': int(self.breaker.state != 'closed'),
+                'circuit_opened': self.breaker.opened,
+                'calls': self.calls,
+                'failures': self.failures,
+                'retries': self.retries,
+                'retries_denied': self.retries_denied,
+                'timeouts': self.timeouts,
+                'short_circuited': self.short_circuited,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'hedge_win_rate': self.hedge_wins / self.hedges if self.hedges else 0.0,
+                'hedge_delay_seconds': self.hedge_delay() or 0.0,
+                'threads_busy': self.threads_busy,
+            }
+
+    def _admit(self):
+        """Count a new call; returns True if it is the half-open probe."""
+        admitted = self.breaker.admit()
+        if admitted is None:
+            with self._lock:
+                self.short_circuited += 1
+            raise CircuitOpenError(self.name, self.breaker.retry_in())
+        self.budget.deposit()
+        with self._lock:
+            self.calls += 1
+        return admitted == 'probe'
+
+    def _after_success(self, seconds):
+        self.breaker.record_success()
+        with self._lock:
+            self._latencies.append(seconds)
+            # Re-estimate the hedge delay every few samples rather than per call
+            if len(self._latencies) >= self.hedge_min_samples and len(self._latencies) % 10 == 0:
+                ordered = sorted(self._latencies)
+                quantile = ordered[min(len(ordered) - 1, int(self.hedge_quantile * len(ordered)))]
+                self._hedge_delay = max(self.hedge_min_delay, quantile)
+
+    def _after_failure(self, exc, attempt):
+        """Record a failed attempt; return the backoff before retrying, or None to give up."""
+        transient = isinstance(exc, CallTimeout) or self.retryable(exc)
+        with self._lock:
+            self.failures += 1
+            if isinstance(exc, CallTimeout):
+                self.timeouts += 1
+        if not transient:
+            # The backend answered (e.g. a 400), so it is up
+            self.breaker.record_success()
+            return None
+        self.breaker.record_failure()
+        # Once the circuit has opened there is no point retrying
+        if attempt >= self.max_attempts or self.breaker.state != 'closed':
+            return None
+        if not self.budget.withdraw():
+            with self._lock:
+                self.retries_denied += 1
+            return None
+        with self._lock:
+            self.retries += 1
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def _try_hedge(self):
+        if not self.budget.withdraw():
+            return False
+        with self._lock:
+            self.hedges += 1
+        return True
+
+    def _hedge_won(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def _deadline(self, start, timeout):
+        timeout = self.timeout if timeout is None else timeout
+        return start + timeout if timeout else None
+
+    def _wake_in(self, deadline, hedge_at):
+        """Seconds until the deadline or the hedge, whichever is first (None: no limit)."""
+        wake = min(t for t in (deadline, hedge_at, float('inf')) if t is not None)
+        return None if wake == float('inf') else max(0.0, wake - time.perf_counter())
+
+    def _timed_out(self, deadline):
+        return deadline is not None and time.perf_counter() >= deadline
+
+    def _submit(self, fn, args, kwargs, deadline, block=True):
+        """Run fn on this backend's pool; None if no thread frees up before the deadline."""
+        if not block:
+            acquired = self._threads.acquire(blocking=False)
+        else:
+            wait_for = None if deadline is None else max(0.0, deadline - time.perf_counter())
+            acquired = self._threads.acquire(timeout=wait_for) if wait_for is not None else self._threads.acquire()
+        if not acquired:
+            return None
+        with self._lock:
+            self.threads_busy += 1
+        # Each attempt runs in a copy of the caller's context so tracing spans nest
+        future = self._executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        future.add_done_callback(self._thread_done)
+        return future
+
+    def _thread_done(self, future):
+        with self._lock:
+            self.threads_busy -= 1
+        self._threads.release()
+
+    def _attempt(self, fn, args, kwargs, hedge, timeout, discard):
+        start = time.perf_counter()
+        deadline = self._deadline(start, timeout)
+        delay = self.hedge_delay() if hedge else None
+        hedge_at = start + delay if delay is not None else None
+        primary = self._submit(fn, args, kwargs, deadline)
+        if primary is None:
+            raise CallTimeout(f"{self.name} has all {self.max_threads} threads busy")
+        pending, hedged, error = {primary}, None, None
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=self._wake_in(deadline, hedge_at),
+                                     return_when=FIRST_COMPLETED)
+                winner = None
+                for future in done:
+                    if future.exception() is not None:
+                        error = future.exception()
+                    elif winner is None:
+                        winner = future
+                    elif discard is not None:
+                        discard(future.result())
+                if winner is not None:
+                    if winner is hedged:
+                        self._hedge_won()
+                    return winner.result()
+                if not pending:
+                    break
+                if self._timed_out(deadline):
+                    raise CallTimeout(f"{self.name} did not respond within {deadline - start:.1f} s")
+                if hedge_at is not None and time.perf_counter() >= hedge_at:
+                    hedge_at = None
+                    if self._try_hedge():
+                        # A hedge never waits for a thread
+                        hedged = self._submit(fn, args, kwargs, deadline, block=False)
+                        if hedged is not None:
+                            pending.add(hedged)
+            raise error
+        finally:
+            # Losing and timed-out attempts that have not started are cancelled; running ones
+            # keep their thread until they return, and their results are cleaned up then
+            for future in pending:
+                if not future.cancel() and discard is not None:
+                    future.add_done_callback(lambda f: f.exception() is None and discard(f.result()))
+
+    async def _aattempt(self, fn, args, kwargs, hedge, timeout, discard):
+        start = time.perf_counter()
+        deadline = self._deadline(start, timeout)
+        delay = self.hedge_delay() if hedge else None
+        hedge_at = start + delay if delay is not None else None
+        primary = asyncio.ensure_future(fn(*args, **kwargs))
+        pending, hedged, error = {primary}, None, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=self._wake_in(deadline, hedge_at),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                winner = None
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif winner is None:
+                        winner = task
+                    elif discard is not None:
+                        await discard(task.result())
+                if winner is not None:
+                    if winner is hedged:
+                        self._hedge_won()
+                    return winner.result()
+                if not pending:
+                    break
+                if self._timed_out(deadline):
+                    raise CallTimeout(f"{self.name} did not respond within {deadline - start:.1f} s")
+                if hedge_at is not None and time.perf_counter() >= hedge_at:
+                    hedge_at = None
+                    if self._try_hedge():
+                        hedged = asyncio.ensure_future(fn(*args, **kwargs))
+                        pending.add(hedged)
+            raise error
+        finally:
+            # Losing and timed-out attempts are cancelled
+            for task in pending:
+                task.cancel()
+
+
+def _first_item(factory):
+    iterator = iter(factory())
+    return iterator, next(iterator, _END)
+
+
+def _close_stream(opened):
+    close = getattr(opened[0], 'close', None)
+    if close is not None:
+        close()
+
+
+async def _afirst_item(factory):
+    iterator = factory().__aiter__()
+    try:
+        first = await iterator.__anext__()
+    except StopAsyncIteration:
+        first = _END
+    except asyncio.CancelledError:
+        await _aclose_stream((iterator, None))
+        raise
+    return iterator, first
+
+
+async def _aclose_stream(opened):
+    close = getattr(opened[0], 'aclose', None)
+    if close is not None:
+        await close()
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name, **defaults):
+    """The process-wide Backend for a service, created with ``defaults`` on first use."""
+    with _backends_lock:
+        backend = _backends.get(name)
+        if backend is None:
+            backend = _backends[name] = Backend(name, **defaults)
+        return backend
+
+
+def backend_stats():
+    with _backends_lock:
+        backends = list(_backends.values())
+    return [backend.stats() for backend in backends]
+
+
+register_collector('backend', backend_stats)
@@ -0,0 +1,105 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from disk_cache import DiskCache
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+class TieredCache:
+    """Result cache with an in-memory LRU in front of a DiskCache.
+
+    Values are strings. Lookups try memory first, then disk, and disk hits
+    are promoted to memory. Both tiers honour the same TTL, counted from when
+    the result was stored, and are capped in size: memory by entry count,
+    disk by bytes. Settings come from ``<NAME>_CACHE_*`` environment
+    variables (e.g. ASR_CACHE_TTL), falling back to the arguments.
+    """
+
+    def __init__(self, name, path=None, memory_entries=1024, max_bytes=64 * 1024 * 1024,
+                 ttl=7 * 24 * 3600):
+        prefix = f"{name.upper()}_CACHE"
+        self.name = name
+        self.enabled = os.getenv(f'{prefix}_ENABLED', 'true').lower() == 'true'
+        self.memory_entries = int(os.getenv(f'{prefix}_MEMORY_ENTRIES', memory_entries))
+        self.ttl = float(os.getenv(f'{prefix}_TTL', ttl))
+        self._path = path or os.getenv(f'{prefix}_PATH', os.path.join('.cache', f'{name}.sqlite'))
+        self._max_bytes = int(os.getenv(f'{prefix}_MAX_BYTES', max_bytes))
+        self._disk = None
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (value, created)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    @property
+    def disk(self):
+        # Opened on first use so importing a module with a cache stays cheap
+        if self._disk is None:
+            with self._lock:
+                if self._disk is None:
+                    self._disk = DiskCache(self._path, max_bytes=self._max_bytes, ttl=self.ttl)
+        return self._disk
+
+    def get(self, key):
+        """Return the cached value for key, or None."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[1] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[0]
+                del self._memory[key]
+
+        raw = self.disk.get(key)
+        if raw is not None:
+            record = json.loads(raw.decode('utf-8'))
+            if now - record['created'] <= self.ttl:
+                with self._lock:
+                    self._remember(key, record['value'], record['created'])
+                    self.disk_hits += 1
+                return record['value']
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        created = time.time()
+        record = json.dumps({'value': value, 'created': created}, ensure_ascii=False)
+        self.disk.set(key, record.encode('utf-8'))
+        with self._lock:
+            self._remember(key, value, created)
+            self.stores += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                'stores': self.stores,
+                'memory_entries': len(self._memory),
+                'disk_bytes': self._disk.total_bytes if self._disk is not None else 0,
+            }
+
+    def _remember(self, key, value, created):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+class LazyService:
+    """A backend client created on first use.
+
+    Creation happens at most once; a failed attempt is not cached, so the
+    next call tries again. ``warm`` is optional extra work (e.g. fetching a
+    token) done only by the background warm-up.
+    """
+
+    def __init__(self, name, factory, warm=None):
+        self.name = name
+        self._factory = factory
+        self._warm = warm
+        self._instance = None
+        self._lock = threading.Lock()
+        self.state = 'pending'
+        self.warmed = False
+        self.error = None
+        self.init_seconds = None
+
+    def get(self):
+        if self._instance is not None:
+            return self._instance
+        with self._lock:
+            if self._instance is None:
+                self.state = 'initializing'
+                start_time = time.perf_counter()
+                try:
+                    instance = self._factory()
+                except Exception as e:
+                    self.state = 'error'
+                    self.error = str(e)
+                    raise
+                self.init_seconds = time.perf_counter() - start_time
+                self.error = None
+                self.state = 'ready'
+                self._instance = instance
+                print(f"{self.name} initialized in {self.init_seconds:.2f} s")
+        return self._instance
+
+    def warm_up(self):
+        instance = self.get()
+        if not self.warmed:
+            if self._warm is not None:
+                self._warm(instance)
+            self.warmed = True
+        return instance
+
+    def status(self):
+        return {
+            'name': self.name,
+            'state': self.state,
+            'warmed': self.warmed,
+            'init_seconds': self.init_seconds,
+            'error': self.error,
+        }
+
+
+def _create_solver():
+    from llm_service import LLMService
+    return LLMService()
+
+
+def _create_nls_client():
+    from intelligent_speech import IntelligentSpeech
+    return IntelligentSpeech()
+
+
+def _create_job_queue():
+    from ingest_jobs import IngestJobQueue
+    from tracing import register_collector
+    # Workers create the LLMService when they pick up their first job
+    job_queue = IngestJobQueue(get_solver).start()
+    register_collector('ingest_jobs', job_queue.stats)
+    return job_queue
+
+
+solver_service = LazyService('llm_service', _create_solver)
+nls_service = LazyService('intelligent_speech', _create_nls_client, warm=lambda client: client.obtain_token())
+SERVICES = (solver_service, nls_service)
+# Not part of readiness: it only runs background uploads
+job_queue_service = LazyService('ingest_jobs', _create_job_queue)
+
+_started = time.time()
+_warm_up_thread = None
+
+
+def get_solver():
+    return solver_service.get()
+
+
+def get_nls_client():
+    return nls_service.get()
+
+
+def get_job_queue():
+    return job_queue_service.get()
+
+
+def warm_up_enabled():
+    return os.getenv('WARM_UP', 'true').lower() == 'true'
+
+
+def start_warm_up(retry_seconds=None, max_retry_seconds=60):
+    """Create and warm all services on a background thread.
+
+    Failures (e.g. a backend that is briefly down) are retried with
+    exponential backoff until they succeed; requests arriving meanwhile
+    initialize services on demand.
+    """
+    global _warm_up_thread
+    if _warm_up_thread is not None:
+        return _warm_up_thread
+    retry_seconds = float(retry_seconds or os.getenv('WARM_UP_RETRY_SECONDS', 2))
+
+    def run():
+        for service in SERVICES:
+            delay = retry_seconds
+            while True:
+                try:
+                    service.warm_up()
+                    break
+                except Exception as e:
+                    print(f"Warm-up of {service.name} failed: {e}; retrying in {delay:.1f} s")
+                    time.sleep(delay)
+                    delay = min(2 * delay, max_retry_seconds)
+        print(f"Warm-up finished {time.time() - _started:.2f} s after startup")
+
+    _warm_up_thread = threading.Thread(target=run, name='warm-up', daemon=True)
+    _warm_up_thread.start()
+    return _warm_up_thread
+
+
+def readiness():
+    """Readiness report: with warm-up enabled, ready once every service is warm."""
+    statuses = [service.status() for service in SERVICES]
+    ready = all(status['warmed'] for status in statuses) if warm_up_enabled() else True
+    return {
+        'ready': ready,
+        'warm_up': warm_up_enabled(),
+        'uptime_seconds': time.time() - _started,
+        'services': statuses,
+    }
@@ -0,0 +1,85 @@
+import hashlib
+import os
+import threading
+from collections import Counter
+
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+class StagingDirectory:
+    """Bounded local directory of content-addressed file copies.
+
+    Files are stored as ``<sha256><ext>`` so a repeated upload reuses the
+    existing copy. When the directory grows past ``max_bytes`` or
+    ``max_files`` the least recently used files are evicted. A staged file
+    is in use until ``release`` is called for it, and files in use are never
+    evicted, so another thread's upload cannot lose the copy it is reading.
+    """
+
+    def __init__(self, path, max_bytes=None, max_files=None):
+        self.path = path
+        self.max_bytes = int(max_bytes or os.getenv('STAGING_MAX_BYTES', 512 * 1024 * 1024))
+        self.max_files = int(max_files or os.getenv('STAGING_MAX_FILES', 1000))
+        self._lock = threading.Lock()
+        self._in_use = Counter()  # staged path -> callers that have not released it yet
+        os.makedirs(path, exist_ok=True)
+
+    def stage(self, source_path):
+        """Copy source_path into the directory and return (staged_path, sha256), in use."""
+        extension = os.path.splitext(source_path)[1].lower()
+        digest = hashlib.sha256()
+        tmp_path = os.path.join(self.path, f".staging-{threading.get_ident()}{extension}")
+        with open(source_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            for block in iter(lambda: src.read(1024 * 1024), b''):
+                digest.update(block)
+                dst.write(block)
+        return self._commit(tmp_path, digest.hexdigest(), extension)
+
+    def stage_bytes(self, data, extension):
+        """Write in-memory file content into the directory; return (staged_path, sha256), in use."""
+        tmp_path = os.path.join(self.path, f".staging-{threading.get_ident()}{extension}")
+        with open(tmp_path, 'wb') as dst:
+            dst.write(data)
+        return self._commit(tmp_path, hashlib.sha256(data).hexdigest(), extension)
+
+    def release(self, staged_path):
+        """Mark a staged file as no longer in use, so it can be evicted."""
+        with self._lock:
+            self._in_use[staged_path] -= 1
+            if self._in_use[staged_path] <= 0:
+                del self._in_use[staged_path]
+
+    def _commit(self, tmp_path, content_hash, extension):
+        staged_path = os.path.join(self.path, content_hash + extension)
+        with self._lock:
+            if os.path.exists(staged_path):
+                os.remove(tmp_path)
+                os.utime(staged_path)  # Mark as recently used
+            else:
+                os.replace(tmp_path, staged_path)
+            self._in_use[staged_path] += 1
+            self._evict()
+        return staged_path, content_hash
+
+    def _evict(self):
+        entries = []
+        total_bytes = 0
+        for entry in os.scandir(self.path):
+            if entry.is_file() and not entry.name.startswith('.staging-'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_bytes += stat.st_size
+
+        entries.sort()  # Oldest first
+        while entries and (total_bytes > self.max_bytes or len(entries) > self.max_files):
+            _, size, path = entries.pop(0)
+            if path in self._in_use:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
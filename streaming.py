@@ -0,0 +1,33 @@
+import time
+
+from tracing import observe
+
+
+class StreamStats:
+    """Time-to-first-token and throughput of one streamed generation.
+
+    Each streamed chunk is counted as one token; DashScope streams roughly one
+    token per chunk, which is close enough for latency tracking.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.start = time.perf_counter()
+        self.first_token = None
+        self.tokens = 0
+        self.elapsed = 0.0
+
+    def observe(self, text):
+        if self.first_token is None:
+            self.first_token = time.perf_counter() - self.start
+        self.tokens += 1
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.start
+        ttft = self.first_token if self.first_token is not None else self.elapsed
+        generation = self.elapsed - ttft
+        rate = (self.tokens - 1) / generation if self.tokens > 1 and generation > 0 else 0.0
+        observe(f"{self.label}.first_token", ttft)
+        print(f"{self.label}: time to first token {1000 * ttft:.0f} ms, "
+              f"{self.tokens} tokens in {self.elapsed:.2f} s ({rate:.1f} tokens/s)")
+        return self
@@ -0,0 +1,254 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# TRACING=false turns spans into no-ops and @traced into the identity
+ENABLED = os.getenv('TRACING', 'true').lower() == 'true'
+# Optional JSONL file with one line per request (root span) and its child spans
+TRACE_LOG = os.getenv('TRACE_LOG', '')
+METRIC_PREFIX = 'multimodal'
+
+# Prometheus' default latency buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Histogram:
+    """Cumulative latency histogram per stage, in the Prometheus layout."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counts = defaultdict(lambda: [0] * (len(buckets) + 1))
+        self._sums = defaultdict(float)
+
+    def observe(self, stage, seconds):
+        index = 0
+        while index < len(self.buckets) and seconds > self.buckets[index]:
+            index += 1
+        with self._lock:
+            self._counts[stage][index] += 1
+            self._sums[stage] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {stage: (list(counts), self._sums[stage]) for stage, counts in self._counts.items()}
+
+
+class Counter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = defaultdict(int)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+
+latency = Histogram()
+errors = Counter()
+_collectors = {}
+_trace_log_lock = threading.Lock()
+
+
+class Trace:
+    """The spans of one request; written to TRACE_LOG when the root span ends."""
+
+    __slots__ = ('trace_id', 'started', 'spans')
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.started = time.time()
+        self.spans = []
+
+    def add(self, span):
+        self.spans.append(span)
+
+    def finish(self, root):
+        record = {
+            'trace_id': self.trace_id,
+            'name': root.name,
+            'start': self.started,
+            'duration': root.duration,
+            'error': root.error,
+            'attributes': root.attributes,
+            'spans': [{
+                'name': span.name,
+                'parent': span.parent.name if span.parent is not None else None,
+                'offset': span.start - root.start,
+                'duration': span.duration,
+                'error': span.error,
+                'attributes': span.attributes,
+            } for span in self.spans if span is not root],
+        }
+        line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+        with _trace_log_lock:
+            os.makedirs(os.path.dirname(TRACE_LOG) or '.', exist_ok=True)
+            with open(TRACE_LOG, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+
+class Span:
+    """A timed stage. Nested spans share their root's trace.
+
+    The latency goes into the stage histogram; an exception escaping the span
+    is counted per stage and exception type, and re-raised.
+    """
+
+    __slots__ = ('name', 'attributes', 'trace', 'parent', 'start', 'duration', 'error')
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.error = None
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        # Spans are only collected per request when they are logged
+        self.trace = self.parent.trace if self.parent is not None else (Trace() if TRACE_LOG else None)
+        self.start = time.perf_counter()
+        _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        # set() rather than a token reset: generators may resume in another context
+        _current_span.set(self.parent)
+        if exc_type is not None and issubclass(exc_type, Exception):
+            self.error = exc_type.__name__
+            errors.inc(self.name, self.error)
+        latency.observe(self.name, self.duration)
+        if self.trace is not None:
+            self.trace.add(self)
+            if self.parent is None:
+                self.trace.finish(self)
+        return False
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name, **attributes):
+    """Context manager timing one stage: ``with span('vector_search', k=3): ...``"""
+    if not ENABLED:
+        return _NOOP
+    return Span(name, attributes)
+
+
+def traced(name):
+    """Decorator wrapping a function, coroutine or (async) generator in a span.
+
+    Generators are timed from the first item to exhaustion, so a streamed
+    answer counts as one stage.
+    """
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with Span(name, {}):
+                    async for item in fn(*args, **kwargs):
+                        yield item
+        elif inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with Span(name, {}):
+                    return await fn(*args, **kwargs)
+        elif inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with Span(name, {}):
+                    yield from fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with Span(name, {}):
+                    return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def observe(name, seconds):
+    """Record a latency measured elsewhere (e.g. time to first token)."""
+    if ENABLED:
+        latency.observe(name, seconds)
+
+
+def register_collector(name, collect):
+    """Export the numeric values of ``collect()`` (a stats() dict, or a list of
+    them) as gauges named ``multimodal_<name>_<key>``; string values become labels."""
+    _collectors[name] = collect
+
+
+def _label(value):
+    # Label values are quoted; backslash, double quote and line feed must be escaped
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_metrics():
+    """Prometheus text exposition of the stage metrics and registered stats."""
+    lines = [
+        f"# HELP {METRIC_PREFIX}_stage_latency_seconds Latency of traced stages.",
+        f"# TYPE {METRIC_PREFIX}_stage_latency_seconds histogram",
+    ]
+    for stage, (counts, total) in sorted(latency.snapshot().items()):
+        cumulative = 0
+        for bound, count in zip(latency.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{METRIC_PREFIX}_stage_latency_seconds_bucket{{stage="{_label(stage)}",le="{le}"}} {cumulative}')
+        lines.append(f'{METRIC_PREFIX}_stage_latency_seconds_sum{{stage="{_label(stage)}"}} {total}')
+        lines.append(f'{METRIC_PREFIX}_stage_latency_seconds_count{{stage="{_label(stage)}"}} {cumulative}')
+
+    lines += [
+        f"# HELP {METRIC_PREFIX}_stage_errors_total Exceptions raised by traced stages.",
+        f"# TYPE {METRIC_PREFIX}_stage_errors_total counter",
+    ]
+    for (stage, error), count in sorted(errors.snapshot().items()):
+        lines.append(f'{METRIC_PREFIX}_stage_errors_total{{stage="{_label(stage)}",error="{_label(error)}"}} {count}')
+
+    for name, collect in sorted(_collectors.items()):
+        try:
+            stats = collect()
+        except Exception as e:
+            print(f"Metrics collector {name} failed: {e}")
+            continue
+        for entry in stats if isinstance(stats, list) else [stats]:
+            labels = ','.join(f'{key}="{_label(value)}"' for key, value in entry.items() if isinstance(value, str))
+            for key, value in entry.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    metric = f"{METRIC_PREFIX}_{name}_{key}"
+                    lines.append(f"{metric}{{{labels}}} {value}" if labels else f"{metric} {value}")
+    return '\n'.join(lines) + '\n'